@@ -0,0 +1,205 @@
+# Copyright (c) 2014-2017 esotericnonsense (Daniel Edgecumbe)
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or https://opensource.org/licenses/mit-license.php
+
+import functools
+import hashlib
+
+# getblockchaininfo "chain" -> (P2PKH version, P2SH version, bech32 hrp)
+CHAIN_PARAMS = {
+    "main": (0x00, 0x05, "bc"),
+    "test": (0x6f, 0xc4, "tb"),
+    "testnet4": (0x6f, 0xc4, "tb"),
+    "signet": (0x6f, 0xc4, "tb"),
+    "regtest": (0x6f, 0xc4, "bcrt"),
+}
+DEFAULT_CHAIN = "main"
+
+OP_0 = 0x00
+OP_PUSHDATA1, OP_PUSHDATA2, OP_PUSHDATA4 = 0x4c, 0x4d, 0x4e
+OP_1, OP_16 = 0x51, 0x60
+OP_RETURN = 0x6a
+OP_DUP, OP_EQUAL, OP_EQUALVERIFY, OP_HASH160 = 0x76, 0x87, 0x88, 0xa9
+OP_CHECKSIG, OP_CHECKMULTISIG = 0xac, 0xae
+
+# Types as named by Bitcoin Core.
+PUBKEY = "pubkey"
+PUBKEYHASH = "pubkeyhash"
+SCRIPTHASH = "scripthash"
+MULTISIG = "multisig"
+NULLDATA = "nulldata"
+WITNESS_V0_KEYHASH = "witness_v0_keyhash"
+WITNESS_V0_SCRIPTHASH = "witness_v0_scripthash"
+WITNESS_V1_TAPROOT = "witness_v1_taproot"
+WITNESS_UNKNOWN = "witness_unknown"
+NONSTANDARD = "nonstandard"
+
+BASE58_ALPHABET = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+BECH32_ALPHABET = "qpzry9x8gf2tvdw0s3jn54khce6mua7l"
+BECH32_CONST, BECH32M_CONST = 1, 0x2bc830a3
+
+try:
+    hashlib.new("ripemd160")
+    HAVE_RIPEMD160 = True
+except ValueError:
+    # Some OpenSSL 3 builds leave it out; bare pubkeys then go unnamed.
+    HAVE_RIPEMD160 = False
+
+
+def base58check(payload):
+    payload += hashlib.sha256(hashlib.sha256(payload).digest()).digest()[:4]
+    n = int.from_bytes(payload, "big")
+    chars = []
+    while n:
+        n, r = divmod(n, 58)
+        chars.append(BASE58_ALPHABET[r])
+
+    zeros = len(payload) - len(payload.lstrip(b"\0"))
+    return "1" * zeros + "".join(reversed(chars))
+
+
+def _bech32_polymod(values):
+    generator = [0x3b6a57b2, 0x26508e6d, 0x1ea119fa, 0x3d4233dd, 0x2a1462b3]
+    chk = 1
+    for value in values:
+        top = chk >> 25
+        chk = (chk & 0x1ffffff) << 5 ^ value
+        for i in range(5):
+            chk ^= generator[i] if ((top >> i) & 1) else 0
+    return chk
+
+
+def segwit_address(hrp, version, program):
+    """ BIP 173 (bech32) for version 0, BIP 350 (bech32m) after. """
+    data = [version]
+    acc, bits = 0, 0
+    for byte in program:
+        acc = (acc << 8) | byte
+        bits += 8
+        while bits >= 5:
+            bits -= 5
+            data.append((acc >> bits) & 31)
+    if bits:
+        data.append((acc << (5 - bits)) & 31)
+
+    const = BECH32_CONST if version == 0 else BECH32M_CONST
+    expanded = [ord(c) >> 5 for c in hrp] + [0] + [ord(c) & 31 for c in hrp]
+    polymod = _bech32_polymod(expanded + data + [0] * 6) ^ const
+    checksum = [(polymod >> 5 * (5 - i)) & 31 for i in range(6)]
+
+    return hrp + "1" + "".join(BECH32_ALPHABET[d] for d in data + checksum)
+
+
+def _pushes(script):
+    """ The data pushed by a push-only script, or None if it isn't one. """
+    pushes = []
+    pos = 0
+    while pos < len(script):
+        op = script[pos]
+        pos += 1
+        if op <= OP_PUSHDATA4:
+            if op < OP_PUSHDATA1:
+                n = op
+            else:
+                size = {OP_PUSHDATA1: 1, OP_PUSHDATA2: 2, OP_PUSHDATA4: 4}[op]
+                n = int.from_bytes(script[pos:pos+size], "little")
+                pos += size
+            if pos + n > len(script):
+                return None
+            pushes.append(script[pos:pos+n])
+            pos += n
+        elif OP_1 <= op <= OP_16 or op == 0x4f:
+            pushes.append(op)
+        else:
+            return None
+
+    return pushes
+
+
+def _small_int(op):
+    return op - OP_1 + 1 if isinstance(op, int) and OP_1 <= op <= OP_16 else None
+
+
+def classify(script):
+    """
+    (type, address or None, detail) for a scriptPubKey given as bytes,
+    with chain-independent address parts: the address is returned as
+    (kind, payload), kind being "base58p2pkh", "base58p2sh" or a
+    witness version.
+    """
+    n = len(script)
+    if (n == 25 and script[0] == OP_DUP and script[1] == OP_HASH160 and script[2] == 20 and
+            script[23] == OP_EQUALVERIFY and script[24] == OP_CHECKSIG):
+        return PUBKEYHASH, ("base58p2pkh", script[3:23]), None
+
+    if n == 23 and script[0] == OP_HASH160 and script[1] == 20 and script[22] == OP_EQUAL:
+        return SCRIPTHASH, ("base58p2sh", script[2:22]), None
+
+    if 4 <= n <= 42 and (script[0] == OP_0 or OP_1 <= script[0] <= OP_16) and script[1] == n - 2:
+        version = 0 if script[0] == OP_0 else script[0] - OP_1 + 1
+        program = script[2:]
+        if version == 0:
+            if len(program) == 20:
+                return WITNESS_V0_KEYHASH, (0, program), None
+            if len(program) == 32:
+                return WITNESS_V0_SCRIPTHASH, (0, program), None
+            return NONSTANDARD, None, None
+        if version == 1 and len(program) == 32:
+            return WITNESS_V1_TAPROOT, (1, program), None
+        return WITNESS_UNKNOWN, (version, program), None
+
+    if n and script[0] == OP_RETURN:
+        return NULLDATA, None, n - 1
+
+    if n in (35, 67) and script[0] == n - 2 and script[-1] == OP_CHECKSIG:
+        pubkey = script[1:-1]
+        if HAVE_RIPEMD160:
+            h = hashlib.new("ripemd160", hashlib.sha256(pubkey).digest()).digest()
+            return PUBKEY, ("base58p2pkh", h), None
+        return PUBKEY, None, None
+
+    if n and script[-1] == OP_CHECKMULTISIG:
+        pushes = _pushes(script[:-1])
+        if pushes and len(pushes) >= 3:
+            required, total = _small_int(pushes[0]), _small_int(pushes[-1])
+            keys = pushes[1:-1]
+            if (required and total == len(keys) and required <= total and
+                    all(isinstance(key, bytes) and len(key) in (33, 65) for key in keys)):
+                return MULTISIG, None, (required, total)
+
+    return NONSTANDARD, None, None
+
+
+def encode_address(address, chain):
+    kind, payload = address
+    p2pkh, p2sh, hrp = CHAIN_PARAMS.get(chain, CHAIN_PARAMS[DEFAULT_CHAIN])
+    if kind == "base58p2pkh":
+        return base58check(bytes([p2pkh]) + payload)
+    if kind == "base58p2sh":
+        return base58check(bytes([p2sh]) + payload)
+    return segwit_address(hrp, kind, payload)
+
+
+@functools.lru_cache(maxsize=16384)
+def describe(script_hex, chain=DEFAULT_CHAIN):
+    """
+    (type, text) for a scriptPubKey in hex: text is the address where
+    there is one, or a short description of the script.
+    """
+    try:
+        script = bytes.fromhex(script_hex)
+    except ValueError:
+        return NONSTANDARD, "<bad script>"
+
+    kind, address, detail = classify(script)
+    if address is not None:
+        return kind, encode_address(address, chain)
+
+    if kind == NULLDATA:
+        return kind, "OP_RETURN <{} bytes>".format(detail)
+    if kind == MULTISIG:
+        return kind, "<{}-of-{} multisig>".format(*detail)
+    if kind == PUBKEY:
+        return kind, "<pubkey>"
+
+    return kind, "<{}>".format(kind)
@@ -9,12 +9,25 @@ import asyncio
 # from decimal import Decimal
 
 import view
+import primitives
+from rpc import RPCContentError
 from util import isoformatseconds
 
 
 class BlockStore(object):
-    def __init__(self, client):
+    """
+    Blocks by hash, as getblock JSON or, given a rest.RESTClient or a
+    blockfiles.BlockFiles, as primitives.Block objects parsed from the
+    raw block. The latter carry their transactions, so those needn't be
+    fetched one by one. Blocks missing from the block files, or not
+    served over REST, are fetched with getblock. Deep enough blocks are kept in the
+    chaincache.ChainCache, if given, for later sessions.
+    """
+    def __init__(self, client, rest=None, blockfiles=None, cache=None):
         self._client = client
+        self._rest = rest
+        self._blockfiles = blockfiles
+        self._cache = cache
 
         self._lock = asyncio.Lock()
 
@@ -26,13 +39,63 @@ class BlockStore(object):
             try:
                 return self._blocks[blockhash]
             except KeyError:
-                # TODO: handle error if the block doesn't exist at all.
-                j = await self._client.request("getblock", [blockhash])
-                self._blocks[blockhash] = j["result"]
-                return j["result"]
+                pass
+
+            block = await self._fetch_block(blockhash)
+            self._blocks[blockhash] = block
+            return block
+
+    async def _fetch_block(self, blockhash):
+        """ The block from the cache, block files, REST or RPC, in that order. """
+        if self._cache is not None:
+            block = await self._cache.get_block(blockhash)
+            if block is not None:
+                return block
+
+        block = None
+        if self._blockfiles is not None:
+            block = await self._blockfiles.get_block(blockhash)
+
+        if block is None and self._rest is not None:
+            try:
+                block = await self._rest.get_block(blockhash)
+            except RPCContentError:
+                # Not served over REST (pruned, say); try the RPC.
+                block = None
+
+        # TODO: handle error if the block doesn't exist at all.
+        if block is None:
+            j = await self._client.request("getblock", [blockhash])
+            block = j["result"]
+        else:
+            # The raw block doesn't know where it is in the chain.
+            j = await self._client.request("getblockheader", [blockhash])
+            block["height"] = j["result"]["height"]
+            if "nextblockhash" in j["result"]:
+                block["nextblockhash"] = j["result"]["nextblockhash"]
+
+        if self._cache is not None and self._cache.is_final(j["result"].get("confirmations", 0)):
+            await self._cache.put_block(block)
+
+        return block
+
+    def find_transaction(self, txid):
+        """ A transaction from a raw block already fetched, or None. """
+        for block in self._blocks.values():
+            if isinstance(block, primitives.Block):
+                try:
+                    return block.get_transaction(block["tx"].index(txid))
+                except ValueError:
+                    continue
+
+        return None
 
     async def get_blockhash(self, height):
-        # Direct RPC call.
+        if self._cache is not None:
+            blockhash = await self._cache.get_blockhash(height)
+            if blockhash is not None:
+                return blockhash
+
         j = await self._client.request("getblockhash", [height])
         return j["result"]
 
@@ -64,12 +127,7 @@ class BlockStore(object):
         if block["height"] < n:
             raise KeyError
 
-        j = await self._client.request("getblockhash", [block["height"] - n])
-
-        try:
-            return j["result"]
-        except KeyError:
-            raise
+        return await self.get_blockhash(block["height"] - n)
 
     async def get_nextblockhash_n(self, blockhash, n):
         if n <= 0:
@@ -90,12 +148,23 @@ class BlockStore(object):
         if bestblock["height"] - block["height"] < n:
             raise KeyError
 
-        j = await self._client.request("getblockhash", [block["height"] + n])
+        return await self._fetch_nextblockhash_n(blockhash, block["height"], n)
 
-        try:
-            return j["result"]
-        except KeyError:
-            raise
+    async def _fetch_nextblockhash_n(self, blockhash, height, n):
+        """ The hash n blocks after blockhash, at height, over REST or RPC. """
+        if self._rest is not None:
+            # The headers from blockhash on, up to n blocks ahead.
+            try:
+                headers = await self._rest.get_headers(n + 1, blockhash)
+            except RPCContentError:
+                headers = None
+
+            if headers is not None:
+                if len(headers) <= n:
+                    raise KeyError
+                return headers[n].hash
+
+        return await self.get_blockhash(height + n)
 
     async def on_bestblockhash(self, blockhash):
         with await self._lock:
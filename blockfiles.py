@@ -0,0 +1,263 @@
+# Copyright (c) 2014-2017 esotericnonsense (Daniel Edgecumbe)
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or https://opensource.org/licenses/mit-license.php
+
+import asyncio
+import collections
+import mmap
+import os
+import re
+import struct
+
+import primitives
+
+RECORD = struct.Struct("<4sI")  # network magic, block size
+XOR_KEY_SIZE = 8
+MAX_BLOCK_SIZE = 4000000  # serialized, witness included
+MAX_MAPS = 8  # files kept mapped
+SCAN_FILES = 2  # unscanned files a lookup reads before giving up
+
+FILENAME = re.compile(r"^blk(\d{5})\.dat$")
+
+# bitcoin.conf switch, -chain name and datadir subdirectory of each test chain.
+CHAIN_DIRS = [
+    ("regtest", "regtest", "regtest"),
+    ("testnet", "test", "testnet3"),
+    ("testnet4", "testnet4", "testnet4"),
+    ("signet", "signet", "signet"),
+]
+
+
+def get_blocksdir_from_datadir(datadir, cfg):
+    """ Where bitcoind keeps blk*.dat, going by bitcoin.conf (cfg) if there is one. """
+    if cfg is None:
+        cfg = {}
+
+    subdir = ""
+    chain = cfg.get("chain", "main")
+    for switch, name, dirname in CHAIN_DIRS:
+        if cfg.get(switch) == "1" or chain == name:
+            subdir = dirname
+            break
+
+    return os.path.join(os.path.expanduser(cfg.get("blocksdir", datadir)), subdir, "blocks")
+
+
+def deobfuscate(data, key, offset):
+    """ Undo the XOR of data read from offset in a file with this key. """
+    if not any(key):
+        return bytes(data)
+
+    phase = offset % len(key)
+    key = key[phase:] + key[:phase]
+    n = len(data)
+    stream = (key * (n // len(key) + 1))[:n]
+    return (int.from_bytes(data, "little") ^ int.from_bytes(stream, "little")).to_bytes(n, "little")
+
+
+class BlockFiles(object):
+    """
+    Blocks read straight from bitcoind's blk*.dat files, for when we run
+    on the same host as the node.
+
+    Each file is a run of records, the network magic and a size followed
+    by the serialized block, padded out with zeros. Since 28.0 the files
+    may be XORed with the key in xor.dat. The position of each block is
+    found by hashing the headers as the files are scanned; files are
+    scanned newest first, as recent blocks are the ones most often asked
+    for. The last file is rescanned from where it was left as the node
+    appends to it.
+
+    A lookup scans at most SCAN_FILES files not yet seen, so that a
+    block that isn't there (or is in a file far back) doesn't stall the
+    caller for a scan of every file; it comes back as None, to be
+    fetched some other way, and get_block starts indexing the remaining
+    files in the background, one at a time between lookups.
+
+    The files are read through mmap and the block is copied out, so that
+    a map can be closed (or the file pruned away) while the block is in
+    use. Blocks that aren't there, such as pruned ones, come back as None.
+    """
+    def __init__(self, blocksdir):
+        self._blocksdir = blocksdir
+        self._key = self._read_key()
+
+        self._lock = asyncio.Lock()
+
+        self._positions = {}  # hash -> (file number, offset, size)
+        self._scanned = {}  # file number -> offset scanned up to
+        self._newest = None  # the last file, when last looked
+        self._maps = collections.OrderedDict()  # file number -> (mmap, file size)
+        self._indexing = None  # the background scan of the older files
+
+    def _read_key(self):
+        try:
+            with open(os.path.join(self._blocksdir, "xor.dat"), "rb") as f:
+                key = f.read()
+        except FileNotFoundError:
+            return bytes(XOR_KEY_SIZE)
+
+        if len(key) != XOR_KEY_SIZE:
+            raise ValueError("xor.dat holds {} bytes, not {}".format(len(key), XOR_KEY_SIZE))
+
+        return key
+
+    def _filename(self, number):
+        return os.path.join(self._blocksdir, "blk{:05d}.dat".format(number))
+
+    def _file_numbers(self):
+        numbers = []
+        try:
+            for name in os.listdir(self._blocksdir):
+                match = FILENAME.match(name)
+                if match:
+                    numbers.append(int(match.group(1)))
+        except FileNotFoundError:
+            pass
+
+        return sorted(numbers)
+
+    def _map(self, number):
+        """ The file mapped in full, remapped if it has grown since. """
+        try:
+            size = os.path.getsize(self._filename(number))
+        except FileNotFoundError:
+            self._unmap(number)
+            return None, 0
+
+        try:
+            mm, mapped = self._maps[number]
+            if mapped == size:
+                self._maps.move_to_end(number)
+                return mm, size
+            self._unmap(number)
+        except KeyError:
+            pass
+
+        if not size:
+            return None, 0
+
+        with open(self._filename(number), "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self._maps[number] = (mm, size)
+        while len(self._maps) > MAX_MAPS:
+            _, (old, _) = self._maps.popitem(last=False)
+            old.close()
+
+        return mm, size
+
+    def _unmap(self, number):
+        try:
+            mm, _ = self._maps.pop(number)
+        except KeyError:
+            return
+        mm.close()
+
+    def _read(self, mm, offset, size):
+        return deobfuscate(mm[offset:offset+size], self._key, offset)
+
+    def _unscanned(self):
+        """ The numbers of the files never scanned, newest first. """
+        return [number for number in reversed(self._file_numbers()) if number not in self._scanned]
+
+    def _scan(self, number):
+        """ Index the records in a file from where the last scan stopped. """
+        mm, size = self._map(number)
+        if mm is None:
+            self._scanned.setdefault(number, 0)
+            return
+
+        offset = self._scanned.get(number, 0)
+        magic = None
+        while offset + RECORD.size + primitives.HEADER_SIZE <= size:
+            record_magic, length = RECORD.unpack(self._read(mm, offset, RECORD.size))
+            if not any(record_magic):
+                # The zeroed space bitcoind allocates ahead.
+                break
+            if magic is None:
+                magic = record_magic
+            elif record_magic != magic:
+                break
+
+            start = offset + RECORD.size
+            if length > MAX_BLOCK_SIZE or start + length > size:
+                # Not written out in full yet.
+                break
+
+            header = self._read(mm, start, primitives.HEADER_SIZE)
+            blockhash = primitives.hash_hex(primitives.sha256d(header))
+            self._positions[blockhash] = (number, start, length)
+            offset = start + length
+
+        self._scanned[number] = offset
+
+    def _find(self, blockhash):
+        try:
+            return self._positions[blockhash]
+        except KeyError:
+            pass
+
+        numbers = self._file_numbers()
+        if numbers:
+            # The newest file may have had blocks added, as may the one
+            # before it if the node has moved on since.
+            if self._newest is not None and self._newest != numbers[-1]:
+                self._scan(self._newest)
+            self._newest = numbers[-1]
+            self._scan(self._newest)
+
+        for number in self._unscanned()[:SCAN_FILES]:
+            if blockhash in self._positions:
+                break
+            self._scan(number)
+
+        return self._positions.get(blockhash)
+
+    def read_block(self, blockhash):
+        """ The block as a primitives.Block, or None if it isn't found. """
+        position = self._find(blockhash)
+        if position is None:
+            return None
+
+        number, offset, length = position
+        mm, size = self._map(number)
+        if mm is None or offset + length > size:
+            # Pruned since.
+            del self._positions[blockhash]
+            return None
+
+        try:
+            block = primitives.Block.parse(self._read(mm, offset, length))
+        except primitives.DeserializationError:
+            return None
+
+        if block.hash != blockhash:
+            return None
+
+        return block
+
+    async def _index(self):
+        """ Scan the files not yet scanned, newest first, a file per turn of the lock. """
+        loop = asyncio.get_event_loop()
+        try:
+            while True:
+                with await self._lock:
+                    numbers = self._unscanned()
+                    if not numbers:
+                        return
+                    await loop.run_in_executor(None, self._scan, numbers[0])
+        finally:
+            self._indexing = None
+
+    async def get_block(self, blockhash):
+        """ read_block, off the event loop. """
+        loop = asyncio.get_event_loop()
+        with await self._lock:
+            block = await loop.run_in_executor(None, self.read_block, blockhash)
+            unscanned = block is None and self._unscanned()
+
+        if unscanned and self._indexing is None:
+            self._indexing = asyncio.ensure_future(self._index())
+
+        return block
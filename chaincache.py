@@ -0,0 +1,273 @@
+# Copyright (c) 2014-2017 esotericnonsense (Daniel Edgecumbe)
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or https://opensource.org/licenses/mit-license.php
+
+import asyncio
+import concurrent.futures
+import os
+import sqlite3
+
+try:
+    import ujson as json
+except ImportError:
+    import json
+
+import primitives
+from rpc import RPCError, RPCContentError
+
+DEFAULT_DEPTH = 100  # confirmations before a block is considered final
+DEFAULT_SIZE = 512 * 1024 * 1024  # bytes
+EVICT_TO = 0.9  # of the size limit, so that eviction isn't done per insert
+
+JSON, RAW = 0, 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS blocks (
+    hash TEXT PRIMARY KEY,
+    height INTEGER NOT NULL,
+    kind INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    nextblockhash TEXT,
+    used INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS blocks_height ON blocks (height);
+CREATE INDEX IF NOT EXISTS blocks_used ON blocks (used);
+CREATE TABLE IF NOT EXISTS transactions (
+    txid TEXT PRIMARY KEY,
+    blockhash TEXT NOT NULL,
+    height INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    used INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS transactions_used ON transactions (used);
+"""
+
+# Things that change as the chain grows aren't stored.
+VOLATILE_KEYS = ["confirmations"]
+
+
+def _strip(result):
+    return {k: v for k, v in result.items() if k not in VOLATILE_KEYS}
+
+
+class ChainCache(object):
+    """
+    Blocks and transactions at least depth blocks deep, kept in an SQLite
+    database across sessions: getblock and getrawtransaction results as
+    JSON, and raw blocks (primitives.Block) as bytes with their height and
+    next block hash, which is all getblockheader would otherwise be asked
+    for. The height of each block also answers getblockhash.
+
+    The total size is kept under max_size by dropping the least recently
+    used entries. Nothing is read or written until verify has checked the
+    cache against the node's chain; the database is only touched from one
+    worker thread so as not to hold up the event loop.
+    """
+    def __init__(self, filename, depth=DEFAULT_DEPTH, max_size=DEFAULT_SIZE):
+        self._filename = filename
+        self._depth = depth
+        self._max_size = max_size
+
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._db = None
+        self._clock = 0  # for least recently used
+        self._size = 0
+        self._verified = False
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self._filename), exist_ok=True)
+        db = sqlite3.connect(self._filename, check_same_thread=False)
+        # Commits are frequent (every read marks its entry used) and
+        # losing the last few to a crash costs nothing.
+        db.execute("PRAGMA journal_mode = WAL")
+        db.execute("PRAGMA synchronous = NORMAL")
+        db.executescript(SCHEMA)
+
+        self._clock = max(
+            db.execute("SELECT IFNULL(MAX(used), 0) FROM blocks").fetchone()[0],
+            db.execute("SELECT IFNULL(MAX(used), 0) FROM transactions").fetchone()[0],
+        )
+        self._db = db
+        self._measure()
+
+    def _measure(self):
+        # Another session may have written to the same file.
+        self._size = (
+            self._db.execute("SELECT IFNULL(SUM(LENGTH(data)), 0) FROM blocks").fetchone()[0] +
+            self._db.execute("SELECT IFNULL(SUM(LENGTH(data)), 0) FROM transactions").fetchone()[0]
+        )
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    def _tick(self):
+        self._clock += 1
+        return self._clock
+
+    def _heights(self):
+        """ (height, hash) of everything cached, highest first. """
+        return self._db.execute(
+            "SELECT height, hash FROM blocks UNION "
+            "SELECT height, blockhash FROM transactions "
+            "ORDER BY height DESC").fetchall()
+
+    def _check_genesis(self, genesis):
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'genesis'").fetchone()
+        if row is not None and row[0] == genesis:
+            return
+
+        # A different network, or a new cache.
+        with self._db:
+            self._db.execute("DELETE FROM blocks")
+            self._db.execute("DELETE FROM transactions")
+            self._db.execute("INSERT OR REPLACE INTO meta VALUES ('genesis', ?)", (genesis, ))
+        self._size = 0
+
+    def _drop_block(self, blockhash):
+        with self._db:
+            self._db.execute("DELETE FROM blocks WHERE hash = ?", (blockhash, ))
+            self._db.execute("DELETE FROM transactions WHERE blockhash = ?", (blockhash, ))
+            # A block before this one may point to it.
+            self._db.execute("UPDATE blocks SET nextblockhash = NULL WHERE nextblockhash = ?",
+                             (blockhash, ))
+
+    async def verify(self, client):
+        """
+        Check the cache against the node's chain, dropping everything if
+        it is for another network and any blocks reorganized away. Cached
+        blocks are checked from the highest down until one is found on
+        the active chain, as those under it must be too.
+        """
+        try:
+            await self._run(self._open)
+        except (OSError, sqlite3.Error):
+            # Carry on without.
+            return
+
+        try:
+            j = await client.request("getblockhash", [0])
+            await self._run(self._check_genesis, j["result"])
+
+            for height, blockhash in await self._run(self._heights):
+                try:
+                    j = await client.request("getblockhash", [height])
+                    if j["result"] == blockhash:
+                        break
+                except RPCContentError:
+                    # Beyond the node's tip.
+                    pass
+                await self._run(self._drop_block, blockhash)
+        except (RPCError, KeyError, sqlite3.Error):
+            return
+
+        self._verified = True
+
+    def _evict(self):
+        if self._size <= self._max_size:
+            return
+
+        self._measure()
+        target = self._max_size * EVICT_TO
+        while self._size > target:
+            rows = self._db.execute(
+                "SELECT used, 'b', hash, LENGTH(data) FROM blocks UNION ALL "
+                "SELECT used, 't', txid, LENGTH(data) FROM transactions "
+                "ORDER BY used LIMIT 64").fetchall()
+            if not rows:
+                self._size = 0
+                return
+
+            with self._db:
+                for _, table, key, size in rows:
+                    if table == "b":
+                        self._db.execute("DELETE FROM blocks WHERE hash = ?", (key, ))
+                    else:
+                        self._db.execute("DELETE FROM transactions WHERE txid = ?", (key, ))
+                    self._size -= size
+
+    def _get_block(self, blockhash):
+        row = self._db.execute("SELECT kind, data, height, nextblockhash FROM blocks WHERE hash = ?",
+                               (blockhash, )).fetchone()
+        if row is None:
+            return None
+
+        with self._db:
+            self._db.execute("UPDATE blocks SET used = ? WHERE hash = ?", (self._tick(), blockhash))
+        kind, data, height, nextblockhash = row
+        if kind == JSON:
+            return json.loads(data)
+
+        block = primitives.Block.parse(data)
+        block.height = height
+        block.nextblockhash = nextblockhash
+        return block
+
+    def _put_block(self, block):
+        if isinstance(block, primitives.Block):
+            kind, data = RAW, block.get_bytes()
+        else:
+            kind, data = JSON, json.dumps(_strip(block)).encode("utf-8")
+
+        with self._db:
+            self._db.execute("INSERT OR REPLACE INTO blocks VALUES (?, ?, ?, ?, ?, ?)",
+                             (block["hash"], block["height"], kind, data,
+                              block.get("nextblockhash"), self._tick()))
+        self._size += len(data)
+        self._evict()
+
+    def _get_blockhash(self, height):
+        row = self._db.execute("SELECT hash FROM blocks WHERE height = ?", (height, )).fetchone()
+        return row[0] if row is not None else None
+
+    def _get_transaction(self, txid):
+        row = self._db.execute("SELECT data FROM transactions WHERE txid = ?", (txid, )).fetchone()
+        if row is None:
+            return None
+
+        with self._db:
+            self._db.execute("UPDATE transactions SET used = ? WHERE txid = ?", (self._tick(), txid))
+        return json.loads(row[0])
+
+    def _put_transaction(self, transaction, height):
+        data = json.dumps(_strip(transaction)).encode("utf-8")
+        with self._db:
+            self._db.execute("INSERT OR REPLACE INTO transactions VALUES (?, ?, ?, ?, ?)",
+                             (transaction["txid"], transaction["blockhash"], height, data, self._tick()))
+        self._size += len(data)
+        self._evict()
+
+    async def _call(self, fn, *args):
+        if not self._verified:
+            return None
+
+        try:
+            return await self._run(fn, *args)
+        except (sqlite3.Error, primitives.DeserializationError, ValueError):
+            return None
+
+    def is_final(self, confirmations):
+        """ Whether something this deep would be kept. """
+        return self._verified and confirmations >= self._depth
+
+    async def get_block(self, blockhash):
+        """ The cached block, or None. """
+        return await self._call(self._get_block, blockhash)
+
+    async def put_block(self, block):
+        """ Keep a block, which must have its height set. """
+        await self._call(self._put_block, block)
+
+    async def get_blockhash(self, height):
+        return await self._call(self._get_blockhash, height)
+
+    async def get_transaction(self, txid):
+        return await self._call(self._get_transaction, txid)
+
+    async def put_transaction(self, transaction, height):
+        """ Keep a getrawtransaction result from the block at height. """
+        await self._call(self._put_transaction, transaction, height)
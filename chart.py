@@ -0,0 +1,155 @@
+# Copyright (c) 2014-2017 esotericnonsense (Daniel Edgecumbe)
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or https://opensource.org/licenses/mit-license.php
+
+import re
+import math
+import curses
+
+# "reverse" draws reverse-video spaces, one level per cell, and works on any
+# terminal. The glyph styles need a UTF-8 locale.
+STYLES = ["reverse", "block", "braille"]
+
+BLOCKS = " ▁▂▃▄▅▆▇█"  # eighths
+
+# Braille dot bits for (left, right) columns, from the top of the cell down.
+BRAILLE_BASE = 0x2800
+BRAILLE_DOTS = [(0x01, 0x08), (0x02, 0x10), (0x04, 0x20), (0x40, 0x80)]
+
+FILLED, INVERTED = 1, 2
+
+EMPTY_CELL = "\0"  # placeholder while building a row; never drawn
+RUNS = re.compile("[^\0]+")
+
+
+def _glyphs(style, downward):
+    """ (fill -> character, span kind) for the single-sample styles. """
+    if style == "reverse":
+        return [EMPTY_CELL, " "], INVERTED
+
+    if downward:
+        # Reverse video turns the lower (8-fill) eighths into the upper fill.
+        return [EMPTY_CELL] + [BLOCKS[8-fill] for fill in range(1, 9)], INVERTED
+
+    return [EMPTY_CELL] + [BLOCKS[fill] for fill in range(1, 9)], FILLED
+
+
+def _braille(downward):
+    """ [left fill][right fill] -> character. """
+    dots = BRAILLE_DOTS if downward else BRAILLE_DOTS[::-1]
+    table = []
+    for left in range(5):
+        row = []
+        for right in range(5):
+            bits = 0
+            for d in dots[:left]:
+                bits |= d[0]
+            for d in dots[:right]:
+                bits |= d[1]
+            row.append(chr(BRAILLE_BASE + bits) if bits else EMPTY_CELL)
+        table.append(row)
+
+    return table
+
+
+def samples_per_column(style):
+    return 2 if style == "braille" else 1
+
+
+def levels_per_row(style):
+    if style == "block":
+        return 8
+    if style == "braille":
+        return 4
+    return 1
+
+
+def _levels(values, maxvalue, height, style):
+    top = levels_per_row(style) * height
+    if maxvalue <= 0:
+        return [0 for _ in values]
+
+    # Round up so that any non-zero value is visible.
+    return [
+        min(top, int(math.ceil(top * value / maxvalue))) if value > 0 else 0
+        for value in values
+    ]
+
+
+def bar_rows(values, maxvalue, height, style, downward=False):
+    """
+    Render a bar chart as run-length encoded rows.
+
+    Returns height rows, top row first. Each row is a list of
+    (column, text, kind) spans covering the non-empty cells, where kind is
+    FILLED or INVERTED (to be drawn in reverse video).
+    """
+    per_row = levels_per_row(style)
+    levels = _levels(values, maxvalue, height, style)
+
+    if style == "braille":
+        table = _braille(downward)
+        kind = FILLED
+        if len(levels) % 2:
+            levels.append(0)
+        keys = list(zip(levels[0::2], levels[1::2]))
+
+        def column(key):
+            a, b = key
+            return tuple(
+                table[min(max(a - base, 0), 4)][min(max(b - base, 0), 4)]
+                for base in range(0, 4 * height, 4)
+            )
+    else:
+        glyphs, kind = _glyphs(style, downward)
+        keys = levels
+
+        def column(level):
+            return tuple(
+                glyphs[min(max(level - base, 0), per_row)]
+                for base in range(0, per_row * height, per_row)
+            )
+
+    # Build each distinct bar once, then transpose the columns into rows.
+    columns = {}
+    for key in keys:
+        if key not in columns:
+            columns[key] = column(key)
+
+    rows = [
+        [(m.start(), m.group(), kind) for m in RUNS.finditer("".join(cells))]
+        for cells in zip(*[columns[key] for key in keys])
+    ]
+
+    if not rows:
+        rows = [[] for _ in range(height)]
+
+    if not downward:
+        rows.reverse()
+
+    return rows
+
+
+def draw_rows(pad, y, x, rows, attr):
+    """ Draw the output of bar_rows with one addstr call per span. """
+    for i, spans in enumerate(rows):
+        for column, text, kind in spans:
+            pad.addstr(y+i, x+column, text,
+                attr + curses.A_REVERSE if kind == INVERTED else attr)
+
+
+def draw_bars(pad, y, x, values, maxvalue, height, style, attr, downward=False):
+    """
+    Draw a bar chart into the height rows from y. In the reverse style
+    each bar is a single vline of reverse-video spaces: one call per
+    column, however ragged the data, and no rows to build. The glyph
+    styles go through bar_rows and draw_rows.
+    """
+    if style != "reverse":
+        draw_rows(pad, y, x, bar_rows(values, maxvalue, height, style, downward), attr)
+        return
+
+    cell = ord(" ") | attr | curses.A_REVERSE
+    for column, level in enumerate(_levels(values, maxvalue, height, style)):
+        if level:
+            pad.vline(y if downward else y + height - level, x + column, cell, level)
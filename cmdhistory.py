@@ -0,0 +1,224 @@
+# Copyright (c) 2014-2017 esotericnonsense (Daniel Edgecumbe)
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or https://opensource.org/licenses/mit-license.php
+
+import heapq
+import itertools
+import os
+import time
+
+try:
+    import ujson as json
+except ImportError:
+    import json
+
+MAX_COMMANDS = 100000  # distinct commands kept when the file is compacted
+COMPACT_LINES = 10000  # don't bother compacting files shorter than this
+
+CHILDREN, MAX_STAMP, STAMP = 0, 1, 2
+
+
+def _common_length(a, b):
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+class PrefixTrie(object):
+    """
+    A radix tree of strings, each with a stamp (larger is more recent).
+
+    Nodes are [children, max stamp, stamp], where children maps the first
+    character of an edge to (edge label, node), max stamp is the largest
+    stamp in the subtree and stamp is the node's own, or -1 if no string
+    ends there. Following the max stamps finds the most recent string with
+    a given prefix in time proportional to the prefix, and a best-first
+    walk lists them newest first without visiting the rest of the subtree.
+
+    Stamps must increase from one insert to the next.
+    """
+    def __init__(self):
+        self._root = [{}, -1, -1]
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def insert(self, key, stamp):
+        node = self._root
+        node[MAX_STAMP] = stamp
+        rest = key
+        while rest:
+            edge = node[CHILDREN].get(rest[0])
+            if edge is None:
+                leaf = [{}, stamp, -1]
+                node[CHILDREN][rest[0]] = (rest, leaf)
+                node = leaf
+                break
+
+            label, child = edge
+            n = _common_length(label, rest)
+            if n < len(label):
+                # Split the edge where the key leaves it.
+                middle = [{label[n]: (label[n:], child)}, child[MAX_STAMP], -1]
+                node[CHILDREN][rest[0]] = (label[:n], middle)
+                child = middle
+
+            node = child
+            node[MAX_STAMP] = stamp
+            rest = rest[n:]
+
+        if node[STAMP] < 0:
+            self._count += 1
+        node[STAMP] = stamp
+
+    def _find(self, prefix):
+        """ (node, the string it spells) for the subtree under prefix. """
+        node, spelled = self._root, ""
+        rest = prefix
+        while rest:
+            edge = node[CHILDREN].get(rest[0])
+            if edge is None:
+                return None, None
+
+            label, child = edge
+            if not (rest.startswith(label) or label.startswith(rest)):
+                return None, None
+
+            node, spelled = child, spelled + label
+            rest = rest[len(label):]
+
+        return node, spelled
+
+    def iter_prefix(self, prefix):
+        """ The strings starting with prefix, most recent first. """
+        node, spelled = self._find(prefix)
+        if node is None or node[MAX_STAMP] < 0:
+            return
+
+        # Nodes queue on their max stamp and strings on their own stamp;
+        # a string is only yielded once nothing queued can be newer.
+        tiebreak = itertools.count()
+        queue = [(-node[MAX_STAMP], next(tiebreak), spelled, node)]
+        while queue:
+            _, _, spelled, node = heapq.heappop(queue)
+            if node is None:
+                yield spelled
+                continue
+
+            if node[STAMP] >= 0:
+                heapq.heappush(queue, (-node[STAMP], next(tiebreak), spelled, None))
+            for label, child in node[CHILDREN].values():
+                heapq.heappush(queue,
+                    (-child[MAX_STAMP], next(tiebreak), spelled + label, child))
+
+
+class CommandHistory(object):
+    """
+    Console commands, appended to a file as JSON lines and indexed by a
+    PrefixTrie for recall. A repeated command is kept once, at its latest
+    use. Without a filename nothing is saved.
+    """
+    def __init__(self, filename=None):
+        self._filename = filename
+        self._trie = PrefixTrie()
+        self._stamp = 0
+        self._lines = 0  # in the file, repeats included
+
+    def __len__(self):
+        return len(self._trie)
+
+    @classmethod
+    def load(cls, filename):
+        history = cls(filename)
+
+        try:
+            with open(filename, "r") as f:
+                for line in f:
+                    history._lines += 1
+                    try:
+                        history._insert(json.loads(line)["command"])
+                    except (ValueError, KeyError, TypeError):
+                        # A torn last line, say.
+                        continue
+        except FileNotFoundError:
+            pass
+
+        if history._lines > max(2 * len(history), COMPACT_LINES):
+            history._compact()
+
+        return history
+
+    def _insert(self, command):
+        self._stamp += 1
+        self._trie.insert(command, self._stamp)
+
+    def _compact(self):
+        """ Rewrite the file with each command once, oldest first. """
+        commands = list(itertools.islice(self._trie.iter_prefix(""), MAX_COMMANDS))
+        commands.reverse()
+
+        tmpname = self._filename + ".tmp"
+        try:
+            with open(tmpname, "w") as f:
+                for command in commands:
+                    f.write(json.dumps({"command": command}) + "\n")
+            os.replace(tmpname, self._filename)
+        except OSError:
+            return
+
+        self._trie = PrefixTrie()
+        self._lines = len(commands)
+        for command in commands:
+            self._insert(command)
+
+    def add(self, command):
+        self._insert(command)
+        if self._filename is None:
+            return
+
+        line = json.dumps({"time": int(time.time()), "command": command})
+        try:
+            os.makedirs(os.path.dirname(self._filename), exist_ok=True)
+            with open(self._filename, "a") as f:
+                f.write(line + "\n")
+            self._lines += 1
+        except OSError:
+            # Keep going without saving.
+            self._filename = None
+
+    def iter_prefix(self, prefix):
+        return self._trie.iter_prefix(prefix)
+
+
+class Recall(object):
+    """ Stepping back and forth through the history matches for a prefix. """
+    def __init__(self, history, prefix):
+        self.prefix = prefix
+        self._matches = history.iter_prefix(prefix)
+        self._seen = []
+        self._index = -1  # -1 is the prefix itself
+
+    def get(self):
+        if self._index < 0:
+            return None
+        return self._seen[self._index]
+
+    def older(self):
+        """ The next older match, or None (staying put) if there is none. """
+        if self._index + 1 == len(self._seen):
+            match = next(self._matches, None)
+            if match is None:
+                return None
+            self._seen.append(match)
+
+        self._index += 1
+        return self._seen[self._index]
+
+    def newer(self):
+        """ The next newer match, or None once back at the prefix. """
+        if self._index >= 0:
+            self._index -= 1
+        return self.get()
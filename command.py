@@ -0,0 +1,595 @@
+# Copyright (c) 2014-2017 esotericnonsense (Daniel Edgecumbe)
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or https://opensource.org/licenses/mit-license.php
+
+import bisect
+import collections
+import decimal
+import operator
+import re
+
+try:
+    import ujson as json
+except ImportError:
+    import json
+
+# A method call; params may contain further (nested) Calls. pipeline is
+# the list of filter stages applied to the result.
+Call = collections.namedtuple("Call", ["method", "params", "pipeline"])
+
+WHITESPACE = " \t\n"
+IDENTIFIER = re.compile(r"[A-Za-z_][\w-]*")
+INDEX = re.compile(r"\s*(-?\d+)\s*\]")
+COMPARISON = re.compile(r"\s*(==|!=|<=|>=|<|>)")
+INTEGER = re.compile(r"-?\d+\Z")
+NUMBER = re.compile(r"-?\d+(\.\d+)?([eE][+-]?\d+)?\Z")
+WORDS = {
+    "true": True,
+    "True": True,
+    "false": False,
+    "False": False,
+    "null": None,
+}
+
+
+# Path steps.
+KEY, ITEM, ITERATE = 0, 1, 2
+
+# Filter stages, besides paths (PATH, steps) and (SELECT, steps, op, value).
+PATH, SELECT = "path", "select"
+AGGREGATES = ["sum", "count", "min", "max", "first"]
+MAPS = ["keys", "length"]
+
+OPERATORS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+
+class ParseError(ValueError):
+    pass
+
+
+class FilterError(ValueError):
+    pass
+
+
+def literal(word):
+    """ A bare word as a number, boolean, null or string. """
+    if word in WORDS:
+        return WORDS[word]
+
+    if INTEGER.match(word):
+        return int(word)
+
+    if NUMBER.match(word):
+        return float(word)
+
+    return word
+
+
+class Parser(object):
+    """
+    Console command lines:
+
+        getblock $(getblockhash 100) 2; getrawmempool true
+        sendmany "" {"bc1q...": 0.1} 1 "a comment"
+
+    Commands are separated by ';'. Arguments are bare words (numbers,
+    true/false/null or strings), quoted strings, JSON arrays and objects,
+    or $(...) for the result of a nested command.
+
+    A command may be followed by a pipeline of filters on its result:
+
+        getpeerinfo | [].addr
+        getpeerinfo | [] | select(.inbound == true) | .addr
+        getblock $(getbestblockhash) 2 | tx[].vout[].value | sum
+
+    A path is a series of .key, [n] and [] (every element) steps; the
+    leading . may be dropped. Paths with [] produce a stream of values,
+    which select() filters and sum, count, min, max and first reduce to
+    one. keys and length apply to each value. A stream left at the end of
+    the pipeline is shown as a list.
+    """
+    def __init__(self, text):
+        self._text = text
+        self._pos = 0
+        self._depth = 0  # $( nesting
+
+    def _error(self, message):
+        raise ParseError("{} at column {}".format(message, self._pos + 1))
+
+    def _peek(self):
+        return self._text[self._pos] if self._pos < len(self._text) else ""
+
+    def _skip_whitespace(self):
+        while self._peek() and self._peek() in WHITESPACE:
+            self._pos += 1
+
+    def parse(self):
+        """ [(source text, Call)] for each command. """
+        commands = []
+        while True:
+            self._skip_whitespace()
+            if not self._peek():
+                return commands
+
+            if self._peek() == ";":
+                self._pos += 1
+                continue
+
+            start = self._pos
+            call = self._call()
+            commands.append((self._text[start:self._pos].strip(), call))
+
+    def _call(self):
+        words = []
+        while True:
+            self._skip_whitespace()
+            c = self._peek()
+            if not c or c in ";|" or (c == ")" and self._depth):
+                break
+
+            words.append(self._value())
+
+        if not words or not isinstance(words[0], str):
+            self._error("expected a method name")
+
+        pipeline = []
+        while self._peek() == "|":
+            self._pos += 1
+            self._skip_whitespace()
+            pipeline.append(self._stage())
+            self._skip_whitespace()
+
+            c = self._peek()
+            if c and c not in ";|" and not (c == ")" and self._depth):
+                self._error("unexpected {}".format(c))
+
+        return Call(words[0], words[1:], pipeline)
+
+    def _value(self):
+        c = self._peek()
+        if c in "\"'":
+            return self._quoted()
+
+        if c in "[{":
+            return self._json()
+
+        if self._text.startswith("$(", self._pos):
+            self._pos += 2
+            self._depth += 1
+            call = self._call()
+            if self._peek() != ")":
+                self._error("unterminated $(")
+            self._pos += 1
+            self._depth -= 1
+            return call
+
+        return self._bare()
+
+    def _bare(self):
+        start = self._pos
+        while True:
+            c = self._peek()
+            if not c or c in WHITESPACE or c in ";|" or (c == ")" and self._depth):
+                break
+            if c in "\"'[{" or self._text.startswith("$(", self._pos):
+                self._error("unexpected {}".format(c))
+            self._pos += 1
+
+        return literal(self._text[start:self._pos])
+
+    def _quoted(self):
+        quote = self._peek()
+        start = self._pos
+        self._pos += 1
+        while True:
+            c = self._peek()
+            if not c:
+                self._error("unterminated string")
+
+            self._pos += 1
+            if c == "\\" and quote == '"':
+                self._pos += 1
+            elif c == quote:
+                break
+
+        if quote == "'":
+            # No escapes in single quotes.
+            return self._text[start+1:self._pos-1]
+
+        try:
+            return json.loads(self._text[start:self._pos])
+        except ValueError:
+            self._error("bad string")
+
+    def _identifier(self):
+        m = IDENTIFIER.match(self._text, self._pos)
+        if not m:
+            return None
+
+        self._pos = m.end()
+        return m.group()
+
+    def _stage(self):
+        start = self._pos
+        name = self._identifier()
+        if name in AGGREGATES or name in MAPS:
+            return (name, )
+
+        if name == SELECT and self._peek() == "(":
+            self._pos += 1
+            self._depth += 1
+            self._skip_whitespace()
+            steps = self._path()
+
+            op, value = None, None
+            m = COMPARISON.match(self._text, self._pos)
+            if m:
+                self._pos = m.end()
+                self._skip_whitespace()
+                op, value = m.group(1), self._value()
+                if isinstance(value, Call):
+                    self._error("unexpected $(")
+
+            self._skip_whitespace()
+            if self._peek() != ")":
+                self._error("unterminated select(")
+            self._pos += 1
+            self._depth -= 1
+            return (SELECT, steps, op, value)
+
+        self._pos = start
+        return (PATH, self._path())
+
+    def _path(self):
+        start = self._pos
+        steps = []
+
+        key = self._identifier()
+        if key is not None:
+            steps.append((KEY, key))
+
+        while True:
+            c = self._peek()
+            if c == ".":
+                self._pos += 1
+                if self._peek() == '"':
+                    steps.append((KEY, self._quoted()))
+                    continue
+
+                key = self._identifier()
+                if key is not None:
+                    steps.append((KEY, key))
+            elif c == "[":
+                self._pos += 1
+                m = INDEX.match(self._text, self._pos)
+                if m:
+                    steps.append((ITEM, int(m.group(1))))
+                    self._pos = m.end()
+                elif self._peek() == "]":
+                    steps.append((ITERATE, None))
+                    self._pos += 1
+                else:
+                    self._error("bad index")
+            else:
+                break
+
+        if self._pos == start:
+            self._error("expected a filter")
+
+        return steps
+
+    def _json(self):
+        start = self._pos
+        depth = 0
+        in_string = False
+        while True:
+            c = self._peek()
+            if not c:
+                self._error("unterminated JSON")
+
+            self._pos += 1
+            if in_string:
+                if c == "\\":
+                    self._pos += 1
+                elif c == '"':
+                    in_string = False
+            elif c == '"':
+                in_string = True
+            elif c in "[{":
+                depth += 1
+            elif c in "]}":
+                depth -= 1
+                if not depth:
+                    break
+
+        try:
+            return json.loads(self._text[start:self._pos])
+        except ValueError:
+            self._pos = start
+            self._error("bad JSON")
+
+
+def parse(text):
+    return Parser(text).parse()
+
+
+def parse_script(lines):
+    """ Commands from a script; blank lines and # comments are skipped. """
+    commands = []
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+
+        try:
+            commands.extend(parse(line))
+        except ParseError as e:
+            raise ParseError("line {}: {}".format(number, e))
+
+    return commands
+
+
+def _json_type(value):
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, (int, float)):
+        return "number"
+    if isinstance(value, str):
+        return "string"
+    if isinstance(value, list):
+        return "array"
+    return "object"
+
+
+def _follow(value, steps, i=0):
+    """ The values at the end of steps[i:] from value. """
+    if i == len(steps):
+        yield value
+        return
+
+    kind, arg = steps[i]
+    if value is None:
+        # Like jq, a path through null is null, and iterates over nothing.
+        if kind != ITERATE:
+            yield from _follow(None, steps, i + 1)
+        return
+
+    if kind == KEY:
+        if not isinstance(value, dict):
+            raise FilterError("cannot get .{} of {}".format(arg, _json_type(value)))
+        yield from _follow(value.get(arg), steps, i + 1)
+    elif kind == ITEM:
+        if not isinstance(value, list):
+            raise FilterError("cannot get [{}] of {}".format(arg, _json_type(value)))
+        try:
+            item = value[arg]
+        except IndexError:
+            item = None
+        yield from _follow(item, steps, i + 1)
+    else:
+        if isinstance(value, dict):
+            value = value.values()
+        elif not isinstance(value, list):
+            raise FilterError("cannot iterate over {}".format(_json_type(value)))
+        for item in value:
+            yield from _follow(item, steps, i + 1)
+
+
+def _paths(values, steps):
+    for value in values:
+        yield from _follow(value, steps)
+
+
+def _sum(values):
+    # Floats are added as the decimals they were sent as, so that amounts
+    # in BTC come out exact.
+    total = 0
+    for value in values:
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise FilterError("cannot sum {}".format(_json_type(value)))
+        total += value if isinstance(value, int) else decimal.Decimal(repr(value))
+
+    return float(total) if isinstance(total, decimal.Decimal) else total
+
+
+def _extreme(values, key):
+    try:
+        return key(values, default=None)
+    except TypeError:
+        raise FilterError("cannot compare mixed types")
+
+
+def _select(values, steps, op, operand):
+    for value in values:
+        for selected in _follow(value, steps):
+            try:
+                if op is None and selected is not None and selected is not False:
+                    yield value
+                    break
+                if op is not None and OPERATORS[op](selected, operand):
+                    yield value
+                    break
+            except TypeError:
+                raise FilterError("cannot compare {} {} {}".format(
+                    _json_type(selected), op, _json_type(operand)))
+
+
+def _map(values, name):
+    for value in values:
+        yield _map_value(name, value)
+
+
+def _map_value(name, value):
+    if name == "keys":
+        if isinstance(value, dict):
+            return sorted(value)
+        if isinstance(value, list):
+            return list(range(len(value)))
+    elif isinstance(value, (str, list, dict)):
+        return len(value)
+
+    raise FilterError("{} has no {}".format(_json_type(value), name))
+
+
+def evaluate(pipeline, value):
+    """
+    Run value through a pipeline. Stages are chained generators, so a
+    stream is never built up in full unless it is the result, which is a
+    list if the pipeline ends in a stream and a single value otherwise.
+    """
+    values = iter([value])
+    stream = False
+    for stage in pipeline:
+        name = stage[0]
+        if name == PATH:
+            values = _paths(values, stage[1])
+            stream = stream or any(kind == ITERATE for kind, _ in stage[1])
+        elif name == SELECT:
+            values = _select(values, *stage[1:])
+        elif name in MAPS:
+            values = _map(values, name)
+        else:
+            if name == "sum":
+                result = _sum(values)
+            elif name == "count":
+                result = sum(1 for _ in values)
+            elif name == "min":
+                result = _extreme(values, min)
+            elif name == "max":
+                result = _extreme(values, max)
+            else:
+                result = next(values, None)
+            values = iter([result])
+            stream = False
+
+    if stream:
+        return list(values)
+
+    return next(values, None)
+
+
+def split_stream(pipeline):
+    """
+    (keys, project, pipeline) for a pipeline whose first path iterates
+    over a container: the keys of the container in the result, the rest
+    of the path as a function to apply to each element while the response
+    is decoded, and the pipeline to run on the result with the elements
+    replaced by their projections. keys is None for other pipelines.
+    """
+    if not pipeline or pipeline[0][0] != PATH:
+        return None, None, pipeline
+
+    steps = pipeline[0][1]
+    for i, (kind, arg) in enumerate(steps):
+        if kind == ITERATE:
+            rest = steps[i+1:]
+
+            def project(value):
+                return list(_follow(value, rest))
+
+            # Each projection is a list of values, so iterate twice.
+            path = steps[:i] + [(ITERATE, None), (ITERATE, None)]
+            return [arg for _, arg in steps[:i]], project, [(PATH, path)] + pipeline[1:]
+
+        if kind != KEY:
+            break
+
+    return None, None, pipeline
+
+
+async def resolve(params, request):
+    """
+    Replace nested Calls in params with their (filtered) results,
+    innermost first. request(method, params) is a coroutine returning the
+    result.
+    """
+    resolved = []
+    for param in params:
+        if isinstance(param, Call):
+            result = await request(param.method, await resolve(param.params, request))
+            param = evaluate(param.pipeline, result)
+        resolved.append(param)
+
+    return resolved
+
+
+def line_context(text):
+    """
+    (method, word) at the end of a partly typed command line: the method
+    whose arguments are being typed, or None while the method name itself
+    is, and the word being typed. word is None inside a string.
+    """
+    frames = [None]  # the method of each open $(...), innermost last
+    start = 0  # of the current word
+    i = 0
+    while i < len(text):
+        c = text[i]
+        if c in "\"'":
+            end = text.find(c, i + 1)
+            while c == '"' and end > 0 and text[end-1] == "\\":
+                end = text.find(c, end + 1)
+            if end < 0:
+                return frames[-1], None
+            i = end + 1
+            continue
+
+        if text.startswith("$(", i):
+            frames.append(None)
+            i += 2
+            start = i
+            continue
+
+        if c in WHITESPACE or c in ";)":
+            if frames[-1] is None and i > start:
+                frames[-1] = text[start:i]
+            if c == ";":
+                frames[-1] = None
+            elif c == ")" and len(frames) > 1:
+                frames.pop()
+            start = i + 1
+
+        i += 1
+
+    return frames[-1], text[start:]
+
+
+def parse_help(text):
+    """ {method: argument summary} from the output of "help". """
+    methods = {}
+    for line in text.split("\n"):
+        line = line.strip()
+        if not line or line.startswith("=="):
+            continue
+
+        name, _, args = line.partition(" ")
+        methods[name] = args
+
+    return methods
+
+
+class HelpIndex(object):
+    """
+    The node's RPC methods and their argument summaries, for completion.
+    Names are kept sorted so that a prefix is two bisections.
+    """
+    def __init__(self, methods):
+        self._methods = methods
+        self._names = sorted(methods)
+
+    def complete(self, prefix):
+        """ The method names starting with prefix. """
+        lo = bisect.bisect_left(self._names, prefix)
+        hi = bisect.bisect_left(self._names, prefix + "\uffff")
+        return self._names[lo:hi]
+
+    def get_args(self, method):
+        return self._methods.get(method)
@@ -5,7 +5,13 @@
 import curses
 import curses.textpad
 import asyncio
-import decimal
+
+import array
+import bisect
+import collections
+import functools
+import os
+import time
 
 try:
     import ujson as json
@@ -13,50 +19,279 @@ except ImportError:
     import json
 
 import view
+import command
+import cmdhistory
 from rpc import RPCError
 
+WIDTH = 99  # characters per response line
+REQUEST_WIDTH = 95  # after the ">>> " prompt
+HISTORY_BYTES = 32 * 1024 * 1024  # responses kept, as formatted text and line offsets
+FORMAT_CACHE = 4  # entries kept formatted
+SPINNER = "|/-\\"
+CANCEL_KEY = "\x18"  # ^X
+SEARCH_KEY = "\x12"  # ^R
+BATCH_COMMAND = ":batch"
+MAX_COMMAND = 190  # characters on the command line
+
+REQUEST, RESPONSE, SEPARATOR, RUNNING = 0, 1, -1, 2
+
+PENDING = object()  # the response of a request still in flight
+
+# A response formatted ahead of time, in a worker process.
+Formatted = collections.namedtuple("Formatted", ["text", "offsets"])
+
+
+def format_response(response):
+    return json.dumps(response, indent=4, sort_keys=True)
+
+
+def wrap_offsets(text, width):
+    """ Start offsets of text's lines, wrapped at width. """
+    offsets = array.array("L")
+    start = 0
+    for n in map(len, text.split("\n")):
+        if n > width:
+            offsets.extend(range(start, start + n, width))
+        else:
+            offsets.append(start)
+        start += n + 1
+
+    return offsets
+
+
+def prepare_response(pipeline, d):
+    """ The response, or its result filtered by pipeline. """
+    return command.evaluate(pipeline, d["result"]) if pipeline else d
+
+
+def format_prepared(response):
+    """ A large response, Formatted in the worker that decoded it. """
+    text = format_response(response)
+    return Formatted(text, wrap_offsets(text, WIDTH))
+
+
+class ConsoleBuffer(object):
+    """
+    Console requests and their raw responses, formatted when shown.
+
+    Each entry's wrapped line count is worked out when its response
+    arrives, and a cumulative index maps screen lines to entries; as
+    scrolling moves a line at a time, a lookup starts from the entry the
+    last one found. Only the FORMAT_CACHE entries used last are kept
+    formatted, as text plus line offsets rather than a list of lines,
+    and the visible lines are cut from those. Old entries are dropped
+    once the formatted size of the history, line offsets included,
+    passes maxbytes. A response too large to decode on the loop arrives
+    Formatted from the worker that decoded it, and is kept as it is.
+    """
+    def __init__(self, maxbytes):
+        self._maxbytes = maxbytes
+
+        self._entries = collections.deque()  # [request, response, lines, bytes]
+        self._dropped = 0  # entries dropped from the front, for ids
+        self._bytes = 0
+
+        self._starts = None  # first line of each entry; None if stale
+        self._cursor = 0  # index of the entry the last lookup found
+        self._cache = collections.OrderedDict()  # entry id -> (text, offsets)
+
+    def __len__(self):
+        """ The number of lines. """
+        if not self._entries:
+            return 0
+
+        starts = self._get_starts()
+        return starts[-1] + self._entries[-1][2]
+
+    def _get_starts(self):
+        if self._starts is None:
+            starts = array.array("L")
+            line = 0
+            for entry in self._entries:
+                starts.append(line)
+                line += entry[2]
+            self._starts = starts
+
+        return self._starts
+
+    def _entry_at(self, starts, line):
+        """ The index of the entry holding line. """
+        last = min(self._cursor, len(starts) - 1)
+        for index in (last, last + 1, last - 1):
+            if 0 <= index < len(starts) and starts[index] <= line and (
+                    index + 1 == len(starts) or line < starts[index+1]):
+                break
+        else:
+            # A jump, such as to the end for a new request.
+            index = bisect.bisect_right(starts, line) - 1
+
+        self._cursor = index
+        return index
+
+    def _format(self, ident):
+        try:
+            self._cache.move_to_end(ident)
+            return self._cache[ident]
+        except KeyError:
+            pass
+
+        request, response, _, _ = self._entries[ident - self._dropped]
+        if isinstance(response, Formatted):
+            return response
+
+        text = format_response(response)
+        formatted = (text, wrap_offsets(text, WIDTH))
+
+        self._cache[ident] = formatted
+        while len(self._cache) > FORMAT_CACHE:
+            self._cache.popitem(last=False)
+
+        return formatted
+
+    @staticmethod
+    def _request_lines(request):
+        return max(1, -(-(len(request) + 4) // REQUEST_WIDTH))
+
+    def append(self, request):
+        """ Add a request with its response pending. Returns its id. """
+        ident = self._dropped + len(self._entries)
+        # The request, a status line and the separator.
+        self._entries.append([request, PENDING, self._request_lines(request) + 2, 0])
+        self._starts = None
+
+        return ident
+
+    def set_response(self, ident, response):
+        index = ident - self._dropped
+        if index < 0:
+            # Dropped while it was running.
+            return
+
+        entry = self._entries[index]
+        entry[1] = response
+        self._cache.pop(ident, None)
+
+        text, offsets = self._format(ident)
+        entry[2] = self._request_lines(entry[0]) + len(offsets) + 1
+        entry[3] = len(text) + offsets.itemsize * len(offsets)
+        self._bytes += entry[3]
+
+        # Keep the latest entry, however large.
+        while self._bytes > self._maxbytes and len(self._entries) > 1:
+            self._bytes -= self._entries.popleft()[3]
+            self._cache.pop(self._dropped, None)
+            self._dropped += 1
+
+        self._starts = None
+
+    def _entry_lines(self, ident, first, n, status):
+        """ Lines [first, first+n) of an entry, as (kind, string). """
+        request, response, nlines, _ = self._entries[ident - self._dropped]
+
+        prompt = ">>> " + request
+        request_lines = max(1, -(-len(prompt) // REQUEST_WIDTH))
+
+        lines = []
+        for i in range(first, min(first + n, nlines)):
+            if i < request_lines:
+                lines.append((REQUEST, prompt[i*REQUEST_WIDTH:(i+1)*REQUEST_WIDTH]))
+            elif i == nlines - 1:
+                lines.append((SEPARATOR, ""))
+            elif response is PENDING:
+                lines.append((RUNNING, status(ident)))
+            else:
+                text, offsets = self._format(ident)
+                start = offsets[i - request_lines]
+                end = text.find("\n", start, start + WIDTH)
+                lines.append((RESPONSE, text[start:end if end >= 0 else start + WIDTH]))
+
+        return lines
+
+    def get_lines(self, first, n, status):
+        """
+        Lines [first, first+n) of the whole buffer. status(id) gives the
+        text shown for a request that is still running.
+        """
+        if not self._entries:
+            return []
+
+        starts = self._get_starts()
+        index = self._entry_at(starts, first)
+
+        lines = []
+        while len(lines) < n and index < len(self._entries):
+            lines.extend(self._entry_lines(
+                self._dropped + index, first - starts[index], n - len(lines), status))
+            index += 1
+            first = starts[index] if index < len(self._entries) else 0
+
+        return lines
+
 
 class ConsoleView(view.View):
     _mode_name = "console"
 
-    def __init__(self, client):
+    def __init__(self, client, cachedir):
         self._client = client
+        self._cachedir = cachedir
 
         self._textbox_active = False
-        # TODO: implement history properly
-        self._command_history = [""]
-        self._response_history = []
-        self._response_history_strings = []
+        self._command = ""
+        # In memory only until on_history supplies the saved history.
+        self._command_history = cmdhistory.CommandHistory()
+        self._recall = None  # cmdhistory.Recall while browsing the history
+        self._searching = False  # ^R
+
+        self._help = None  # command.HelpIndex once fetched
+        self._help_task = None
+        self._candidates = None  # from an ambiguous completion
+
+        self._response_history = ConsoleBuffer(HISTORY_BYTES)
         self._response_history_offset = 0
 
+        self._running = collections.OrderedDict()  # entry id -> (task, start time)
+        self._spinner = 0
+
         super().__init__()
 
     async def _draw(self):
         self._clear_init_pad()
 
         CGREEN = curses.color_pair(1)
+        CCYAN = curses.color_pair(2)
         CRED = curses.color_pair(3)
         CYELLOW = curses.color_pair(5)
         CBOLD = curses.A_BOLD
         CREVERSE = curses.A_REVERSE
 
-        self._pad.addstr(0, 63, "[UP/DOWN: browse, TAB: enter command]", CYELLOW)
+        if self._textbox_active:
+            self._pad.addstr(0, 50, "[UP/DOWN: recall, TAB: complete, ^R: search]", CYELLOW)
+        else:
+            self._pad.addstr(0, 63, "[UP/DOWN: browse, TAB: enter command]", CYELLOW)
+        if self._running:
+            self._pad.addstr(0, 1, "{} running [^X: cancel]".format(len(self._running)), CYELLOW)
         offset = self._response_history_offset
         if offset > 0:
             self._pad.addstr(0, 36, "... ^ ...", CBOLD)
-        if offset < len(self._response_history_strings) - 17:
+        if offset < len(self._response_history) - 17:
             self._pad.addstr(17, 36, "... v ...", CBOLD)
 
-        for i, (t, string) in enumerate(self._response_history_strings):
-            if i < offset:
-                continue
-            if i > offset+15: # TODO
-                break
-
-            color = CBOLD + CGREEN if t == 0 else CBOLD
-            self._pad.addstr(1+i-offset, 1, string, color)
+        # Only the visible lines are formatted.
+        lines = self._response_history.get_lines(offset, 16, self._status)
+        for i, (t, string) in enumerate(lines):
+            color = CBOLD + CGREEN if t == REQUEST else CBOLD
+            if t == RUNNING:
+                color = CBOLD + CYELLOW
+            self._pad.addstr(1+i, 1, string, color)
+
+        if self._searching:
+            match = self._recall.get() or ""
+            prompt = "(search) `{}': {}".format(self._recall.prefix, match)
+            self._pad.addstr(18, 1, prompt[:98], CRED + CBOLD + CREVERSE)
+            self._draw_pad_to_screen()
+            return
 
-        cmd = self._command_history[-1]
+        cmd = self._command
         cmd2 = None
         if len(cmd) > 97:
             cmd2, cmd = cmd[97:], cmd[:97]
@@ -66,72 +301,209 @@ class ConsoleView(view.View):
         if cmd2 is not None:
             self._pad.addstr(19, 3, cmd2,
                 CRED + CBOLD + CREVERSE if self._textbox_active else 0)
+        elif self._textbox_active:
+            hint = self._get_hint()
+            if hint:
+                self._pad.addstr(19, 3, hint[:96], CCYAN)
 
         self._draw_pad_to_screen()
 
-    @staticmethod
-    def _convert_reqresp_to_strings(request, response):
-        srequest = [
-            (0, request[i:i+95])
-            for i in range(0, len(request), 95)
-        ]
-        srequest[0] = (0, ">>> " + srequest[0][1])
-
-        jresponse = json.dumps(response, indent=4, sort_keys=True).split("\n")
-        # TODO: if error, set 2 not 1
-        sresponse = [
-            (1, l[i:i+99])
-            for l in jresponse
-            for i in range(0, len(l), 99)
-        ]
+    def _get_hint(self):
+        """ Completion candidates, or the arguments of the method being typed. """
+        if self._candidates:
+            return " ".join(self._candidates)
+
+        if self._help is None:
+            return None
+
+        method, _ = command.line_context(self._command)
+        args = self._help.get_args(method)
+        if args is None:
+            return None
+
+        return "{} {}".format(method, args)
 
-        return srequest + sresponse + [(-1, "")]
+    async def _load_help(self):
+        """
+        Fetch the method list for completion. "help" is parsed once per
+        node version and the result cached on disk.
+        """
+        try:
+            version = (await self._client.request("getnetworkinfo"))["result"]["version"]
+        except RPCError:
+            return
+
+        filename = os.path.join(self._cachedir, "help-{}.json".format(version))
+        try:
+            with open(filename, "r") as f:
+                methods = json.loads(f.read())
+        except (OSError, ValueError):
+            try:
+                text = (await self._client.request("help"))["result"]
+            except RPCError:
+                return
+
+            methods = command.parse_help(text)
+            try:
+                os.makedirs(self._cachedir, exist_ok=True)
+                with open(filename, "w") as f:
+                    f.write(json.dumps(methods))
+            except OSError:
+                pass
+
+        self._help = command.HelpIndex(methods)
+        await self._draw_if_visible()
+
+    async def on_history(self, history):
+        # Keep anything entered while the history was loading.
+        for request in reversed(list(self._command_history.iter_prefix(""))):
+            history.add(request)
+
+        self._command_history = history
+        self._recall = None
+
+    async def _request_result(self, method, params):
+        d = await self._client.request(method, params=params or None, timeout=None)
+        return d["result"]
+
+    def _command_job(self, call):
+        async def job():
+            # Console commands may legitimately take minutes.
+            params = await command.resolve(call.params, self._request_result)
+
+            # Only the projection is formatted and kept. Where the pipeline
+            # starts by iterating over a container, that part of the
+            # response is projected as it is decoded; otherwise a large
+            # response is filtered and formatted in a worker. Anything
+            # smaller is kept raw and formatted when it is shown.
+            keys, project, pipeline = command.split_stream(call.pipeline)
+            return await self._client.request(
+                call.method, params=params or None, timeout=None,
+                path=keys, project=project,
+                prepare=functools.partial(prepare_response, pipeline),
+                offload=format_prepared)
+
+        return job
+
+    def _batch_job(self, filename):
+        async def job():
+            # Every command in the script, as one JSON-RPC batch.
+            try:
+                with open(os.path.expanduser(filename), "r") as f:
+                    calls = [call for _, call in command.parse_script(f)]
+            except (IOError, command.ParseError) as e:
+                return "{}: {}".format(filename, e)
+
+            batch = []
+            for call in calls:
+                params = await command.resolve(call.params, self._request_result)
+                batch.append((call.method, params or None))
+
+            responses = await self._client.request_batch(batch, timeout=None)
+            for call, d in zip(calls, responses):
+                if call.pipeline and d["error"] is None:
+                    d["result"] = command.evaluate(call.pipeline, d["result"])
+
+            return responses
+
+        return job
+
+    def _parse_request(self, request):
+        """ [(text, job)] for a command line; raises command.ParseError. """
+        if request.startswith(BATCH_COMMAND):
+            filename = request[len(BATCH_COMMAND):].strip()
+            if not filename:
+                raise command.ParseError("usage: {} <file>".format(BATCH_COMMAND))
+            return [(request, self._batch_job(filename))]
+
+        return [
+            (text, self._command_job(call))
+            for text, call in command.parse(request)
+        ]
 
     async def _submit_command(self):
-        # TODO: parse, allow nested, use brackets etc
-        request = self._command_history[-1]
+        request = self._command
         if len(request) == 0:
             return
 
-        parts = request.split(" ")
-        for i in range(len(parts)):
-            # TODO: parse better.
-            if parts[i].isdigit():
-                parts[i] = int(parts[i])
-            elif parts[i] == "false" or parts[i] == "False":
-                parts[i] = False
-            elif parts[i] == "true" or parts[i] == "True":
-                parts[i] = True
-            else:
-                try:
-                    parts[i] = decimal.Decimal(parts[i])
-                except: 
-                    pass
-
-        cmd = parts[0]
-        if len(parts) > 1:
-            params = parts[1:]
-        else:
-            params = None
+        self._command_history.add(request)
 
         try:
-            response = await self._client.request(cmd, params=params)
-        except RPCError as e:
-            response = str(e)
-
-        self._response_history.append(
-            (request, response),
-        )
-        self._response_history_strings.extend(
-            self._convert_reqresp_to_strings(request, response),
-        )
-
-        self._command_history.append("") # add a new, empty command
-        self._response_history_offset = len(self._response_history_strings) - 17
+            jobs = self._parse_request(request)
+        except command.ParseError as e:
+            ident = self._response_history.append(request)
+            self._response_history.set_response(ident, "parse error: {}".format(e))
+            jobs = []
+
+        idents = [self._response_history.append(text) for text, _ in jobs]
+        if jobs:
+            # ;-separated commands run one after another.
+            task = asyncio.ensure_future(self._run_commands(
+                [(ident, job) for ident, (_, job) in zip(idents, jobs)]))
+            for ident in idents:
+                self._running[ident] = (task, time.time())
+
+        self._command = ""
+        self._recall = None
+        self._candidates = None
+        self._response_history_offset = max(len(self._response_history) - 17, 0)
         self._textbox_active = not self._textbox_active
 
         await self._draw_if_visible()
 
+    async def _run_commands(self, jobs):
+        finished = 0
+        try:
+            for ident, job in jobs:
+                try:
+                    response = await job()
+                except RPCError as e:
+                    response = str(e)
+                except command.FilterError as e:
+                    response = "filter error: {}".format(e)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    # Such as a truncated response, or a dropped connection.
+                    response = "error: {}".format(e)
+
+                self._set_response(ident, response)
+                finished += 1
+                await self._draw_if_visible()
+        except asyncio.CancelledError:
+            # bitcoind carries on regardless; we just stop waiting.
+            pass
+        finally:
+            for ident, _ in jobs[finished:]:
+                self._set_response(ident, "cancelled")
+
+        await self._draw_if_visible()
+
+    def _set_response(self, ident, response):
+        at_end = self._response_history_offset >= len(self._response_history) - 17
+
+        self._running.pop(ident, None)
+        self._response_history.set_response(ident, response)
+
+        if at_end:
+            self._response_history_offset = max(len(self._response_history) - 17, 0)
+
+    def _status(self, ident):
+        _, started = self._running[ident]
+        return "{} running for {:.0f}s".format(
+            SPINNER[self._spinner % len(SPINNER)], time.time() - started)
+
+    async def _cancel_command(self):
+        """ Cancel the most recent command still running. """
+        if self._running:
+            task, _ = next(reversed(self._running.values()))
+            task.cancel()
+
+    async def on_tick(self, dt):
+        if self._running:
+            self._spinner += 1
+            await self._draw_if_visible()
+
     async def _scroll_back_response_history(self):
         if self._response_history_offset == 0:
             return # At the beginning already.
@@ -141,32 +513,111 @@ class ConsoleView(view.View):
         await self._draw_if_visible()
 
     async def _scroll_forward_response_history(self):
-        if self._response_history_offset > len(self._response_history_strings) - 18:
+        if self._response_history_offset > len(self._response_history) - 18:
             return # At the end already.
 
         self._response_history_offset += 1
 
         await self._draw_if_visible()
 
+    def _complete(self):
+        """ Complete the method name being typed. """
+        method, word = command.line_context(self._command)
+        if self._help is None or method is not None or word is None:
+            return
+
+        names = self._help.complete(word)
+        if not names:
+            return
+
+        if len(names) == 1:
+            completion = names[0] + " "
+            self._candidates = None
+        else:
+            completion = os.path.commonprefix(names)
+            self._candidates = names
+
+        command_line = self._command[:len(self._command)-len(word)] + completion
+        if len(command_line) <= MAX_COMMAND:
+            self._command = command_line
+
+    def _recall_older(self):
+        if self._recall is None:
+            self._recall = cmdhistory.Recall(self._command_history, self._command)
+
+        match = self._recall.older()
+        if match is not None:
+            self._command = match
+
+    def _recall_newer(self):
+        if self._recall is None:
+            return
+
+        match = self._recall.newer()
+        self._command = match if match is not None else self._recall.prefix
+
+    def _handle_search_keypress(self, key):
+        if (len(key) == 1 and ord(key) == 127) or key == "KEY_BACKSPACE":
+            self._recall = cmdhistory.Recall(self._command_history, self._recall.prefix[:-1])
+            self._recall.older()
+        elif len(key) == 1 and key.isprintable():
+            self._recall = cmdhistory.Recall(self._command_history, self._recall.prefix + key)
+            self._recall.older()
+        else:
+            # Anything else takes the match to the command line for editing.
+            self._command = self._recall.get() or self._recall.prefix
+            self._searching = False
+            self._recall = None
+
     async def handle_keypress(self, key):
+        if key == CANCEL_KEY:
+            await self._cancel_command()
+            return None
+
+        if key == SEARCH_KEY:
+            if not self._searching:
+                self._textbox_active = True
+                self._searching = True
+                self._candidates = None
+                self._recall = cmdhistory.Recall(self._command_history, "")
+            self._recall.older()
+            await self._draw_if_visible()
+            return None
+
+        if self._searching:
+            self._handle_search_keypress(key)
+            await self._draw_if_visible()
+            return None
+
         if key == "\t" or key == "KEY_TAB":
-            self._textbox_active = not self._textbox_active
+            if self._textbox_active and self._command:
+                self._complete()
+            else:
+                self._textbox_active = not self._textbox_active
             key = None
         elif self._textbox_active:
-            if (len(key) == 1 and ord(key) == 127) or key == "KEY_BACKSPACE":
-                self._command_history[-1] = self._command_history[-1][:-1]
+            if key == "KEY_UP":
+                self._recall_older()
+                key = None
+            elif key == "KEY_DOWN":
+                self._recall_newer()
+                key = None
+            elif (len(key) == 1 and ord(key) == 127) or key == "KEY_BACKSPACE":
+                self._command = self._command[:-1]
+                self._recall = None
+                self._candidates = None
 
                 key = None
             elif key == "KEY_RETURN" or key == "\n":
-                # We use ensure_future so as not to block the keypad loop on
-                #   an RPC call
-                # asyncio.ensure_future(self._submit_command())
+                # The RPC call itself runs in the background.
                 await self._submit_command()
                 return None
             elif len(key) == 1:
                 # TODO: check if it's printable etc
-                if len(self._command_history[-1]) < 190:
-                    self._command_history[-1] += key
+                if len(self._command) < MAX_COMMAND:
+                    self._command += key
+                self._recall = None
+                self._candidates = None
 
                 key = None
         else:
@@ -185,8 +636,13 @@ class ConsoleView(view.View):
         """ Overrides view.View to set the textbox inactive. """
         if newmode != self._mode_name:
             self._textbox_active = False
+            self._searching = False
+            self._recall = None
             self._visible = False
             return
 
+        if self._help is None and (self._help_task is None or self._help_task.done()):
+            self._help_task = asyncio.ensure_future(self._load_help())
+
         self._visible = True
         await self._draw_if_visible()
@@ -39,7 +39,7 @@ class FooterView(object):
                 modifier += CREVERSE
             self._pad.addstr(0, x, first_char, modifier + CYELLOW)
             self._pad.addstr(0, x+1, rest, modifier)
-            x += len(mode_string) + 5
+            x += len(mode_string) + 3
 
         if self._dt:
             self._pad.addstr(0, 81, isoformatseconds(self._dt)[:19], CYELLOW + CBOLD)
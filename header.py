@@ -27,6 +27,7 @@ class HeaderView(object):
         self._connectioncount = None
         self._nettotals = None
         self._balance = None
+        self._walletcount = 0
 
         self._window_size = MIN_WINDOW_SIZE
 
@@ -90,6 +91,8 @@ class HeaderView(object):
             ), CBOLD + CGREEN)
 
         if self._balance is not None:
+            if self._walletcount > 1:
+                self._pad.addstr(0, 72, "{} wallets".format(self._walletcount), CBOLD)
             self._pad.addstr(0, 82, "{: 14.8f} {}".format(
                 self._balance[0],
                 currency
@@ -164,14 +167,22 @@ class HeaderView(object):
 
         await self.draw()
 
-    async def on_walletinfo(self, key, obj):
+    async def on_walletinfos(self, walletinfos):
+        """ getwalletinfo results for every loaded wallet; shows the total. """
         try:
-            bal = obj["result"]["balance"]
-            ubal = obj["result"]["unconfirmed_balance"]
-            ibal = obj["result"]["immature_balance"]
-            self._balance = (bal, ubal, ibal)
+            bal = sum(w["balance"] for w in walletinfos)
+            ubal = sum(w["unconfirmed_balance"] for w in walletinfos)
+            ibal = sum(w["immature_balance"] for w in walletinfos)
         except KeyError:
-            pass
+            return
+
+        balance = (bal, ubal, ibal) if walletinfos else None
+        if (balance, len(walletinfos)) == (self._balance, self._walletcount):
+            # Nothing to redraw.
+            return
+
+        self._balance = balance
+        self._walletcount = len(walletinfos)
 
         await self.draw()
 
@@ -0,0 +1,101 @@
+# Copyright (c) 2014-2017 esotericnonsense (Daniel Edgecumbe)
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or https://opensource.org/licenses/mit-license.php
+
+import array
+
+
+class RingBuffer(object):
+    """ Fixed-capacity, array-backed FIFO of numbers. """
+    def __init__(self, capacity, typecode="d"):
+        self._capacity = capacity
+        self._data = array.array(typecode, [0]) * capacity
+        self._next = 0  # index of the next write
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, value):
+        self._data[self._next] = value
+        self._next = (self._next + 1) % self._capacity
+        if self._count < self._capacity:
+            self._count += 1
+
+    def latest(self):
+        if not self._count:
+            raise IndexError("latest() on an empty RingBuffer")
+
+        return self._data[self._next - 1]
+
+    def last(self, n=None):
+        """ The most recent n values (all if None), oldest first. """
+        if n is None or n > self._count:
+            n = self._count
+        if n <= 0:
+            return []
+
+        start = self._next - n
+        if start >= 0:
+            return self._data[start:self._next].tolist()
+
+        return (self._data[start:].tolist() +
+                self._data[:self._next].tolist())
+
+    def clear(self):
+        self._next = 0
+        self._count = 0
+
+
+class RateHistory(object):
+    """
+    (up, down) rate samples kept at several resolutions.
+
+    The first resolution stores samples as they arrive; the coarser ones are
+    averages over fixed wall-clock buckets, rolled up incrementally as each
+    sample is added. Every resolution has the same capacity, so memory use is
+    independent of uptime.
+    """
+    def __init__(self, resolutions, capacity):
+        self._resolutions = resolutions  # seconds per bucket, finest first
+        self._series = [
+            (RingBuffer(capacity), RingBuffer(capacity))
+            for _ in resolutions
+        ]
+        # [bucket id, sum up, sum down, count] for each rollup in progress
+        self._partial = [None for _ in resolutions]
+
+    def add(self, timestamp, up, down):
+        ups, downs = self._series[0]
+        ups.append(up)
+        downs.append(down)
+
+        for i in range(1, len(self._resolutions)):
+            bucket = int(timestamp // self._resolutions[i])
+            partial = self._partial[i]
+            if partial is not None and partial[0] != bucket:
+                ups, downs = self._series[i]
+                ups.append(partial[1] / partial[3])
+                downs.append(partial[2] / partial[3])
+                partial = None
+
+            if partial is None:
+                self._partial[i] = [bucket, up, down, 1]
+            else:
+                partial[1] += up
+                partial[2] += down
+                partial[3] += 1
+
+    def get(self, index, n):
+        """ Up to n (up, down) pairs at a resolution, oldest first. """
+        ups, downs = self._series[index]
+        partial = self._partial[index]
+        if partial is not None:
+            # Show the bucket that is still being filled, too.
+            n -= 1
+
+        pairs = list(zip(ups.last(n), downs.last(n)))
+        if partial is not None:
+            pairs.append((partial[1] / partial[3], partial[2] / partial[3]))
+
+        return pairs
@@ -3,11 +3,15 @@
 # file COPYING or https://opensource.org/licenses/mit-license.php
 
 import curses
+import locale
 
 from macros import MIN_WINDOW_SIZE
 
 
 def init_curses():
+    # Needed for the unicode chart glyphs.
+    locale.setlocale(locale.LC_ALL, "")
+
     window = curses.initscr()
     curses.noecho()
     curses.curs_set(0)
@@ -0,0 +1,137 @@
+# Copyright (c) 2014-2017 esotericnonsense (Daniel Edgecumbe)
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or https://opensource.org/licenses/mit-license.php
+
+import array
+import bisect
+import functools
+import gzip
+import ipaddress
+import socket
+
+
+def parse_host(addr):
+    """ Strip the port from a getpeerinfo addr, returning the host. """
+    if addr.startswith("["):
+        return addr[1:].split("]", 1)[0]
+
+    if addr.count(":") == 1:
+        return addr.rsplit(":", 1)[0]
+
+    return addr
+
+
+class IPASNDatabase(object):
+    """
+    Offline IP to (ASN, country) lookups.
+
+    Loaded from a local tab separated range file in the iptoasn.com format
+    (ip2asn-combined.tsv, optionally gzipped):
+
+        range_start  range_end  AS_number  country_code  AS_description
+
+    Ranges are held as sorted start/end arrays per address family and looked
+    up by bisection.
+    """
+    def __init__(self):
+        self._v4_starts = array.array("L")
+        self._v4_ends = array.array("L")
+        self._v4_asns = array.array("L")
+        self._v4_countries = array.array("H")
+
+        # 128 bit integers don't fit an array; these are plain lists.
+        self._v6_starts = []
+        self._v6_ends = []
+        self._v6_asns = array.array("L")
+        self._v6_countries = array.array("H")
+
+        self._countries = []  # index -> country code
+        self._country_index = {}  # country code -> index
+        self._names = {}  # asn -> description
+
+        self.lookup_addr = functools.lru_cache(maxsize=4096)(self._lookup_addr)
+
+    def _country(self, code):
+        try:
+            return self._country_index[code]
+        except KeyError:
+            self._country_index[code] = len(self._countries)
+            self._countries.append(code)
+            return self._country_index[code]
+
+    def _add(self, start, end, asn, country):
+        # socket is a lot quicker than ipaddress for the bulk load.
+        if ":" not in start:
+            self._v4_starts.append(int.from_bytes(socket.inet_aton(start), "big"))
+            self._v4_ends.append(int.from_bytes(socket.inet_aton(end), "big"))
+            self._v4_asns.append(asn)
+            self._v4_countries.append(self._country(country))
+        else:
+            self._v6_starts.append(int.from_bytes(socket.inet_pton(socket.AF_INET6, start), "big"))
+            self._v6_ends.append(int.from_bytes(socket.inet_pton(socket.AF_INET6, end), "big"))
+            self._v6_asns.append(asn)
+            self._v6_countries.append(self._country(country))
+
+    @classmethod
+    def load(cls, filename):
+        db = cls()
+
+        opener = gzip.open if filename.endswith(".gz") else open
+        with opener(filename, "rt") as f:
+            for line in f:
+                parts = line.rstrip("\n").split("\t")
+                if len(parts) < 4 or line.startswith("#"):
+                    continue
+
+                try:
+                    asn = int(parts[2])
+                except ValueError:
+                    continue
+
+                if asn == 0:
+                    # "Not routed"
+                    continue
+
+                try:
+                    db._add(parts[0], parts[1], asn, parts[3])
+                except OSError:
+                    raise ValueError("{}: bad address range {}".format(filename, line.strip()))
+                if len(parts) > 4 and asn not in db._names:
+                    db._names[asn] = parts[4]
+
+        if (list(db._v4_starts) != sorted(db._v4_starts) or
+                db._v6_starts != sorted(db._v6_starts)):
+            raise ValueError("{}: ranges are not sorted".format(filename))
+
+        return db
+
+    def lookup(self, ip):
+        """ (asn, country) for an ipaddress object, or None. """
+        if ip.version == 4:
+            starts, ends = self._v4_starts, self._v4_ends
+            asns, countries = self._v4_asns, self._v4_countries
+        else:
+            starts, ends = self._v6_starts, self._v6_ends
+            asns, countries = self._v6_asns, self._v6_countries
+
+        value = int(ip)
+        i = bisect.bisect_right(starts, value) - 1
+        if i < 0 or value > ends[i]:
+            return None
+
+        return asns[i], self._countries[countries[i]]
+
+    def _lookup_addr(self, addr):
+        try:
+            ip = ipaddress.ip_address(parse_host(addr))
+        except ValueError:
+            # onion, i2p etc.
+            return None
+
+        if ip.version == 6 and ip.ipv4_mapped is not None:
+            ip = ip.ipv4_mapped
+
+        return self.lookup(ip)
+
+    def get_name(self, asn):
+        return self._names.get(asn, "")
@@ -0,0 +1,199 @@
+# Copyright (c) 2014-2017 esotericnonsense (Daniel Edgecumbe)
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or https://opensource.org/licenses/mit-license.php
+
+import asyncio
+import codecs
+
+# ujson has no raw_decode.
+import json
+
+CHUNK_SIZE = 64 * 1024
+
+DECODER = json.JSONDecoder()
+WHITESPACE = " \t\n\r"
+NUMBER_TAIL = ".eE+-0123456789"
+
+# Frame fields and states.
+CONTAINER, PATH, TARGET, STATE, KEY = 0, 1, 2, 3, 4
+OBJECT_START, OBJECT_KEY, OBJECT_COLON, OBJECT_VALUE, OBJECT_NEXT = 0, 1, 2, 3, 4
+ARRAY_START, ARRAY_VALUE, ARRAY_NEXT = 5, 6, 7
+
+INCOMPLETE = object()
+DESCENDED = object()
+
+
+class StreamDecoder(object):
+    """
+    Decodes a JSON document fed to it in chunks.
+
+    Only the containers on the way to path (a tuple of object keys and
+    array indices) are decoded piece by piece; everything else, including
+    each element of the container at path, goes to the C decoder whole
+    once it has arrived. The elements of the container at path are passed
+    through project as they are decoded, so only the projections are kept.
+
+    A value that is still incomplete is retried once the unread text has
+    doubled, so that large values don't make decoding quadratic.
+    """
+    def __init__(self, path=None, project=None):
+        self._path = tuple(path) if path is not None else None
+        self._project = project or (lambda value: value)
+
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._text = ""
+        self._pos = 0
+        self._chunks = []  # not yet joined onto the text
+        self._unread = 0
+        self._retry = 0  # unread length needed before decoding again
+        self._eof = False
+
+        self._stack = []  # [container, path, target, state, key]
+        self._done = False
+        self._value = None
+
+    def feed(self, data):
+        chunk = self._utf8.decode(data, self._eof)
+        self._chunks.append(chunk)
+        self._unread += len(chunk)
+        if self._unread < self._retry and not self._eof:
+            return
+
+        self._text = self._text[self._pos:] + "".join(self._chunks)
+        self._pos = 0
+        self._chunks = []
+        self._run()
+        self._unread = len(self._text) - self._pos
+
+    def close(self):
+        """ The decoded document; raises ValueError if it is incomplete. """
+        self._eof = True
+        self.feed(b"")
+        if not self._done:
+            raise ValueError("truncated JSON")
+
+        return self._value
+
+    def _error(self, message):
+        raise ValueError("{} in JSON".format(message))
+
+    def _decode(self):
+        try:
+            value, end = DECODER.raw_decode(self._text, self._pos)
+        except ValueError:
+            if self._eof:
+                raise
+            self._retry = 2 * (len(self._text) - self._pos)
+            return INCOMPLETE
+
+        if not self._eof and (end == len(self._text) or self._text[end] in NUMBER_TAIL):
+            # A number cut short by the end of the chunk ("1.", "1e").
+            return INCOMPLETE
+
+        self._retry = 0
+        self._pos = end
+        return value
+
+    def _value_at(self, path):
+        c = self._text[self._pos]
+        if c in "[{" and self._path is not None and path == self._path[:len(path)]:
+            state = ARRAY_START if c == "[" else OBJECT_START
+            container = [] if c == "[" else {}
+            self._stack.append([container, path, path == self._path, state, None])
+            self._pos += 1
+            return DESCENDED
+
+        return self._decode()
+
+    def _store(self, value):
+        if not self._stack:
+            self._done = True
+            self._value = value
+            return
+
+        frame = self._stack[-1]
+        if frame[TARGET]:
+            value = self._project(value)
+
+        if frame[STATE] == OBJECT_VALUE:
+            frame[CONTAINER][frame[KEY]] = value
+            frame[STATE] = OBJECT_NEXT
+        else:
+            frame[CONTAINER].append(value)
+            frame[STATE] = ARRAY_NEXT
+
+    def _close(self):
+        self._pos += 1
+        self._store(self._stack.pop()[CONTAINER])
+
+    def _run(self):
+        text = self._text
+        while True:
+            while self._pos < len(text) and text[self._pos] in WHITESPACE:
+                self._pos += 1
+            if self._pos == len(text):
+                return
+
+            if not self._stack:
+                if self._done:
+                    self._error("trailing data")
+                value = self._value_at(())
+                if value is INCOMPLETE:
+                    return
+                if value is not DESCENDED:
+                    self._store(value)
+                continue
+
+            frame = self._stack[-1]
+            state = frame[STATE]
+            c = text[self._pos]
+
+            if state == OBJECT_START and c == "}":
+                self._close()
+            elif state == ARRAY_START and c == "]":
+                self._close()
+            elif state in (OBJECT_START, OBJECT_KEY):
+                if c != '"':
+                    self._error("expected a key")
+                key = self._decode()
+                if key is INCOMPLETE:
+                    return
+                frame[KEY] = key
+                frame[STATE] = OBJECT_COLON
+            elif state == OBJECT_COLON:
+                if c != ":":
+                    self._error("expected ':'")
+                self._pos += 1
+                frame[STATE] = OBJECT_VALUE
+            elif state in (OBJECT_VALUE, ARRAY_START, ARRAY_VALUE):
+                if state != OBJECT_VALUE:
+                    frame[STATE] = ARRAY_VALUE
+                    key = len(frame[CONTAINER])
+                else:
+                    key = frame[KEY]
+
+                value = self._value_at(frame[PATH] + (key, ))
+                if value is INCOMPLETE:
+                    return
+                if value is not DESCENDED:
+                    self._store(value)
+            elif c == ",":
+                self._pos += 1
+                frame[STATE] = OBJECT_KEY if state == OBJECT_NEXT else ARRAY_VALUE
+            elif c == ("}" if state == OBJECT_NEXT else "]"):
+                self._close()
+            else:
+                self._error("unexpected {}".format(c))
+
+
+async def decode_chunks(chunks, path=None, project=None):
+    """
+    Decode an async iterator of byte chunks with a StreamDecoder, letting
+    the event loop run between chunks.
+    """
+    decoder = StreamDecoder(path, project)
+    async for chunk in chunks:
+        decoder.feed(chunk)
+        await asyncio.sleep(0)
+
+    return decoder.close()
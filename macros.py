@@ -4,7 +4,7 @@
 
 VERSION_STRING = "bitcoind-ncurses v0.3.1"
 
-MODES = ["monitor", "peers", "wallet", "block", "transaction", "console", "net"]
+MODES = ["monitor", "peers", "wallet", "block", "transaction", "console", "net", "stats"]
 DEFAULT_MODE = "monitor"
 
 # TX_VERBOSE_MODE controls whether the prevouts for an input are fetched.
@@ -2,12 +2,16 @@
 # Distributed under the MIT software license, see the accompanying
 # file COPYING or https://opensource.org/licenses/mit-license.php
 
+import time
+STARTED = time.perf_counter()  # before the imports, for --startup-benchmark
+
 import argparse
 import os
 import asyncio
 import datetime
 
 import rpc
+import transport
 import interface
 import modes
 import splash
@@ -20,6 +24,9 @@ import transaction
 import net
 import wallet
 import console
+import stats
+import cmdhistory
+import chaincache
 
 
 async def keypress_loop(window, callback, resize_callback):
@@ -49,9 +56,14 @@ async def keypress_loop(window, callback, resize_callback):
         await handle_keypress(key)
 
 
-async def poll_client(client, method, callback, sleeptime, params=None):
+class StartupBenchmark(Exception):
+    """ Raised to stop once the first frame with node data is drawn. """
+    pass
+
+
+async def poll_client(client, method, callback, sleeptime, params=None, delay=0.1):
     # Allow the rest of the program to start.
-    await asyncio.sleep(0.1)
+    await asyncio.sleep(delay)
 
     while True:
         try:
@@ -65,6 +77,77 @@ async def poll_client(client, method, callback, sleeptime, params=None):
         await asyncio.sleep(sleeptime)
 
 
+async def poll_clients(client, polls, on_ready=None):
+    """
+    Run polls, (method, callback, sleeptime, params) tuples, sending the
+    first round together as one batch so that the views fill in after a
+    single round trip. A poll whose first request fails starts over on
+    its own straight away.
+    """
+    calls = [(method, params) for method, _, _, params in polls]
+    delays = [0] * len(polls)
+    try:
+        responses = await client.request_batch(calls)
+    except (rpc.RPCContentError, rpc.RPCTimeoutError):
+        responses = []
+
+    callbacks = []
+    for i, d in enumerate(responses):
+        method, callback, sleeptime, _ = polls[i]
+        try:
+            rpc.check_response(d)
+        except rpc.RPCContentError:
+            continue
+
+        callbacks.append(callback(method, d))
+        delays[i] = sleeptime
+
+    await asyncio.gather(*callbacks)
+
+    if on_ready is not None:
+        await on_ready()
+
+    await asyncio.gather(*[
+        poll_client(client, method, callback, sleeptime, params=params, delay=delay)
+        for (method, callback, sleeptime, params), delay in zip(polls, delays)
+    ])
+
+
+async def load_ipasn(filename, callback):
+    import ipasn
+
+    # Loading takes a second or so; keep it off the event loop.
+    loop = asyncio.get_event_loop()
+    try:
+        db = await loop.run_in_executor(None, ipasn.IPASNDatabase.load, filename)
+    except (IOError, ValueError):
+        # TODO: tell the user somehow.
+        return
+
+    await callback(db)
+
+
+async def load_history(filename, callback):
+    loop = asyncio.get_event_loop()
+    try:
+        history = await loop.run_in_executor(None, cmdhistory.CommandHistory.load, filename)
+    except OSError:
+        # Carry on without saving.
+        return
+
+    await callback(history)
+
+
+async def poll_wallets(walletset, callback):
+    # Allow the rest of the program to start.
+    await asyncio.sleep(0.1)
+
+    while True:
+        if await walletset.poll():
+            await callback()
+        await walletset.wait()
+
+
 async def tick(callback, sleeptime):
     # Allow the rest of the program to start.
     await asyncio.sleep(0.1)
@@ -86,44 +169,87 @@ def initialize():
                         action='store_true',
                         dest="nosplash",
                         default=False)
+    parser.add_argument("--cachedir",
+                        help="path for console history and cached node data "
+                             "[~/.bitcoind-ncurses/]",
+                        default=os.path.expanduser("~/.bitcoind-ncurses/"))
+    parser.add_argument("--cachesize",
+                        help="MiB of confirmed blocks and transactions to keep "
+                             "in the cachedir across sessions, 0 for none [512]",
+                        type=int,
+                        default=chaincache.DEFAULT_SIZE // (1024 * 1024))
+    parser.add_argument("--cachedepth",
+                        help="confirmations before a block or transaction is "
+                             "cached [{}]".format(chaincache.DEFAULT_DEPTH),
+                        type=int,
+                        default=chaincache.DEFAULT_DEPTH)
+    parser.add_argument("--transport",
+                        help="HTTP client for RPC: aiohttp, or the lighter "
+                             "builtin one [aiohttp]",
+                        choices=transport.TRANSPORTS,
+                        default="aiohttp")
+    parser.add_argument("--rpcunix",
+                        help="connect to RPC through this Unix socket (e.g. "
+                             "a proxy to the node) with the builtin transport [None]",
+                        default=None)
+    parser.add_argument("--rest",
+                        help="fetch blocks and transactions in binary over "
+                             "the REST interface (bitcoind -rest) [False]",
+                        action='store_true',
+                        default=False)
+    parser.add_argument("--blockfiles",
+                        help="read blocks from the blk*.dat files under "
+                             "the datadir, for a node on this host [False]",
+                        action='store_true',
+                        default=False)
+    parser.add_argument("--startup-benchmark",
+                        help="print the time to the first frame with node "
+                             "data, and quit [False]",
+                        action='store_true',
+                        dest="startup_benchmark",
+                        default=False)
+    parser.add_argument("--ip2asn",
+                        help="offline IP to ASN database for peer annotation "
+                             "(iptoasn.com ip2asn-combined.tsv[.gz]) [None]",
+                        default=None)
     args = parser.parse_args()
 
-    url = rpc.get_url_from_datadir(args.datadir)
-    auth = rpc.get_auth_from_datadir(args.datadir)
-    client = rpc.BitcoinRPCClient(url, auth)
-
-    return client, args.nosplash
+    if args.ip2asn is not None and not os.path.isfile(args.ip2asn):
+        parser.error("ip2asn database {} not found".format(args.ip2asn))
 
+    if args.startup_benchmark:
+        args.nosplash = True
 
-def wallet_enabled(client):
-    """ Check if the wallet is enabled. """
-
-    async def check_getwalletinfo(client):
-        try:
-            d = await client.request("getwalletinfo")
-        except (rpc.RPCContentError, rpc.RPCTimeoutError):
-            # TODO: try again on timeout?
-            return False
-
+    cfg = rpc.read_config(args.datadir)
+    url = rpc.get_url_from_config(cfg)
+    auth = rpc.get_auth_from_datadir(args.datadir, cfg)
+    try:
+        rpctransport = transport.make_transport(args.transport, url, auth, args.rpcunix)
+    except ValueError as e:
+        parser.error(str(e))
+    client = rpc.BitcoinRPCClient(rpctransport)
+
+    # The optional sources are only imported when asked for.
+    restclient = None
+    if args.rest:
+        import rest
+        restclient = rest.RESTClient(rpctransport)
+
+    blockreader = None
+    if args.blockfiles:
+        import blockfiles
+        blocksdir = blockfiles.get_blocksdir_from_datadir(args.datadir, cfg)
+        if not os.path.isdir(blocksdir):
+            parser.error("block files directory {} not found".format(blocksdir))
         try:
-            d["result"]["walletname"]
-        except (KeyError, TypeError):
-            return False
-
-        return True
-
-    # Ugly, a synchronous RPC request mechanism would be nice here.
-    check = asyncio.gather(check_getwalletinfo(client))
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(check)
+            blockreader = blockfiles.BlockFiles(blocksdir)
+        except (OSError, ValueError) as e:
+            parser.error("can't read block files: {}".format(e))
 
-    if check.result():
-        return True
+    return client, restclient, blockreader, args
 
-    return False
 
-
-def create_tasks(client, window, nosplash):
+def create_tasks(client, restclient, blockreader, window, args):
     headerview = header.HeaderView()
     footerview = footer.FooterView()
 
@@ -134,25 +260,40 @@ def create_tasks(client, window, nosplash):
     splashview = splash.SplashView(modehandler.set_mode)
 
     monitorview = monitor.MonitorView(client)
-    peerview = peers.PeersView()
+    peerstore = peers.PeerStore()
+    peerview = peers.PeersView(peerstore)
+
+    cache = None
+    if args.cachesize > 0:
+        cache = chaincache.ChainCache(
+            os.path.join(args.cachedir, "chain.sqlite"),
+            depth=args.cachedepth,
+            max_size=args.cachesize * 1024 * 1024,
+        )
 
-    transactionstore = transaction.TransactionStore(client)
+    blockstore = block.BlockStore(client, restclient, blockreader, cache)
+
+    transactionstore = transaction.TransactionStore(client, restclient, blockstore, cache)
     transactionview = transaction.TransactionView(transactionstore)
 
-    blockstore = block.BlockStore(client)
     blockview = block.BlockView(
         blockstore,
         transactionview.set_txid,
         modehandler.set_mode,
     )
 
+    statsstore = stats.ChainStatsStore(client, blockstore)
+    statsview = stats.ChainStatsView(statsstore)
+
     netview = net.NetView()
+    walletset = wallet.WalletSet(client)
     walletview = wallet.WalletView(
+        walletset,
         transactionview.set_txid,
         modehandler.set_mode,
     )
 
-    consoleview = console.ConsoleView(client)
+    consoleview = console.ConsoleView(client, args.cachedir)
 
     modehandler.add_callback("monitor", monitorview.on_mode_change)
     modehandler.add_callback("peers", peerview.on_mode_change)
@@ -161,19 +302,35 @@ def create_tasks(client, window, nosplash):
     modehandler.add_callback("net", netview.on_mode_change)
     modehandler.add_callback("wallet", walletview.on_mode_change)
     modehandler.add_callback("console", consoleview.on_mode_change)
+    modehandler.add_callback("stats", statsview.on_mode_change)
 
     modehandler.add_keypress_handler("block", blockview.handle_keypress)
     modehandler.add_keypress_handler("transaction", transactionview.handle_keypress)
     modehandler.add_keypress_handler("wallet", walletview.handle_keypress)
     modehandler.add_keypress_handler("console", consoleview.handle_keypress)
+    modehandler.add_keypress_handler("stats", statsview.handle_keypress)
+    modehandler.add_keypress_handler("net", netview.handle_keypress)
+    modehandler.add_keypress_handler("peers", peerview.handle_keypress)
 
     async def on_nettotals(key, obj):
         await headerview.on_nettotals(key, obj)
         await netview.on_nettotals(key, obj)
 
     async def on_bestblockhash(key, obj):
-        await monitorview.on_bestblockhash(key, obj)
-        await blockview.on_bestblockhash(key, obj)
+        # Each fetches what it needs for the new tip; don't queue them up.
+        await asyncio.gather(
+            monitorview.on_bestblockhash(key, obj),
+            blockview.on_bestblockhash(key, obj),
+            statsview.on_bestblockhash(key, obj),
+        )
+        try:
+            walletset.on_bestblockhash(obj["result"])
+        except KeyError:
+            pass
+
+    async def on_blockchaininfo(key, obj):
+        await headerview.on_blockchaininfo(key, obj)
+        await transactionview.on_blockchaininfo(key, obj)
 
     async def on_peerinfo(key, obj):
         await headerview.on_peerinfo(key, obj)
@@ -183,6 +340,17 @@ def create_tasks(client, window, nosplash):
         await footerview.on_tick(dt)
         await monitorview.on_tick(dt)
 
+    async def on_walletset():
+        await headerview.on_walletinfos(walletset.get_walletinfos())
+        await walletview.on_walletset()
+
+    async def on_mempoolinfo(key, obj):
+        await monitorview.on_mempoolinfo(key, obj)
+        try:
+            walletset.on_mempoolinfo(obj["result"])
+        except KeyError:
+            pass
+
     async def on_window_resize(y, x):
         interface.check_min_window_size(y, x)
 
@@ -196,59 +364,64 @@ def create_tasks(client, window, nosplash):
         await netview.on_window_resize(y, x)
         await walletview.on_window_resize(y, x)
         await consoleview.on_window_resize(y, x)
+        await statsview.on_window_resize(y, x)
+
+    async def on_polls_ready():
+        if args.startup_benchmark:
+            raise StartupBenchmark(time.perf_counter() - STARTED)
+
+    polls = [
+        ("getbestblockhash", on_bestblockhash, 1.0, None),
+        ("getblockchaininfo", on_blockchaininfo, 5.0, None),
+        ("getnetworkinfo", headerview.on_networkinfo, 5.0, None),
+        ("getnettotals", on_nettotals, 5.0, None),
+        ("getpeerinfo", on_peerinfo, 5.0, None),
+        ("getmempoolinfo", on_mempoolinfo, 5.0, None),
+        ("estimatesmartfee", monitorview.on_estimatesmartfee, 15.0, [2]),
+        ("estimatesmartfee", monitorview.on_estimatesmartfee, 15.0, [5]),
+        ("estimatesmartfee", monitorview.on_estimatesmartfee, 15.0, [10]),
+        # This is a bit lazy because we could just do it once and calculate it.
+        ("uptime", monitorview.on_uptime, 5.0, [10]),
+    ]
 
     ty, tx = window.getmaxyx()
     tasks = [
-        poll_client(client, "getbestblockhash",
-                    on_bestblockhash, 1.0),
-        poll_client(client, "getblockchaininfo",
-                    headerview.on_blockchaininfo, 5.0),
-        poll_client(client, "getnetworkinfo",
-                    headerview.on_networkinfo, 5.0),
-        poll_client(client, "getnettotals",
-                    on_nettotals, 5.0),
-        poll_client(client, "getpeerinfo",
-                    on_peerinfo, 5.0),
-        poll_client(client, "getmempoolinfo",
-                    monitorview.on_mempoolinfo, 5.0),
-        poll_client(client, "listsinceblock",
-                    walletview.on_sinceblock, 5.0),
-        poll_client(client, "estimatesmartfee",
-                    monitorview.on_estimatesmartfee, 15.0, params=[2]),
-        poll_client(client, "estimatesmartfee",
-                    monitorview.on_estimatesmartfee, 15.0, params=[5]),
-        poll_client(client, "estimatesmartfee",
-                    monitorview.on_estimatesmartfee, 15.0, params=[10]),
-        # This is a bit lazy because we could just do it once and calculate it.
-        poll_client(client, "uptime",
-                    monitorview.on_uptime, 5.0, params=[10]),
+        poll_clients(client, polls, on_polls_ready),
         tick(on_tick, 1.0),
+        tick(consoleview.on_tick, 0.25),
+        poll_wallets(walletset, on_walletset),
+        load_history(os.path.join(args.cachedir, "console_history"),
+                     consoleview.on_history),
         keypress_loop(window, modehandler.handle_keypress, on_window_resize),
         on_window_resize(ty, tx),
-        splashview.draw(nosplash),
+        splashview.draw(args.nosplash),
     ]
 
-    if wallet_enabled(client):
-        tasks.append(
-            poll_client(client, "getwalletinfo", headerview.on_walletinfo, 1.0)
-        )
+    if args.ip2asn is not None:
+        tasks.append(load_ipasn(args.ip2asn, peerview.on_ipasn))
+
+    if cache is not None:
+        tasks.append(cache.verify(client))
 
     return tasks
 
 
 def mainfn():
-    client, nosplash = initialize()
-
+    client, restclient, blockreader, args = initialize()
 
+    elapsed = None
     try:
         window = interface.init_curses()
 
-        tasks = create_tasks(client, window, nosplash)
+        tasks = create_tasks(client, restclient, blockreader, window, args)
 
         loop = asyncio.get_event_loop()
         t = asyncio.gather(*tasks)
         loop.run_until_complete(t)
 
+    except StartupBenchmark as e:
+        elapsed = e.args[0]
+
     finally:
         try:
             loop.close()
@@ -256,6 +429,9 @@ def mainfn():
             pass
         interface.end_curses()
 
+    if elapsed is not None:
+        print("first frame with node data after {:.0f}ms".format(elapsed * 1000))
+
 
 if __name__ == "__main__":
     mainfn()
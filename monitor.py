@@ -9,7 +9,8 @@ import asyncio
 from decimal import Decimal
 
 import view
-from rpc import RPCError
+from rpc import RPCError, check_response
+from util import block_subsidy
 
 
 class MonitorView(view.View):
@@ -119,11 +120,7 @@ class MonitorView(view.View):
 
         reward = sum(vout["value"] for vout in bcb["vout"])
 
-        # TODO: if chain is regtest, this is different
-        halvings = bb["height"] // 210000
-        block_subsidy = Decimal(50 * (0.5 ** halvings))
-
-        total_fees = Decimal(reward) - block_subsidy
+        total_fees = Decimal(reward) - block_subsidy(bb["height"])
 
         self._pad.addstr(4, 1, "Block reward: {:.6f} BTC".format(
             reward))
@@ -152,14 +149,23 @@ class MonitorView(view.View):
                 await self._draw()
 
     async def _request_bestblockhash_info(self, bestblockhash):
+        # The header and block in one round trip.
+        try:
+            jh, j = await self._client.request_batch([
+                ("getblockheader", [bestblockhash]),
+                ("getblock", [bestblockhash]),
+            ])
+        except RPCError:
+            return
+
         try:
-            j = await self._client.request("getblockheader", [bestblockhash])
-            self._bestblockheader = j["result"]
+            check_response(jh)
+            self._bestblockheader = jh["result"]
         except RPCError:
             return
 
         try:
-            j = await self._client.request("getblock", [bestblockhash])
+            check_response(j)
             h = j["result"]["hash"]
             self._bestblock = j["result"]
         except (RPCError, KeyError):
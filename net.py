@@ -7,39 +7,40 @@ import curses
 import asyncio
 
 import view
+import chart
+from history import RateHistory
+
+# (seconds per sample, label). The finest is the getnettotals poll interval.
+RESOLUTIONS = [(5, "5s"), (60, "1m"), (3600, "1h")]
+HISTORY_CAPACITY = 200  # samples kept per resolution
 
 
 class NetView(view.View):
     _mode_name = "net"
 
     def __init__(self):
-        self._nettotals_history = []
+        self._last_nettotals = None  # previous raw getnettotals
+        self._history = RateHistory(
+            [seconds for seconds, _ in RESOLUTIONS],
+            HISTORY_CAPACITY,
+        )
+        self._resolution = 0  # index into RESOLUTIONS
+        self._style = 0  # index into chart.STYLES
 
         super().__init__()
 
     async def _draw(self):
         self._clear_init_pad()
 
-        deltas = []
-        if self._nettotals_history:
-            hist = self._nettotals_history
-            i = 1
-            while i < len(hist):
-                prev = hist[i-1]
-                current = hist[i]
-                seconds = (current["timemillis"] - prev["timemillis"]) / 1000
-                if seconds <= 0:
-                    continue
-                up = current["totalbytessent"] - prev["totalbytessent"]
-                down = current["totalbytesrecv"] - prev["totalbytesrecv"]
-
-                deltas.append(
-                    (up/seconds, down/seconds),
-                )
-
-                i += 1
-
-        if not self._nettotals_history or len(deltas) < 1:
+        CYELLOW = curses.color_pair(5)
+        self._pad.addstr(18, 1, "[1/2/3: res, G: style] {} {}".format(
+            RESOLUTIONS[self._resolution][1],
+            chart.STYLES[self._style],
+        ), CYELLOW)
+
+        deltas = self._history.get(self._resolution, HISTORY_CAPACITY)
+
+        if len(deltas) < 1:
             await self._draw_no_chart()
         else:
             await self._draw_chart(deltas)
@@ -62,11 +63,12 @@ class NetView(view.View):
         CGREEN = curses.color_pair(1)
         CCYAN = curses.color_pair(2)
         CBOLD = curses.A_BOLD
-        CREVERSE = curses.A_REVERSE
+        style = chart.STYLES[self._style]
+        capacity = chart_width * chart.samples_per_column(style)
 
         if deltas:
-            if len(deltas) > chart_width:
-                deltas = deltas[-chart_width:]
+            if len(deltas) > capacity:
+                deltas = deltas[-capacity:]
 
             up_str = "Up: {: 9.2f}kB/s".format(deltas[-1][0]/1024).rjust(10)
             down_str = "Down: {: 9.2f}kB/s".format(deltas[-1][1]/1024).rjust(10)
@@ -87,26 +89,43 @@ class NetView(view.View):
                     height = int(math.ceil((1.0 * plot_height * max_down) / max_total))
                     self._pad.addstr(plot_offset-1+height, 1, "{: 5.0f}kB/s".format(max_down//1024).rjust(10), CBOLD)
 
-                for i, delta in enumerate(deltas):
-                    if i > chart_width:
-                        break
-
-                    height = int(math.ceil((1.0 * plot_height * deltas[i][0]) / max_total))
-                    for y in range(0, height):
-                        self._pad.addstr(plot_offset-1-y, i+12, " ", CCYAN + CREVERSE)
-
-                    height = int(math.ceil((1.0 * plot_height * deltas[i][1]) / max_total))
-                    for y in range(0, height):
-                        self._pad.addstr(plot_offset+y, i+12, " ", CGREEN + CREVERSE)
+                # A call per bar or row span rather than one per cell.
+                chart.draw_bars(self._pad, plot_offset-plot_height, 12,
+                    [delta[0] for delta in deltas], max_total, plot_height, style, CCYAN)
+                chart.draw_bars(self._pad, plot_offset, 12,
+                    [delta[1] for delta in deltas], max_total, plot_height, style, CGREEN,
+                    downward=True)
 
     async def on_nettotals(self, key, obj):
         try:
-            self._nettotals_history.append(obj["result"])
+            current = obj["result"]
         except KeyError:
-            pass
+            return
 
-        # Avoid memory leak.
-        if len(self._nettotals_history) > 500:
-            self._nettotals_history = self._nettotals_history[:300]
+        prev, self._last_nettotals = self._last_nettotals, current
+        if prev is None:
+            return
+
+        seconds = (current["timemillis"] - prev["timemillis"]) / 1000
+        if seconds <= 0:
+            return
+
+        up = current["totalbytessent"] - prev["totalbytessent"]
+        down = current["totalbytesrecv"] - prev["totalbytesrecv"]
+        self._history.add(current["timemillis"] / 1000, up/seconds, down/seconds)
 
         await self._draw_if_visible()
+
+    async def handle_keypress(self, key):
+        for i in range(len(RESOLUTIONS)):
+            if key == str(i+1):
+                self._resolution = i
+                await self._draw_if_visible()
+                return None
+
+        if key.lower() == "g":
+            self._style = (self._style + 1) % len(chart.STYLES)
+            await self._draw_if_visible()
+            return None
+
+        return key
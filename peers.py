@@ -7,94 +7,667 @@ import time
 import math
 import curses
 import asyncio
+import bisect
+import heapq
+import collections
 
 import view
+from history import RingBuffer
 
+PEER_HISTORY = 60  # samples kept per peer; 5 minutes at the poll interval
+TOP_TALKERS = 17
 
-class PeersView(view.View):
-    _mode_name = "peers"
 
+def format_addr(addr):
+    addr_str = addr.replace(".onion","").replace(":8333","").replace(":18333","").strip("[").strip("]")
+
+    # truncate long ip addresses (ipv6)
+    return (addr_str[:17] + '...') if len(addr_str) > 20 else addr_str
+
+
+class PeerHistory(object):
+    """ Transfer rates and ping times for one peer, from successive snapshots. """
+    def __init__(self, capacity):
+        self.recv = RingBuffer(capacity, "f")  # bytes/s
+        self.sent = RingBuffer(capacity, "f")  # bytes/s
+        self.ping = RingBuffer(capacity, "f")  # seconds
+
+        self.peer = None  # latest raw getpeerinfo entry
+        self.rate = 0  # latest recv + sent rate, for ranking
+        self.asinfo = None  # (asn, country), set once when annotated
+
+        self._last = None  # (time, bytesrecv, bytessent)
+
+    def update(self, t, peer):
+        self.peer = peer
+
+        if "pingtime" in peer:
+            self.ping.append(peer["pingtime"])
+
+        last, self._last = self._last, (t, peer["bytesrecv"], peer["bytessent"])
+        if last is None or t <= last[0]:
+            return
+
+        seconds = t - last[0]
+        recv = (peer["bytesrecv"] - last[1]) / seconds
+        sent = (peer["bytessent"] - last[2]) / seconds
+        self.recv.append(recv)
+        self.sent.append(sent)
+        self.rate = recv + sent
+
+
+# (name, key function, descending by default)
+SORT_COLUMNS = [
+    ("bytes", lambda p: p["bytesrecv"] + p["bytessent"], True),
+    ("ping", lambda p: p.get("pingtime", float("inf")), False),
+    ("conntime", lambda p: p["conntime"], False),
+    ("height", lambda p: p.get("synced_headers", -1), True),
+    ("direction", lambda p: int(p["inbound"]), True),
+]
+
+# Above this fraction of changed keys, re-sorting beats bisect updates.
+RESORT_FRACTION = 0.125
+
+EVENT_LOG_SIZE = 1000
+CHURN_WINDOWS = [(600, "10m"), (3600, "1h")]  # (seconds, label)
+WATCHED_FIELDS = ["services", "subver", "connection_type"]
+
+PANELS = ["peers", "talkers", "events", "asn"]  # cycled with TAB
+
+ASN_WARN_SHARE = 0.25  # highlight an ASN holding this share of our peers
+
+
+class PeerTable(object):
+    """
+    Peer ids in sorted order, kept up to date incrementally between
+    snapshots, with an optional substring filter on address and version.
+    """
+    def __init__(self):
+        self._column = 0  # index into SORT_COLUMNS
+        self._reverse = False  # relative to the column's default order
+        self._filter = ""
+
+        self._order = []  # sorted [(key, id)]
+        self._keys = {}  # id -> key
+        self._texts = {}  # id -> (addr, subver), lowercased for the filter
+        self._matches = {}  # id -> bool, for the current filter
+        self._rows = None  # cached filtered, ordered ids
+
+    def _key(self, peer):
+        _, keyfunc, descending = SORT_COLUMNS[self._column]
+        value = keyfunc(peer)
+        return -value if descending else value
+
+    def update(self, peers):
+        """ peers is a dict of peer id -> raw getpeerinfo entry. """
+        keys = self._keys
+        texts = self._texts
+        changed = []
+        for ident, peer in peers.items():
+            key = self._key(peer)
+            old = keys.get(ident)
+            if old != key:
+                changed.append((ident, old, key))
+
+            text = (peer["addr"].lower(), peer.get("subver", "").lower())
+            if texts.get(ident) != text:
+                texts[ident] = text
+                if self._matches.pop(ident, None) is not None:
+                    self._rows = None
+
+        removed = [(ident, key) for ident, key in keys.items() if ident not in peers]
+        if not changed and not removed:
+            return
+
+        for ident, _ in removed:
+            del keys[ident]
+            texts.pop(ident, None)
+            self._matches.pop(ident, None)
+        for ident, _, key in changed:
+            keys[ident] = key
+
+        if len(changed) + len(removed) > RESORT_FRACTION * len(self._order):
+            # Timsort is close to linear on the nearly sorted old order.
+            self._order = [(keys[ident], ident) for _, ident in self._order if ident in keys]
+            self._order.extend((key, ident) for ident, old, key in changed if old is None)
+            self._order.sort()
+        else:
+            for ident, key in removed:
+                del self._order[bisect.bisect_left(self._order, (key, ident))]
+            for ident, old, key in changed:
+                if old is not None:
+                    del self._order[bisect.bisect_left(self._order, (old, ident))]
+                bisect.insort(self._order, (key, ident))
+
+        self._rows = None
+
+    def set_sort(self, column, reverse, peers):
+        self._column, self._reverse = column, reverse
+        self._keys = {}
+        self._order = []
+        self.update(peers)
+        self._rows = None
+
+    def get_sort(self):
+        return self._column, self._reverse
+
+    def set_filter(self, text):
+        if text == self._filter:
+            return
+
+        self._filter = text
+        self._matches = {}
+        self._rows = None
+
+    def get_filter(self):
+        return self._filter
+
+    def rows(self, peers):
+        """ The visible peer ids, in display order. """
+        if self._rows is not None:
+            return self._rows
+
+        ids = (ident for _, ident in self._order)
+        if self._filter:
+            needle = self._filter.lower()
+            matches = self._matches
+            selected = []
+            for ident in ids:
+                try:
+                    match = matches[ident]
+                except KeyError:
+                    addr, subver = self._texts[ident]
+                    match = matches[ident] = needle in addr or needle in subver
+                if match:
+                    selected.append(ident)
+        else:
+            selected = list(ids)
+
+        if self._reverse:
+            selected.reverse()
+
+        self._rows = selected
+        return selected
+
+
+class PeerEventLog(object):
+    """ Bounded log of peer connects, disconnects and changes, with churn. """
+    def __init__(self):
+        self._events = collections.deque(maxlen=EVENT_LOG_SIZE)  # (time, kind, id, addr, detail)
+        # Timestamps within the longest churn window, oldest first.
+        self._connects = collections.deque()
+        self._disconnects = collections.deque()
+
+        self.total_connects = 0
+        self.total_disconnects = 0
+
+    def connect(self, t, peer):
+        self._events.append((t, "+", peer["id"], peer["addr"], peer.get("connection_type", "")))
+        self._connects.append(t)
+        self.total_connects += 1
+
+    def disconnect(self, t, peer):
+        self._events.append((t, "-", peer["id"], peer["addr"], ""))
+        self._disconnects.append(t)
+        self.total_disconnects += 1
+
+    def change(self, t, peer, field, old, new):
+        self._events.append((t, "~", peer["id"], peer["addr"],
+            "{}: {} -> {}".format(field, old, new)))
+
+    def prune(self, t):
+        horizon = t - max(seconds for seconds, _ in CHURN_WINDOWS)
+        for stamps in (self._connects, self._disconnects):
+            while stamps and stamps[0] < horizon:
+                stamps.popleft()
+
+    def get_churn(self, t):
+        """ [(label, connects, disconnects)] for each churn window. """
+        def count_since(stamps, since):
+            n = 0
+            for stamp in reversed(stamps):
+                if stamp < since:
+                    break
+                n += 1
+            return n
+
+        return [
+            (label,
+             count_since(self._connects, t - seconds),
+             count_since(self._disconnects, t - seconds))
+            for seconds, label in CHURN_WINDOWS
+        ]
+
+    def __len__(self):
+        return len(self._events)
+
+    def get_events(self, offset, n):
+        """ Up to n events, newest first, skipping the newest offset. """
+        events = self._events
+        return [
+            events[i]
+            for i in range(len(events) - 1 - offset, max(len(events) - 1 - offset - n, -1), -1)
+        ]
+
+
+class PeerStore(object):
     def __init__(self):
         self._peerinfo = None  # raw data from getpeerinfo
+        self._peers = {}  # peer id -> PeerHistory
+        self._byid = {}  # peer id -> latest raw getpeerinfo entry
+        self._table = PeerTable()
+        self._log = PeerEventLog()
+
+        self._ipasn = None  # ipasn.IPASNDatabase
+        self._asn_counts = collections.Counter()  # asn -> connected peers
+        self._country_counts = collections.Counter()
+
+    def _annotate(self, history):
+        """ Look up a newly seen peer once; redraws reuse the result. """
+        if self._ipasn is None:
+            return
+
+        history.asinfo = self._ipasn.lookup_addr(history.peer["addr"])
+        if history.asinfo is not None:
+            asn, country = history.asinfo
+            self._asn_counts[asn] += 1
+            self._country_counts[country] += 1
+
+    def _unannotate(self, history):
+        if history.asinfo is not None:
+            asn, country = history.asinfo
+            self._asn_counts[asn] -= 1
+            if not self._asn_counts[asn]:
+                del self._asn_counts[asn]
+            self._country_counts[country] -= 1
+            if not self._country_counts[country]:
+                del self._country_counts[country]
+
+    def set_ipasn(self, db):
+        self._ipasn = db
+        self._asn_counts.clear()
+        self._country_counts.clear()
+        for history in self._peers.values():
+            self._annotate(history)
+
+    def has_ipasn(self):
+        return self._ipasn is not None
+
+    def get_asinfo(self, ident):
+        return self._peers[ident].asinfo
+
+    def get_asn_summary(self, n):
+        """ The n most common ASNs as [(asn, name, count)], and countries. """
+        return (
+            [(asn, self._ipasn.get_name(asn), count)
+             for asn, count in self._asn_counts.most_common(n)],
+            self._country_counts.most_common(n),
+        )
+
+    def on_peerinfo(self, peerinfo, t):
+        peers = self._peers
+        log = self._log
+        # Everything would look like a connect on the first snapshot.
+        first = self._peerinfo is None
+
+        current = set()
+        for peer in peerinfo:
+            ident = peer["id"]
+            current.add(ident)
+            try:
+                history = peers[ident]
+            except KeyError:
+                history = peers[ident] = PeerHistory(PEER_HISTORY)
+                if not first:
+                    log.connect(t, peer)
+            else:
+                previous = history.peer
+                for field in WATCHED_FIELDS:
+                    old, new = previous.get(field), peer.get(field)
+                    if old != new:
+                        log.change(t, peer, field, old, new)
+
+            if history.peer is None:
+                history.update(t, peer)
+                self._annotate(history)
+            else:
+                history.update(t, peer)
+
+        if len(peers) != len(current):
+            for ident in [i for i in peers if i not in current]:
+                log.disconnect(t, peers[ident].peer)
+                self._unannotate(peers[ident])
+                del peers[ident]
+
+        log.prune(t)
+
+        self._peerinfo = peerinfo
+        self._byid = {peer["id"]: peer for peer in peerinfo}
+        self._table.update(self._byid)
+
+    def get_peerinfo(self):
+        return self._peerinfo
+
+    def get_top_talkers(self, n):
+        return heapq.nlargest(n, self._peers.values(), key=lambda h: h.rate)
+
+    def get_peer(self, ident):
+        return self._byid[ident]
+
+    def get_log(self):
+        return self._log
+
+    def get_rows(self):
+        return self._table.rows(self._byid)
+
+    def get_sort(self):
+        return self._table.get_sort()
+
+    def set_sort(self, column, reverse):
+        self._table.set_sort(column, reverse, self._byid)
+
+    def get_filter(self):
+        return self._table.get_filter()
+
+    def set_filter(self, text):
+        self._table.set_filter(text)
+
+
+class PeersView(view.View):
+    _mode_name = "peers"
+
+    def __init__(self, peerstore):
+        self._peerstore = peerstore
+
+        self._panel = 0  # index into PANELS
+        self._event_offset = 0
+
+        self._selected = 0  # index into the current rows
+        self._offset = 0  # index of the first row drawn
+        self._edit_mode = False  # typing a filter?
+        self._edit_buffer = ""
 
         super().__init__()
 
-    async def _draw(self):
-        self._clear_init_pad()
+    def _page_size(self):
+        # Rows of the pad that make it onto the screen, less header/status.
+        return max(1, min(17, self._window_size[0] - 8))
 
-        if self._peerinfo:
-            po = self._peerinfo
+    async def _draw_talkers(self):
+        CYELLOW = curses.color_pair(5)
+        CBOLD = curses.A_BOLD
 
-            self._pad.addstr(0, 1, "Node IP              Version                                    Recv      Sent        Time   Height", curses.A_BOLD + curses.color_pair(5))
+        self._pad.addstr(0, 1, "Top talkers          Down kB/s   Up kB/s     Ping ms   avg ms   min ms", CBOLD + CYELLOW)
+        self._pad.addstr(0, 80, "[TAB: peer events]", CYELLOW)
 
-            window_height = 20
-            offset = 0
-            for index in range(offset, offset+window_height):
-                # TODO: replace this hack with real scrolling.
-                if index > 15 and index < len(po):
-                    self._pad.addstr(1+index-offset, 1, "<some peers were omitted>")
-                    break
+        for i, history in enumerate(self._peerstore.get_top_talkers(TOP_TALKERS)):
+            y = 1 + i
+            self._pad.addstr(y, 1, format_addr(history.peer["addr"]))
+
+            if len(history.recv):
+                self._pad.addstr(y, 22, "{: 9.2f} {: 9.2f}".format(
+                    history.recv.latest() / 1024,
+                    history.sent.latest() / 1024,
+                ))
+
+            pings = history.ping.last()
+            if pings:
+                self._pad.addstr(y, 45, "{: 8.1f} {: 8.1f} {: 8.1f}".format(
+                    1000 * pings[-1],
+                    1000 * sum(pings) / len(pings),
+                    1000 * min(pings),
+                ))
+
+    async def _draw_peer(self, y, peer, color):
+        if color:
+            self._pad.addstr(y, 0, " " * 99, color)
+
+        if peer['inbound']:
+            self._pad.addstr(y, 0, 'I', color)
+        elif peer.get('syncnode'):
+            # syncnodes are outgoing only
+            self._pad.addstr(y, 0, 'S', color)
+
+        self._pad.addstr(y, 1, format_addr(peer['addr']), color)
+        if self._peerstore.has_ipasn():
+            self._pad.addstr(y, 22, peer['subver'][1:26][:-1], color)
+            asinfo = self._peerstore.get_asinfo(peer['id'])
+            if asinfo is not None:
+                self._pad.addstr(y, 47, "AS{:<7} {}".format(*asinfo)[:12], color)
+        else:
+            self._pad.addstr(y, 22, peer['subver'][1:40][:-1], color)
+
+        mbrecv = "% 7.1f" % ( float(peer['bytesrecv']) / 1048576 )
+        mbsent = "% 7.1f" % ( float(peer['bytessent']) / 1048576 )
+
+        self._pad.addstr(y, 60, mbrecv + 'MB', color)
+        self._pad.addstr(y, 70, mbsent + 'MB', color)
+
+        timedelta = int(time.time() - peer['conntime'])
+        m, s = divmod(timedelta, 60)
+        h, m = divmod(m, 60)
+        d, h = divmod(h, 24)
+
+        time_string = ""
+        if d:
+            time_string += ("%d" % d + "d").rjust(3) + " "
+            time_string += "%02d" % h + ":"
+        elif h:
+            time_string += "%02d" % h + ":"
+        time_string += "%02d" % m + ":"
+        time_string += "%02d" % s
+
+        self._pad.addstr(y, 79, time_string.rjust(12), color)
 
-                if index < len(po):
-                    peer = po[index]
+        if 'synced_headers' in peer:
+            self._pad.addstr(y, 93, str(peer['synced_headers']).rjust(7), color)
 
-                    condition = (index == offset+window_height-1) and (index+1 < len(state['peerinfo']))
-                    condition = condition or ( (index == offset) and (index > 0) )
+    async def _draw_table(self):
+        CRED = curses.color_pair(3)
+        CYELLOW = curses.color_pair(5)
+        CBOLD = curses.A_BOLD
+        CREVERSE = curses.A_REVERSE
 
-                    if condition:
-                        # scrolling up or down is possible
-                        self._pad.addstr(1+index-offset, 3, "...")
+        self._pad.addstr(0, 1, "Node IP              Version                                    Recv      Sent        Time   Height", CBOLD + CYELLOW)
+        if self._peerstore.has_ipasn():
+            self._pad.addstr(0, 47, "AS", CBOLD + CYELLOW)
 
-                    else:
-                        if peer['inbound']:
-                            self._pad.addstr(1+index-offset, 1, 'I')
+        rows = self._peerstore.get_rows()
+        page = self._page_size()
 
-                        elif 'syncnode' in peer:
-                            if peer['syncnode']:
-                                # syncnodes are outgoing only
-                                self._pad.addstr(1+index-offset, 1, 'S')
+        # Keep the selection valid as peers come and go.
+        self._selected = max(0, min(self._selected, len(rows) - 1))
+        self._offset = max(0, min(self._offset, self._selected, len(rows) - page))
+        if self._selected >= self._offset + page:
+            self._offset = self._selected - page + 1
 
-                        addr_str = peer['addr'].replace(".onion","").replace(":8333","").replace(":    18333","").strip("[").strip("]")
+        # Only the rows on screen are ever formatted.
+        for i, ident in enumerate(rows[self._offset:self._offset+page]):
+            color = CBOLD + CREVERSE if self._offset + i == self._selected else 0
+            await self._draw_peer(1+i, self._peerstore.get_peer(ident), color)
 
-                        # truncate long ip addresses (ipv6)
-                        addr_str = (addr_str[:17] + '...') if len(addr_str) > 20 else addr_str
+        status_y = page + 1
+        column, reverse = self._peerstore.get_sort()
+        name, _, descending = SORT_COLUMNS[column]
+        status = "{}/{} sort: {} {}".format(
+            min(self._selected + 1, len(rows)), len(rows),
+            name, "desc" if descending != reverse else "asc",
+        )
+        if self._offset > 0:
+            status += "  ^"
+        if self._offset + page < len(rows):
+            status += "  v"
+        self._pad.addstr(status_y, 1, status, CBOLD)
 
-                        self._pad.addstr(1+index-offset, 1, addr_str)
-                        self._pad.addstr(1+index-offset, 22,
-                            peer['subver'][1:40][:-1]
-                        )
+        if self._edit_mode:
+            self._pad.addstr(status_y, 36, "filter> {}".format(self._edit_buffer)[:62],
+                CRED + CBOLD + CREVERSE)
+        else:
+            flt = self._peerstore.get_filter()
+            if flt:
+                self._pad.addstr(status_y, 36, "filter: {}".format(flt)[:24], CRED + CBOLD)
+            self._pad.addstr(status_y, 61, "[O/R: sort, /: filter, TAB: talkers]", CYELLOW)
 
-                        mbrecv = "% 7.1f" % ( float(peer['bytesrecv']) / 1048576 )
-                        mbsent = "% 7.1f" % ( float(peer['bytessent']) / 1048576 )
+    async def _draw_events(self):
+        CGREEN = curses.color_pair(1)
+        CRED = curses.color_pair(3)
+        CYELLOW = curses.color_pair(5)
+        CBOLD = curses.A_BOLD
 
-                        self._pad.addstr(1+index-offset, 60, mbrecv + 'MB')
-                        self._pad.addstr(1+index-offset, 70, mbsent + 'MB')
+        log = self._peerstore.get_log()
+        now = time.time()
 
-                        timedelta = int(time.time() - peer['conntime'])
-                        m, s = divmod(timedelta, 60)
-                        h, m = divmod(m, 60)
-                        d, h = divmod(h, 24)
+        churn = "  ".join(
+            "{} +{}/-{}".format(label, connects, disconnects)
+            for label, connects, disconnects in log.get_churn(now)
+        )
+        self._pad.addstr(0, 1, "Peer events   churn: {}  total +{}/-{}".format(
+            churn, log.total_connects, log.total_disconnects)[:74], CBOLD + CYELLOW)
+        self._pad.addstr(0, 76, "[UP/DOWN, TAB: ASNs]", CYELLOW)
 
-                        time_string = ""
-                        if d:
-                            time_string += ("%d" % d + "d").rjust(3) + " "
-                            time_string += "%02d" % h + ":"
-                        elif h:
-                            time_string += "%02d" % h + ":"
-                        time_string += "%02d" % m + ":"
-                        time_string += "%02d" % s
+        page = self._page_size() + 1
+        self._event_offset = max(0, min(self._event_offset, len(log) - page))
 
-                        self._pad.addstr(1+index-offset, 79, time_string.rjust(12))
+        colors = {"+": CGREEN, "-": CRED, "~": CYELLOW}
+        for i, (t, kind, ident, addr, detail) in enumerate(log.get_events(self._event_offset, page)):
+            stamp = datetime.datetime.utcfromtimestamp(t).strftime("%H:%M:%S")
+            self._pad.addstr(1+i, 1, "{} {} {:<21} {:<5} {}".format(
+                stamp, kind, format_addr(addr), ident, detail)[:98],
+                colors[kind])
 
-                        if 'synced_headers' in peer:
-                          self._pad.addstr(1+index-offset, 93, str(peer['synced_headers']).rjust(7)    )
+    async def _draw_asn(self):
+        CRED = curses.color_pair(3)
+        CYELLOW = curses.color_pair(5)
+        CBOLD = curses.A_BOLD
 
+        self._pad.addstr(0, 1, "ASN concentration", CBOLD + CYELLOW)
+        self._pad.addstr(0, 80, "[TAB: peers]", CYELLOW)
+
+        if not self._peerstore.has_ipasn():
+            self._pad.addstr(2, 1, "no IP to ASN database loaded (see --ip2asn)", CRED + CBOLD)
+            return
+
+        total = len(self._peerstore.get_peerinfo() or []) or 1
+        asns, countries = self._peerstore.get_asn_summary(self._page_size())
+
+        self._pad.addstr(1, 1, "ASN        Peers  Share  Name", CBOLD)
+        for i, (asn, name, count) in enumerate(asns):
+            color = CRED + CBOLD if count / total >= ASN_WARN_SHARE else 0
+            self._pad.addstr(2+i, 1, "AS{:<8} {: 5d} {: 5.1f}%  {}".format(
+                asn, count, 100 * count / total, name[:42]), color)
+
+        self._pad.addstr(1, 75, "Country  Peers  Share", CBOLD)
+        for i, (country, count) in enumerate(countries):
+            self._pad.addstr(2+i, 75, "{:<7} {: 6d} {: 5.1f}%".format(
+                country, count, 100 * count / total))
+
+    async def _draw(self):
+        self._clear_init_pad()
+
+        if PANELS[self._panel] == "asn":
+            await self._draw_asn()
+            self._draw_pad_to_screen()
+            return
+
+        if PANELS[self._panel] == "talkers":
+            await self._draw_talkers()
+            self._draw_pad_to_screen()
+            return
+
+        if PANELS[self._panel] == "events":
+            await self._draw_events()
+            self._draw_pad_to_screen()
+            return
+
+        await self._draw_table()
         self._draw_pad_to_screen()
 
+    async def on_ipasn(self, db):
+        self._peerstore.set_ipasn(db)
+        await self._draw_if_visible()
+
     async def on_peerinfo(self, key, obj):
         try:
-            self._peerinfo = obj["result"]
+            self._peerstore.on_peerinfo(obj["result"], time.time())
         except KeyError:
             return
 
         await self._draw_if_visible()
+
+    async def _handle_edit_keypress(self, key):
+        if (len(key) == 1 and ord(key) == 127) or key == "KEY_BACKSPACE":
+            self._edit_buffer = self._edit_buffer[:-1]
+        elif key == "KEY_RETURN" or key == "\n":
+            self._edit_mode = False
+        elif len(key) == 1:
+            if len(self._edit_buffer) < 40:
+                self._edit_buffer += key
+        else:
+            return
+
+        # Filter as you type; matches are cached per peer.
+        self._peerstore.set_filter(self._edit_buffer)
+        self._selected, self._offset = 0, 0
+
+    async def handle_keypress(self, key):
+        if self._edit_mode:
+            await self._handle_edit_keypress(key)
+            await self._draw_if_visible()
+            return None
+
+        if key == "\t" or key == "KEY_TAB":
+            self._panel = (self._panel + 1) % len(PANELS)
+            await self._draw_if_visible()
+            return None
+
+        if PANELS[self._panel] == "events":
+            if key in ("KEY_UP", "KEY_DOWN"):
+                self._event_offset += -1 if key == "KEY_UP" else 1
+                await self._draw_if_visible()
+                return None
+            return key
+
+        if PANELS[self._panel] in ("talkers", "asn"):
+            return key
+
+        page = self._page_size()
+        moves = {
+            "KEY_UP": -1,
+            "KEY_DOWN": 1,
+            "KEY_PPAGE": -page,
+            "KEY_NPAGE": page,
+        }
+        if key in moves:
+            self._selected = max(0, self._selected + moves[key])
+            await self._draw_if_visible()
+            return None
+
+        if key.lower() == "o":
+            column, _ = self._peerstore.get_sort()
+            self._peerstore.set_sort((column + 1) % len(SORT_COLUMNS), False)
+            await self._draw_if_visible()
+            return None
+
+        if key.lower() == "r":
+            column, reverse = self._peerstore.get_sort()
+            self._peerstore.set_sort(column, not reverse)
+            await self._draw_if_visible()
+            return None
+
+        if key == "/":
+            self._edit_mode = True
+            self._edit_buffer = self._peerstore.get_filter()
+            await self._draw_if_visible()
+            return None
+
+        return key
+
+    async def on_mode_change(self, newmode):
+        """ Overrides view.View to leave the filter prompt. """
+        if newmode != self._mode_name:
+            self._edit_mode = False
+            self._visible = False
+            return
+
+        self._visible = True
+        await self._draw_if_visible()
@@ -0,0 +1,400 @@
+# Copyright (c) 2014-2017 esotericnonsense (Daniel Edgecumbe)
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or https://opensource.org/licenses/mit-license.php
+
+import array
+import hashlib
+import struct
+
+COIN = 100000000
+HEADER_SIZE = 80
+WITNESS_SCALE_FACTOR = 4
+
+NULL_HASH = bytes(32)
+COINBASE_INDEX = 0xffffffff
+
+UINT32 = struct.Struct("<I")
+INT32 = struct.Struct("<i")
+INT64 = struct.Struct("<q")
+HEADER = struct.Struct("<i32s32sIII")
+
+
+class DeserializationError(ValueError):
+    pass
+
+
+def sha256d(*parts):
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part)
+    return hashlib.sha256(h.digest()).digest()
+
+
+def hash_hex(digest):
+    """ Hashes are shown byte-reversed. """
+    return bytes(digest[::-1]).hex()
+
+
+def bits_to_difficulty(bits):
+    exponent, mantissa = bits >> 24, bits & 0xffffff
+    difficulty = float(0xffff) / mantissa
+    while exponent < 29:
+        difficulty *= 256.0
+        exponent += 1
+    while exponent > 29:
+        difficulty /= 256.0
+        exponent -= 1
+    return difficulty
+
+
+def read_compact_size(view, pos):
+    """ (value, position after it) """
+    try:
+        first = view[pos]
+        if first < 0xfd:
+            return first, pos + 1
+        if first == 0xfd:
+            return view[pos+1] | view[pos+2] << 8, pos + 3
+        if first == 0xfe:
+            return UINT32.unpack_from(view, pos + 1)[0], pos + 5
+        return struct.unpack_from("<Q", view, pos + 1)[0], pos + 9
+    except (IndexError, struct.error):
+        raise DeserializationError("truncated at {}".format(pos))
+
+
+def _check(view, end):
+    if end > len(view):
+        raise DeserializationError("truncated at {}".format(len(view)))
+
+
+def read_transaction(view, pos, build=False):
+    """
+    Walk the transaction at pos in a memoryview. Returns (end, txid,
+    wtxid, stripped size) and, if build, the inputs and outputs as TxIn
+    and TxOut objects, which hold slices of the view rather than copies.
+    The txid is hashed from slices of the view too.
+    """
+    start = pos
+    _check(view, pos + 6)
+    segwit = view[pos+4] == 0 and view[pos+5] == 1
+    body = pos + (6 if segwit else 4)
+
+    vin, vout = ([], []) if build else (None, None)
+
+    n, pos = read_compact_size(view, body)
+    for _ in range(n):
+        _check(view, pos + 36)
+        outpoint = pos
+        pos += 36
+        length, pos = read_compact_size(view, pos)
+        script = pos
+        pos += length
+        _check(view, pos + 4)
+        if build:
+            vin.append(TxIn(view[outpoint:outpoint+32], UINT32.unpack_from(view, outpoint + 32)[0],
+                            view[script:pos], UINT32.unpack_from(view, pos)[0]))
+        pos += 4
+
+    n, pos = read_compact_size(view, pos)
+    for i in range(n):
+        _check(view, pos + 8)
+        value = pos
+        length, pos = read_compact_size(view, pos + 8)
+        pos += length
+        _check(view, pos)
+        if build:
+            vout.append(TxOut(INT64.unpack_from(view, value)[0], view[pos-length:pos], i))
+
+    body_end = pos
+    if segwit:
+        for i in range(len(vin) if build else _count_inputs(view, body)):
+            items, pos = read_compact_size(view, pos)
+            witness = []
+            for _ in range(items):
+                length, pos = read_compact_size(view, pos)
+                witness.append(view[pos:pos+length])
+                pos += length
+            _check(view, pos)
+            if build:
+                vin[i].witness = witness
+
+    end = pos + 4
+    _check(view, end)
+    if segwit:
+        txid = sha256d(view[start:start+4], view[body:body_end], view[pos:end])
+        stripped = 4 + (body_end - body) + 4
+    else:
+        txid = sha256d(view[start:end])
+        stripped = end - start
+
+    wtxid = sha256d(view[start:end]) if segwit else txid
+
+    if build:
+        return end, txid, wtxid, stripped, vin, vout
+    return end, txid, wtxid, stripped
+
+
+def _count_inputs(view, body):
+    return read_compact_size(view, body)[0]
+
+
+class Record(object):
+    """
+    Base for the deserialized objects, which also read like the dicts the
+    JSON-RPC interface returns (record["txid"], "vin" in record), so that
+    the stores and views can take either. _keys maps JSON keys to
+    attributes, or to methods for values worked out on demand; a None
+    value reads as a missing key.
+    """
+    __slots__ = ()
+    _keys = {}
+
+    def __getitem__(self, key):
+        try:
+            value = getattr(self, self._keys[key])
+        except (KeyError, AttributeError):
+            raise KeyError(key)
+
+        if callable(value):
+            value = value()
+        if value is None:
+            raise KeyError(key)
+
+        return value
+
+    def __setitem__(self, key, value):
+        setattr(self, self._keys[key], value)
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+class TxIn(Record):
+    __slots__ = ("prevout_hash", "prevout_n", "script", "sequence", "witness")
+    _keys = {
+        "txid": "get_txid",
+        "vout": "get_vout",
+        "coinbase": "get_coinbase",
+        "scriptSig": "get_script_sig",
+        "sequence": "sequence",
+        "txinwitness": "get_witness",
+    }
+
+    def __init__(self, prevout_hash, prevout_n, script, sequence):
+        self.prevout_hash = prevout_hash
+        self.prevout_n = prevout_n
+        self.script = script
+        self.sequence = sequence
+        self.witness = None
+
+    def is_coinbase(self):
+        return self.prevout_n == COINBASE_INDEX and self.prevout_hash == NULL_HASH
+
+    def get_txid(self):
+        return None if self.is_coinbase() else hash_hex(self.prevout_hash)
+
+    def get_vout(self):
+        return None if self.is_coinbase() else self.prevout_n
+
+    def get_coinbase(self):
+        return self.script.hex() if self.is_coinbase() else None
+
+    def get_script_sig(self):
+        return None if self.is_coinbase() else {"hex": self.script.hex()}
+
+    def get_witness(self):
+        return [item.hex() for item in self.witness] if self.witness else None
+
+
+class TxOut(Record):
+    __slots__ = ("satoshis", "script", "n")
+    _keys = {
+        "value": "get_value",
+        "n": "n",
+        "scriptPubKey": "get_script_pubkey",
+    }
+
+    def __init__(self, satoshis, script, n):
+        self.satoshis = satoshis
+        self.script = script
+        self.n = n
+
+    def get_value(self):
+        return self.satoshis / COIN
+
+    def get_script_pubkey(self):
+        return {"hex": self.script.hex()}
+
+
+class Transaction(Record):
+    """
+    blockhash and time are only known for a transaction taken from a
+    block; confirmed may be set when the block isn't known.
+    """
+    __slots__ = ("version", "vin", "vout", "locktime", "txid", "hash",
+                 "size", "weight", "blockhash", "time", "confirmed")
+    _keys = {
+        "txid": "txid",
+        "hash": "hash",
+        "version": "version",
+        "size": "size",
+        "vsize": "get_vsize",
+        "weight": "weight",
+        "locktime": "locktime",
+        "vin": "vin",
+        "vout": "vout",
+        "blockhash": "blockhash",
+        "time": "time",
+        "blocktime": "time",
+        "confirmed": "confirmed",
+    }
+
+    def __init__(self):
+        self.blockhash = None
+        self.time = None
+        self.confirmed = None
+
+    @classmethod
+    def parse(cls, data, pos=0, end=None):
+        view = memoryview(data)
+        if end is not None:
+            view = view[:end]
+
+        tx = cls()
+        tx_end, txid, wtxid, stripped, tx.vin, tx.vout = read_transaction(view, pos, build=True)
+        if end is not None and tx_end != end:
+            raise DeserializationError("transaction ends at {}, not {}".format(tx_end, end))
+
+        tx.version = INT32.unpack_from(view, pos)[0]
+        tx.locktime = UINT32.unpack_from(view, tx_end - 4)[0]
+        tx.txid = hash_hex(txid)
+        tx.hash = hash_hex(wtxid)
+        tx.size = tx_end - pos
+        tx.weight = stripped * (WITNESS_SCALE_FACTOR - 1) + tx.size
+        return tx
+
+    def get_vsize(self):
+        return -(-self.weight // WITNESS_SCALE_FACTOR)
+
+
+class BlockHeader(Record):
+    __slots__ = ("version", "prevhash", "merkleroot_hash", "time", "bits", "nonce",
+                 "hash", "height", "nextblockhash")
+    _keys = {
+        "hash": "hash",
+        "version": "version",
+        "versionHex": "get_version_hex",
+        "merkleroot": "get_merkleroot",
+        "time": "time",
+        "nonce": "nonce",
+        "bits": "get_bits",
+        "difficulty": "get_difficulty",
+        "previousblockhash": "get_previousblockhash",
+        "height": "height",
+        "nextblockhash": "nextblockhash",
+    }
+
+    def _read_header(self, view, pos):
+        if pos + HEADER_SIZE > len(view):
+            raise DeserializationError("truncated header")
+
+        (self.version, self.prevhash, self.merkleroot_hash,
+            self.time, self.bits, self.nonce) = HEADER.unpack_from(view, pos)
+        self.hash = hash_hex(sha256d(view[pos:pos+HEADER_SIZE]))
+        self.height = None
+        self.nextblockhash = None
+
+    @classmethod
+    def parse(cls, data, pos=0):
+        header = cls()
+        header._read_header(memoryview(data), pos)
+        return header
+
+    def get_version_hex(self):
+        return "{:08x}".format(self.version & 0xffffffff)
+
+    def get_merkleroot(self):
+        return hash_hex(self.merkleroot_hash)
+
+    def get_bits(self):
+        return "{:08x}".format(self.bits)
+
+    def get_difficulty(self):
+        return bits_to_difficulty(self.bits)
+
+    def get_previousblockhash(self):
+        return None if self.prevhash == NULL_HASH else hash_hex(self.prevhash)
+
+
+def parse_headers(data):
+    """ Concatenated 80 byte headers, as from /rest/headers. """
+    if len(data) % HEADER_SIZE:
+        raise DeserializationError("{} bytes of headers".format(len(data)))
+
+    return [BlockHeader.parse(data, pos) for pos in range(0, len(data), HEADER_SIZE)]
+
+
+class Block(BlockHeader):
+    """
+    A block over its serialized bytes. Parsing only walks the
+    transactions to find their offsets and txids; each one is
+    deserialized when it is asked for.
+    """
+    __slots__ = ("_view", "_offsets", "txids", "size", "weight")
+    _keys = dict(BlockHeader._keys, **{
+        "tx": "txids",
+        "nTx": "get_ntx",
+        "size": "size",
+        "strippedsize": "get_strippedsize",
+        "weight": "weight",
+    })
+
+    @classmethod
+    def parse(cls, data):
+        view = memoryview(data)
+        block = cls()
+        block._read_header(view, 0)
+
+        n, pos = read_compact_size(view, HEADER_SIZE)
+        stripped = pos
+        block._view = view
+        block._offsets = array.array("L", [pos])
+        block.txids = []
+        for _ in range(n):
+            pos, txid, _, tx_stripped = read_transaction(view, pos)
+            block._offsets.append(pos)
+            block.txids.append(hash_hex(txid))
+            stripped += tx_stripped
+
+        if pos != len(view):
+            raise DeserializationError("{} bytes after the last transaction".format(len(view) - pos))
+
+        block.size = len(view)
+        block.weight = stripped * (WITNESS_SCALE_FACTOR - 1) + block.size
+        return block
+
+    def get_ntx(self):
+        return len(self.txids)
+
+    def get_bytes(self):
+        """ The serialized block. """
+        return bytes(self._view)
+
+    def get_strippedsize(self):
+        return (self.weight - self.size) // (WITNESS_SCALE_FACTOR - 1)
+
+    def get_transaction(self, index):
+        tx = Transaction.parse(self._view, self._offsets[index], self._offsets[index+1])
+        tx.blockhash = self.hash
+        tx.time = self.time
+        return tx
@@ -0,0 +1,69 @@
+# Copyright (c) 2014-2017 esotericnonsense (Daniel Edgecumbe)
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or https://opensource.org/licenses/mit-license.php
+
+import primitives
+from rpc import TIMEOUT, RPCContentError
+
+
+class RESTClient(object):
+    """
+    Blocks, transactions and headers in binary from bitcoind's REST
+    interface (-rest), which shares the RPC port but takes no
+    authentication. It goes over the RPC client's transport. Failures
+    raise the rpc.RPCError subclasses.
+    """
+    def __init__(self, transport):
+        self._transport = transport
+        self._old_headers = False  # headers only as headers/<count>/<hash>?
+
+    async def _fetch(self, path, timeout=TIMEOUT):
+        return await self._transport.fetch("/rest/{}".format(path), timeout=timeout)
+
+    async def _get(self, path, timeout=TIMEOUT):
+        status, body = await self._fetch(path, timeout)
+        if status != 200:
+            raise RPCContentError("REST {} returned HTTP {}".format(path, status))
+        return body
+
+    async def get_block(self, blockhash):
+        data = await self._get("block/{}.bin".format(blockhash))
+        try:
+            block = primitives.Block.parse(data)
+        except primitives.DeserializationError as e:
+            raise RPCContentError("REST block {}: {}".format(blockhash, e))
+
+        if block.hash != blockhash:
+            raise RPCContentError("REST block {} has hash {}".format(blockhash, block.hash))
+
+        return block
+
+    async def get_transaction(self, txid):
+        data = await self._get("tx/{}.bin".format(txid))
+        try:
+            tx = primitives.Transaction.parse(data, end=len(data))
+        except primitives.DeserializationError as e:
+            raise RPCContentError("REST tx {}: {}".format(txid, e))
+
+        if tx.txid != txid:
+            raise RPCContentError("REST tx {} has txid {}".format(txid, tx.txid))
+
+        return tx
+
+    async def get_headers(self, count, blockhash):
+        """ Up to count headers on the active chain, from blockhash on. """
+        if not self._old_headers:
+            path = "headers/{}.bin?count={}".format(blockhash, count)
+            status, data = await self._fetch(path)
+            if status in (400, 404):
+                # Nodes before 24.0 only take the count in the path.
+                self._old_headers = True
+            elif status != 200:
+                raise RPCContentError("REST {} returned HTTP {}".format(path, status))
+
+        if self._old_headers:
+            data = await self._get("headers/{}/{}.bin".format(count, blockhash))
+        try:
+            return primitives.parse_headers(data)
+        except primitives.DeserializationError as e:
+            raise RPCContentError("REST headers {}: {}".format(blockhash, e))
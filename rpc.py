@@ -2,11 +2,12 @@
 # Distributed under the MIT software license, see the accompanying
 # file COPYING or https://opensource.org/licenses/mit-license.php
 
-import aiohttp
 import asyncio
-import async_timeout
 import base64
+import concurrent.futures
+import functools
 import os
+import urllib.parse
 
 try:
     import ujson as json
@@ -14,18 +15,27 @@ except ImportError:
     import json
 
 import config
+import jsonstream
+
+TIMEOUT = 5  # seconds, unless a request asks otherwise
+OFFLOAD_BYTES = 1024 * 1024  # larger responses are prepared in a worker
+WORKERS = 2
 
 
 def craft_url(proto, ip, port):
     return "{}://{}:{}".format(proto, ip, port)
 
 
-def get_url_from_datadir(datadir):
-    configfile = os.path.join(datadir, "bitcoin.conf")
-
+def read_config(datadir):
+    """ bitcoin.conf in the datadir, or None if there isn't one. """
     try:
-        cfg = config.parse_file(configfile)
+        return config.parse_file(os.path.join(datadir, "bitcoin.conf"))
     except IOError:
+        return None
+
+
+def get_url_from_config(cfg):
+    if cfg is None:
         return craft_url("http", "localhost", 8332)
 
     proto = cfg["protocol"] if "protocol" in cfg else "http"
@@ -44,7 +54,7 @@ def get_url_from_datadir(datadir):
     return craft_url(proto, ip, port)
 
 
-def get_auth_from_datadir(datadir):
+def get_auth_from_datadir(datadir, cfg):
     def craft_auth_from_credentials(user, password):
         details = ":".join([user, password])
         return base64.b64encode(bytes(details, "utf-8")).decode("utf-8")
@@ -61,11 +71,7 @@ def get_auth_from_datadir(datadir):
     except FileNotFoundError:
         print("cookiefile not found, falling back to password authentication")
         # Fall back to credential-based authentication
-        configfile = os.path.join(datadir, "bitcoin.conf")
-
-        try:
-            cfg = config.parse_file(configfile)
-        except IOError:
+        if cfg is None:
             print("configuration file not found; aborting.")
             raise
 
@@ -99,13 +105,51 @@ class RPCConnectionError(RPCError):
     pass
 
 
+def check_response(d):
+    """ d, if it is a successful response; raises RPCContentError otherwise. """
+    try:
+        error = d["error"]
+    except KeyError:
+        raise RPCContentError("RPC response seems malformed (no error field)")
+
+    if error is not None:
+        # TODO: pass the error up the stack; tweak RPCError
+        raise RPCContentError("RPC response returned error {}".format(error))
+
+    try:
+        result = d["result"]
+    except KeyError:
+        raise RPCContentError("RPC response seems malformed (no result field)")
+
+    if result is None:
+        # Is there a case in which a query can return None?
+        raise RPCContentError("RPC response returned a null result")
+
+    return d
+
+
+def decode_response(body, prepare=None, offload=None):
+    """
+    Decode and check a response body and pass it through prepare, then
+    offload. This runs in a worker process for large bodies, so both
+    have to pickle: a module level function or a functools.partial of
+    one.
+    """
+    d = check_response(json.loads(body))
+    if prepare is not None:
+        d = prepare(d)
+    if offload is not None:
+        d = offload(d)
+
+    return d
+
+
 class BitcoinRPCClient(object):
-    def __init__(self, url, auth):
-        self._url = url
-        self._headers = {
-            "Authorization": "Basic {}".format(auth),
-            "Content-Type": "text/plain",
-        }
+    """ JSON-RPC over a transport (see transport.py), which does the HTTP. """
+    def __init__(self, transport):
+        self._transport = transport
+
+        self._executor = None  # started on first use
 
     @staticmethod
     async def _craft_request(req, params, ident):
@@ -122,42 +166,110 @@ class BitcoinRPCClient(object):
 
         return json.dumps(d)
 
-    async def _fetch(self, session, req):
+    def _wallet_path(self, wallet):
+        if wallet is None:
+            return "/"
+
+        return "/wallet/{}".format(urllib.parse.quote(wallet, safe=""))
+
+    async def _fetch(self, req, wallet=None, timeout=TIMEOUT, path=None, project=None):
+        """
+        The response body or, given a path, the response decoded as it
+        arrives (see request).
+        """
+        consume = None
+        if path is not None:
+            consume = functools.partial(jsonstream.decode_chunks,
+                                        path=("result", ) + tuple(path), project=project)
+
+        _, body = await self._transport.fetch(self._wallet_path(wallet), req, timeout, consume)
+        return body
+
+    async def _decode(self, body, prepare, offload):
+        """
+        decode_response, in the worker pool if the body is large and
+        prepare can make it compact. Decoding holds the GIL, so a thread
+        wouldn't keep the loop free; a process does, but its result comes
+        back pickled, so it isn't worth it for the full response. offload
+        only runs in the worker.
+        """
+        if prepare is None or len(body) < OFFLOAD_BYTES:
+            return decode_response(body, prepare)
+
+        if self._executor is None:
+            self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=WORKERS)
+
+        loop = asyncio.get_event_loop()
         try:
-            with async_timeout.timeout(5):
-                async with session.post(self._url, headers=self._headers, data=req) as response:
-                    return await response.text()
-        except asyncio.TimeoutError:
-            raise RPCTimeoutError
-        except aiohttp.client_exceptions.ClientOSError:
-            raise RPCConnectionError
-
-    @staticmethod
-    async def _json_loads(j):
-        return json.loads(j)
-
-    async def request(self, method, params=None, ident=None, callback=None):
-        async with aiohttp.ClientSession() as session:
-            req = await self._craft_request(method, params, ident)
-            j = await self._fetch(session, req)
-            d = await self._json_loads(j)
-
-            try:
-                error = d["error"]
-            except KeyError:
-                raise RPCContentError("RPC response seems malformed (no error field)")
-
-            if error is not None:
-                # TODO: pass the error up the stack; tweak RPCError
-                raise RPCContentError("RPC response returned error {}".format(error))
-
+            return await loop.run_in_executor(self._executor, decode_response, body, prepare,
+                                              offload)
+        except concurrent.futures.process.BrokenProcessPool:
+            self._executor = None
+            return decode_response(body, prepare)
+
+    async def request(self, method, params=None, ident=None, callback=None, wallet=None,
+                      timeout=TIMEOUT, path=None, project=None, prepare=None, offload=None):
+        """
+        wallet selects a loaded wallet by name for wallet RPCs. timeout is
+        in seconds; None waits indefinitely.
+
+        path (keys and indices within the result) names a container whose
+        elements are passed through project as the response is decoded,
+        a chunk at a time, so that only the projections are kept:
+
+            request("getblock", [blockhash, 2], path=["tx"],
+                    project=lambda tx: tx["txid"])
+
+        prepare(response) turns the response into what the caller keeps
+        (a summary, a sorted view, formatted text) and is returned instead
+        of it. For a response over OFFLOAD_BYTES the decoding and prepare
+        both run in a worker process; see decode_response. offload, if
+        given, then runs on prepare's result in the worker too: work that
+        would otherwise be done later on the loop, but that isn't worth
+        doing up front for a small response.
+        """
+        req = await self._craft_request(method, params, ident)
+        if path is None:
+            body = await self._fetch(req, wallet, timeout)
+            return await self._decode(body, prepare, offload)
+
+        d = check_response(await self._fetch(req, wallet, timeout, path, project))
+        if prepare is not None:
+            return prepare(d)
+
+        return d
+
+    async def request_batch(self, calls, wallet=None, timeout=TIMEOUT):
+        """
+        Send a list of (method, params) tuples as a single JSON-RPC batch,
+        optionally to a named wallet.
+
+        Returns the raw responses in the same order as the calls. Errors are
+        per-call and are left in the "error" field for the caller to check.
+        """
+        if not calls:
+            return []
+
+        batch = []
+        for ident, (method, params) in enumerate(calls):
+            d = {"method": method, "id": ident}
+            if params is not None:
+                d["params"] = params
+            batch.append(d)
+
+        ds = json.loads(await self._fetch(json.dumps(batch), wallet, timeout))
+
+        if not isinstance(ds, list):
+            raise RPCContentError("RPC batch response is not a list")
+
+        responses = [None] * len(calls)
+        for d in ds:
             try:
-                result = d["result"]
-            except KeyError:
-                raise RPCContentError("RPC response seems malformed (no result field)")
+                responses[d["id"]] = d
+            except (KeyError, IndexError, TypeError):
+                raise RPCContentError("RPC batch response seems malformed (bad id)")
 
-            if result is None:
-                # Is there a case in which a query can return None?
-                raise RPCContentError("RPC response returned a null result")
+        if any(d is None for d in responses):
+            raise RPCContentError("RPC batch response is missing responses")
 
-            return d
+        return responses
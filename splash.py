@@ -7,8 +7,6 @@ import asyncio
 
 from macros import MIN_WINDOW_SIZE, DEFAULT_MODE
 
-import time
-
 splash_array = [
     " BB            BB                                   BB    ",
     " BB       BB   BB    BBBB    BBBB   BB  BB BB       BB    ",
@@ -59,10 +57,10 @@ class SplashView(object):
                     self._pad.addstr(y+1, x, splash_array[y][x], CRED + CBOLD)
                 y += 1
             await self._draw_pad_to_screen()
-            time.sleep(0.01)
+            # Let the first polls go out meanwhile.
+            await asyncio.sleep(0.01)
 
-        await asyncio.sleep(0.5)
-        time.sleep(0.5)
+        await asyncio.sleep(1)
         await self._end_splash(nosplash)
 
     async def _end_splash(self, nosplash):
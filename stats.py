@@ -0,0 +1,402 @@
+# Copyright (c) 2014-2017 esotericnonsense (Daniel Edgecumbe)
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or https://opensource.org/licenses/mit-license.php
+
+import array
+import curses
+import asyncio
+
+import view
+from rpc import RPCError
+from util import block_subsidy
+
+WINDOWS = [144, 1008, 2016]
+
+# getblockstats is expensive for the node (it reads the undo data), so only
+# request the fields that we actually display.
+STATS_FIELDS = [
+    "height", "blockhash", "time", "total_size", "total_weight",
+    "totalfee", "feerate_percentiles", "txs", "swtxs",
+]
+
+BATCH_SIZE = 50  # getblockstats calls per JSON-RPC batch
+PARALLEL_BATCHES = 4
+REORG_DEPTH = 10  # how far back to refetch if the tip does not connect
+
+MAX_BLOCK_WEIGHT = 4000000
+
+# (upper bound in seconds, label) for the interval histogram
+INTERVAL_BUCKETS = [
+    (120, "   < 2m"),
+    (300, "  2m-5m"),
+    (600, " 5m-10m"),
+    (1200, "10m-20m"),
+    (2400, "20m-40m"),
+    (3600, "40m-60m"),
+    (None, "  > 60m"),
+]
+
+
+def format_seconds(seconds):
+    sign = "-" if seconds < 0 else ""
+    m, s = divmod(int(abs(seconds)), 60)
+    h, m = divmod(m, 60)
+    if h:
+        return "{}{:d}h{:02d}m{:02d}s".format(sign, h, m, s)
+    return "{}{:d}m{:02d}s".format(sign, m, s)
+
+
+def format_hashrate(hashrate):
+    for unit in ["H/s", "kH/s", "MH/s", "GH/s", "TH/s", "PH/s"]:
+        if hashrate < 1000:
+            return "{:.2f} {}".format(hashrate, unit)
+        hashrate /= 1000
+
+    return "{:.2f} EH/s".format(hashrate)
+
+
+class ChainStatsCache(object):
+    """
+    getblockstats results for the most recent blocks, one compact array per
+    field. Heights map onto slots modulo the capacity, so inserting in any
+    order is O(1) and old heights are evicted as the tip moves.
+    """
+    def __init__(self, capacity):
+        self._capacity = capacity
+
+        self._heights = array.array("l", [-1]) * capacity
+        self._hashes = bytearray(32 * capacity)
+        self._time = array.array("L", [0]) * capacity
+        self._size = array.array("L", [0]) * capacity
+        self._weight = array.array("L", [0]) * capacity
+        self._fee = array.array("Q", [0]) * capacity
+        self._txs = array.array("L", [0]) * capacity
+        self._swtxs = array.array("L", [0]) * capacity
+        self._feerates = array.array("L", [0]) * (5 * capacity)
+
+        self._summaries = {}  # (tip, n) -> summary dict
+
+    def has(self, height):
+        return height >= 0 and self._heights[height % self._capacity] == height
+
+    def hash_at(self, height):
+        if not self.has(height):
+            return None
+
+        slot = height % self._capacity
+        return bytes(self._hashes[32*slot:32*slot+32]).hex()
+
+    def missing(self, lo, hi):
+        return [h for h in range(max(lo, 0), hi+1) if not self.has(h)]
+
+    def put(self, stats):
+        height = stats["height"]
+        slot = height % self._capacity
+
+        self._heights[slot] = height
+        self._hashes[32*slot:32*slot+32] = bytes.fromhex(stats["blockhash"])
+        self._time[slot] = stats["time"]
+        self._size[slot] = stats["total_size"]
+        self._weight[slot] = stats["total_weight"]
+        self._fee[slot] = stats["totalfee"]
+        self._txs[slot] = stats["txs"]
+        self._swtxs[slot] = stats["swtxs"]
+        self._feerates[5*slot:5*slot+5] = array.array("L", stats["feerate_percentiles"])
+
+        self._summaries.clear()
+
+    def invalidate(self, lo, hi):
+        for h in range(max(lo, 0), hi+1):
+            if self.has(h):
+                self._heights[h % self._capacity] = -1
+
+        self._summaries.clear()
+
+    def summarize(self, tip, n):
+        """ Aggregate the n blocks ending at tip, or None if incomplete. """
+        try:
+            return self._summaries[(tip, n)]
+        except KeyError:
+            pass
+
+        # One extra block so that there are n intervals.
+        if n + 1 > self._capacity or self.missing(tip - n, tip):
+            return None
+
+        c = self._capacity
+        slots = [h % c for h in range(tip - n + 1, tip + 1)]
+        prevslot = (tip - n) % c
+
+        intervals = []
+        last = self._time[prevslot]
+        for slot in slots:
+            intervals.append(self._time[slot] - last)
+            last = self._time[slot]
+
+        buckets = [0] * len(INTERVAL_BUCKETS)
+        for interval in intervals:
+            for i, (bound, _) in enumerate(INTERVAL_BUCKETS):
+                if bound is None or interval < bound:
+                    buckets[i] += 1
+                    break
+
+        total_size = sum(self._size[slot] for slot in slots)
+        total_weight = sum(self._weight[slot] for slot in slots)
+        total_fee = sum(self._fee[slot] for slot in slots)
+        # The coinbase is counted in txs but never in swtxs.
+        total_txs = sum(self._txs[slot] - 1 for slot in slots)
+        total_swtxs = sum(self._swtxs[slot] for slot in slots)
+        total_subsidy = sum(
+            int(block_subsidy(h) * 100000000)
+            for h in range(tip - n + 1, tip + 1)
+        )
+
+        # Median of each per-block percentile across the window.
+        feerates = []
+        for p in range(5):
+            column = sorted(self._feerates[5*slot+p] for slot in slots)
+            feerates.append(column[len(column)//2])
+
+        ordered = sorted(intervals)
+        span = self._time[slots[-1]] - self._time[prevslot]
+
+        summary = {
+            "lo": tip - n + 1,
+            "hi": tip,
+            "n": n,
+            "interval_mean": span / n,
+            "interval_median": ordered[n//2],
+            "interval_min": ordered[0],
+            "interval_max": ordered[-1],
+            "interval_buckets": buckets,
+            "size_avg": total_size / n,
+            "size_total": total_size,
+            "weight_avg": total_weight / n,
+            "txs_total": total_txs,
+            "segwit_share": total_swtxs / total_txs if total_txs else 0,
+            "fee_total": total_fee,
+            "fee_share": total_fee / (total_fee + total_subsidy) if total_fee + total_subsidy else 0,
+            "feerate_percentiles": feerates,
+        }
+
+        self._summaries[(tip, n)] = summary
+        return summary
+
+
+class ChainStatsStore(object):
+    def __init__(self, client, blockstore):
+        self._client = client
+        self._blockstore = blockstore
+
+        self._lock = asyncio.Lock()
+
+        self._cache = ChainStatsCache(max(WINDOWS) + 1)
+        self._tip = None  # (height, hash, difficulty)
+        self._window = None  # number of blocks wanted, None until shown
+        self._fetching = None  # (done, total) while a range is outstanding
+
+    async def _fetch_batch(self, semaphore, heights):
+        with await semaphore:
+            calls = [("getblockstats", [h, STATS_FIELDS]) for h in heights]
+            try:
+                responses = await self._client.request_batch(calls)
+            except RPCError:
+                return
+
+        for d in responses:
+            if d.get("error") is None and d.get("result"):
+                self._cache.put(d["result"])
+
+        done, total = self._fetching
+        self._fetching = (done + len(heights), total)
+
+    async def _fetch_heights(self, heights):
+        if not heights:
+            return
+
+        self._fetching = (0, len(heights))
+        semaphore = asyncio.Semaphore(PARALLEL_BATCHES)
+        await asyncio.gather(*[
+            self._fetch_batch(semaphore, heights[i:i+BATCH_SIZE])
+            for i in range(0, len(heights), BATCH_SIZE)
+        ])
+        self._fetching = None
+
+    async def update(self):
+        """ Fetch whatever the current window is missing. """
+        with await self._lock:
+            if self._tip is None or self._window is None:
+                return
+
+            height = self._tip[0]
+            missing = self._cache.missing(height - self._window, height)
+
+        await self._fetch_heights(missing)
+
+    async def on_bestblockhash(self, blockhash):
+        block = await self._blockstore.get_block(blockhash)
+
+        with await self._lock:
+            height = block["height"]
+            prevhash = block.get("previousblockhash")
+            if (self._cache.has(height - 1) and
+                    self._cache.hash_at(height - 1) != prevhash):
+                # The new tip doesn't connect to what we have.
+                self._cache.invalidate(height - REORG_DEPTH, height)
+
+            self._tip = (height, blockhash, block["difficulty"])
+
+    async def set_window(self, n):
+        with await self._lock:
+            self._window = n
+
+    def get_fetching(self):
+        return self._fetching
+
+    def get_summary(self):
+        if self._tip is None or self._window is None:
+            return None, None
+
+        height, _, difficulty = self._tip
+        return self._cache.summarize(height, self._window), difficulty
+
+
+class ChainStatsView(view.View):
+    _mode_name = "stats"
+
+    def __init__(self, statsstore):
+        self._statsstore = statsstore
+
+        self._window = WINDOWS[0]
+        self._update_task = None
+        self._update_pending = False
+
+        super().__init__()
+
+    async def _draw_summary(self, summary, difficulty):
+        CGREEN = curses.color_pair(1)
+        CCYAN = curses.color_pair(2)
+        CBOLD = curses.A_BOLD
+
+        self._pad.addstr(0, 1, "Last {} blocks ({} - {})".format(
+            summary["n"], summary["lo"], summary["hi"]), CBOLD)
+
+        self._pad.addstr(2, 1, "Interval: mean {}  median {}  min {}  max {}".format(
+            format_seconds(summary["interval_mean"]),
+            format_seconds(summary["interval_median"]),
+            format_seconds(summary["interval_min"]),
+            format_seconds(summary["interval_max"]),
+        ), CBOLD)
+
+        buckets = summary["interval_buckets"]
+        most = max(buckets)
+        for i, (_, label) in enumerate(INTERVAL_BUCKETS):
+            count = buckets[i]
+            width = (40 * count) // most if most else 0
+            self._pad.addstr(3+i, 1, "{} {: 5d} {: 6.1f}%".format(
+                label, count, 100 * count / summary["n"]))
+            if width:
+                self._pad.addstr(3+i, 24, " " * width, CCYAN + curses.A_REVERSE)
+
+        self._pad.addstr(11, 1, "Size: avg {:,.0f} bytes ({:.2f} MB total)   Weight: avg {:,.0f} WU ({:.1f}% full)".format(
+            summary["size_avg"],
+            summary["size_total"] / 1000000,
+            summary["weight_avg"],
+            100 * summary["weight_avg"] / MAX_BLOCK_WEIGHT,
+        ))
+
+        self._pad.addstr(12, 1, "Transactions: {:,d} ({:.0f}/block)   Segwit: {:.1f}%".format(
+            summary["txs_total"],
+            summary["txs_total"] / summary["n"],
+            100 * summary["segwit_share"],
+        ))
+
+        self._pad.addstr(13, 1, "Fees: {:.8f} BTC ({:.8f} BTC/block, {:.2f}% of reward)".format(
+            summary["fee_total"] / 100000000,
+            summary["fee_total"] / summary["n"] / 100000000,
+            100 * summary["fee_share"],
+        ))
+
+        self._pad.addstr(14, 1, "Feerates (sat/vB, median per block): {}".format(
+            "  ".join(
+                "{}%: {}".format(p, fr)
+                for p, fr in zip([10, 25, 50, 75, 90], summary["feerate_percentiles"])
+            )
+        ))
+
+        if difficulty and summary["interval_mean"] > 0:
+            hashrate = difficulty * 2**32 / summary["interval_mean"]
+            self._pad.addstr(16, 1, "Estimated hashrate: {} (difficulty {:,d})".format(
+                format_hashrate(hashrate), int(difficulty)), CBOLD + CGREEN)
+
+    async def _draw(self):
+        self._clear_init_pad()
+
+        CRED = curses.color_pair(3)
+        CYELLOW = curses.color_pair(5)
+        CBOLD = curses.A_BOLD
+
+        self._pad.addstr(0, 64, "[1/2/3: {}/{}/{} blocks]".format(*WINDOWS), CYELLOW)
+
+        summary, difficulty = self._statsstore.get_summary()
+        if summary:
+            await self._draw_summary(summary, difficulty)
+        else:
+            self._pad.addstr(0, 1, "no chain statistics yet", CRED + CBOLD)
+
+        fetching = self._statsstore.get_fetching()
+        if fetching:
+            self._pad.addstr(18, 1, "fetching getblockstats: {}/{}".format(*fetching), CYELLOW)
+
+        self._draw_pad_to_screen()
+
+    async def _update(self):
+        while self._update_pending:
+            self._update_pending = False
+            await self._statsstore.update()
+            await self._draw_if_visible()
+
+    def _schedule_update(self):
+        # Filling a 2016 block window takes a while; don't block the UI.
+        self._update_pending = True
+        if self._update_task is None or self._update_task.done():
+            self._update_task = asyncio.ensure_future(self._update())
+
+    async def _set_window(self, n):
+        if n == self._window:
+            return
+
+        self._window = n
+        await self._statsstore.set_window(n)
+        self._schedule_update()
+        await self._draw_if_visible()
+
+    async def on_bestblockhash(self, key, obj):
+        try:
+            bestblockhash = obj["result"]
+        except KeyError:
+            return
+
+        await self._statsstore.on_bestblockhash(bestblockhash)
+
+        # Once primed, each new tip only costs a single getblockstats.
+        self._schedule_update()
+
+    async def handle_keypress(self, key):
+        for i, n in enumerate(WINDOWS):
+            if key == str(i+1):
+                await self._set_window(n)
+                return None
+
+        return key
+
+    async def on_mode_change(self, newmode):
+        if newmode != self._mode_name:
+            self._visible = False
+            return
+
+        # Nothing is fetched until the view has been shown once.
+        self._visible = True
+        await self._statsstore.set_window(self._window)
+        self._schedule_update()
+        await self._draw_if_visible()
@@ -0,0 +1,110 @@
+# Copyright (c) 2014-2017 esotericnonsense (Daniel Edgecumbe)
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or https://opensource.org/licenses/mit-license.php
+
+"""
+Synthetic blocks and transactions, serialized as bitcoind would. They
+aren't valid (no proof of work, made up scripts), only well-formed.
+"""
+
+import struct
+
+import primitives
+
+REGTEST_MAGIC = bytes.fromhex("fabfb5da")
+REGTEST_BITS = 0x207fffff
+GENESIS_TIME = 1296688602
+
+
+def compact_size(n):
+    if n < 0xfd:
+        return bytes([n])
+    if n <= 0xffff:
+        return b"\xfd" + struct.pack("<H", n)
+    if n <= 0xffffffff:
+        return b"\xfe" + struct.pack("<I", n)
+    return b"\xff" + struct.pack("<Q", n)
+
+
+def script(data):
+    return compact_size(len(data)) + data
+
+
+def transaction(inputs, outputs, witnesses=None, version=2, locktime=0):
+    """
+    inputs are (prevout txid, prevout n, scriptSig, sequence), outputs
+    are (satoshis, scriptPubKey); witnesses, if given, hold a list of
+    stack items for each input.
+    """
+    ins = b"".join(
+        bytes.fromhex(txid)[::-1] + struct.pack("<I", n) + script(sig) + struct.pack("<I", sequence)
+        for txid, n, sig, sequence in inputs
+    )
+    outs = b"".join(struct.pack("<q", value) + script(spk) for value, spk in outputs)
+    body = compact_size(len(inputs)) + ins + compact_size(len(outputs)) + outs
+
+    if witnesses is None:
+        return struct.pack("<i", version) + body + struct.pack("<I", locktime)
+
+    stacks = b"".join(
+        compact_size(len(stack)) + b"".join(script(item) for item in stack)
+        for stack in witnesses
+    )
+    return struct.pack("<i", version) + b"\x00\x01" + body + stacks + struct.pack("<I", locktime)
+
+
+def txid(tx):
+    """ The txid of a serialized transaction, as hex. """
+    return primitives.Transaction.parse(tx, end=len(tx)).txid
+
+
+def coinbase(height, satoshis=5000000000):
+    spk = bytes.fromhex("0014") + bytes([height % 256]) * 20
+    return transaction(
+        [("00" * 32, 0xffffffff, b"\x03" + height.to_bytes(3, "little"), 0xffffffff)],
+        [(satoshis, spk)],
+    )
+
+
+def spend(prevout, n, satoshis):
+    """ A segwit transaction spending prevout:n to a P2WPKH output and an OP_RETURN. """
+    return transaction(
+        [(prevout, n, b"", 0xfffffffd)],
+        [(satoshis, bytes.fromhex("0014") + b"\x11" * 20), (0, bytes.fromhex("6a0474657374"))],
+        witnesses=[[b"\x30" * 71, b"\x02" * 33]],
+    )
+
+
+def header(prevhash, merkleroot, time, nonce=0, version=0x20000000):
+    return primitives.HEADER.pack(version, bytes.fromhex(prevhash)[::-1], merkleroot,
+                                  time, REGTEST_BITS, nonce)
+
+
+def block(prevhash, txs, time, nonce=0):
+    """ A serialized block. The merkle root is only a stand-in. """
+    merkleroot = primitives.sha256d(*txs)
+    return header(prevhash, merkleroot, time, nonce) + compact_size(len(txs)) + b"".join(txs)
+
+
+def block_hash(data):
+    return primitives.hash_hex(primitives.sha256d(data[:primitives.HEADER_SIZE]))
+
+
+def chain(length, prevhash="00" * 32, height=0):
+    """
+    length linked blocks, as (hash, serialized block, [serialized
+    transactions]). Each block after the first also spends the coinbase
+    of the one before it with a segwit transaction.
+    """
+    blocks = []
+    prevcoinbase = None
+    for i in range(length):
+        txs = [coinbase(height + i)]
+        if prevcoinbase is not None:
+            txs.append(spend(txid(prevcoinbase), 0, 4999990000))
+        data = block(prevhash, txs, GENESIS_TIME + 600 * (height + i))
+        prevhash = block_hash(data)
+        blocks.append((prevhash, data, txs))
+        prevcoinbase = txs[0]
+
+    return blocks
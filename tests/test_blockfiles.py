@@ -0,0 +1,176 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+import blockfiles
+import fixtures
+
+KEY = bytes.fromhex("0123456789abcdef")
+PREALLOCATED = 4096  # zeros past the last record, as bitcoind leaves them
+
+old_locks = pytest.mark.skipif(sys.version_info >= (3, 10),
+                               reason="BlockFiles uses 'with await lock'")
+
+
+def records(blocks):
+    return b"".join(fixtures.REGTEST_MAGIC + len(data).to_bytes(4, "little") + data
+                    for data in blocks)
+
+
+def write_blk(blocksdir, number, data, key=None, offset=0):
+    """ Write data at offset in blk<number>.dat, XORed with key as bitcoind would. """
+    if key is not None:
+        data = blockfiles.deobfuscate(data, key, offset)
+
+    path = os.path.join(blocksdir, "blk{:05d}.dat".format(number))
+    with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+        f.seek(offset)
+        f.write(data)
+    return path
+
+
+def make_blocksdir(tmp_path, key=None):
+    blocksdir = str(tmp_path)
+    if key is not None:
+        with open(os.path.join(blocksdir, "xor.dat"), "wb") as f:
+            f.write(key)
+    return blocksdir
+
+
+@pytest.fixture(params=[None, KEY], ids=["plain", "xor"])
+def key(request):
+    return request.param
+
+
+def test_read_block_across_files(tmp_path, key):
+    blocksdir = make_blocksdir(tmp_path, key)
+    chain = fixtures.chain(6)
+    datas = [data for _, data, _ in chain]
+    write_blk(blocksdir, 0, records(datas[:3]), key)
+    write_blk(blocksdir, 1, records(datas[3:]) + bytes(PREALLOCATED), key)
+
+    files = blockfiles.BlockFiles(blocksdir)
+    for blockhash, data, txs in chain:
+        block = files.read_block(blockhash)
+        assert block.hash == blockhash
+        assert block.get_bytes() == data
+        assert block["tx"] == [fixtures.txid(tx) for tx in txs]
+
+    assert files.read_block("00" * 32) is None
+
+
+def test_wrong_key_finds_nothing(tmp_path):
+    blocksdir = make_blocksdir(tmp_path, KEY)
+    blockhash, data, _ = fixtures.chain(1)[0]
+    write_blk(blocksdir, 0, records([data]))  # not obfuscated
+
+    assert blockfiles.BlockFiles(blocksdir).read_block(blockhash) is None
+
+
+def test_last_file_grows(tmp_path, key):
+    blocksdir = make_blocksdir(tmp_path, key)
+    chain = fixtures.chain(4)
+    first = records([data for _, data, _ in chain[:2]])
+    write_blk(blocksdir, 0, first + bytes(PREALLOCATED), key)
+
+    files = blockfiles.BlockFiles(blocksdir)
+    assert files.read_block(chain[1][0]).hash == chain[1][0]
+    assert files.read_block(chain[2][0]) is None
+
+    # Written into the space allocated ahead, so the size doesn't change.
+    second = records([chain[2][1]])
+    write_blk(blocksdir, 0, second, key, offset=len(first))
+    assert files.read_block(chain[2][0]).hash == chain[2][0]
+
+    # Then on past the end of it, and into a new file.
+    offset = len(first) + len(second)
+    third = records([chain[3][1]])
+    write_blk(blocksdir, 0, third + bytes(PREALLOCATED), key, offset=offset)
+    assert files.read_block(chain[3][0]).hash == chain[3][0]
+
+    # A block written just before the node moved on is found too.
+    more = fixtures.chain(2, prevhash=chain[3][0], height=4)
+    write_blk(blocksdir, 0, records([more[0][1]]), key, offset=offset + len(third))
+    write_blk(blocksdir, 1, records([more[1][1]]), key)
+    assert files.read_block(more[1][0]).hash == more[1][0]
+    assert files.read_block(more[0][0]).hash == more[0][0]
+
+
+def test_partly_written_record(tmp_path, key):
+    blocksdir = make_blocksdir(tmp_path, key)
+    chain = fixtures.chain(3)
+    whole = records([data for _, data, _ in chain[:2]])
+    last = records([chain[2][1]])
+    write_blk(blocksdir, 0, whole + last[:len(last) // 2], key)
+
+    files = blockfiles.BlockFiles(blocksdir)
+    assert files.read_block(chain[1][0]).hash == chain[1][0]
+    assert files.read_block(chain[2][0]) is None
+
+    write_blk(blocksdir, 0, last[len(last) // 2:], key, offset=len(whole) + len(last) // 2)
+    assert files.read_block(chain[2][0]).hash == chain[2][0]
+
+
+def test_pruned_file(tmp_path, key):
+    blocksdir = make_blocksdir(tmp_path, key)
+    chain = fixtures.chain(2)
+    path = write_blk(blocksdir, 0, records([chain[0][1]]), key)
+    write_blk(blocksdir, 1, records([chain[1][1]]), key)
+
+    files = blockfiles.BlockFiles(blocksdir)
+    assert files.read_block(chain[0][0]).hash == chain[0][0]
+
+    os.remove(path)
+    assert files.read_block(chain[0][0]) is None
+    assert files.read_block(chain[1][0]).hash == chain[1][0]
+
+
+def one_block_per_file(blocksdir, n):
+    chain = fixtures.chain(n)
+    for number, (_, data, _) in enumerate(chain):
+        write_blk(blocksdir, number, records([data]))
+    return chain
+
+
+def test_lookup_scans_a_few_files(tmp_path):
+    blocksdir = make_blocksdir(tmp_path)
+    count = 2 * blockfiles.SCAN_FILES + 2
+    chain = one_block_per_file(blocksdir, count)
+
+    files = blockfiles.BlockFiles(blocksdir)
+    # The newest file and SCAN_FILES before it.
+    assert files.read_block("00" * 32) is None
+    assert len(files._scanned) == blockfiles.SCAN_FILES + 1
+    assert files.read_block(chain[-1 - blockfiles.SCAN_FILES][0]) is not None
+
+    # Too far back for one lookup; the next one gets there.
+    assert files.read_block(chain[0][0]) is None
+    assert files.read_block(chain[0][0]).hash == chain[0][0]
+    assert not files._unscanned()
+
+
+@old_locks
+def test_get_block_indexes_in_the_background(tmp_path):
+    blocksdir = make_blocksdir(tmp_path)
+    chain = one_block_per_file(blocksdir, blockfiles.SCAN_FILES + 5)
+
+    async def test():
+        files = blockfiles.BlockFiles(blocksdir)
+        first = await files.get_block(chain[0][0])
+        indexing = files._indexing
+        await indexing
+        return first, indexing, files
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        first, indexing, files = loop.run_until_complete(test())
+    finally:
+        loop.close()
+
+    assert first is None
+    assert indexing is not None and files._indexing is None
+    assert not files._unscanned()
+    assert files.read_block(chain[0][0]).hash == chain[0][0]
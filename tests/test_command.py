@@ -0,0 +1,26 @@
+import decimal
+
+import command
+
+
+def run(text, value):
+    (_, call), = command.parse(text)
+    return command.evaluate(call.pipeline, value)
+
+
+def test_select_keeps_zero():
+    peers = [
+        {"id": 0, "x": 0},
+        {"id": 1, "x": 0.0},
+        {"id": 2, "x": decimal.Decimal(0)},
+        {"id": 3, "x": ""},
+        {"id": 4, "x": False},
+        {"id": 5, "x": None},
+        {"id": 6},
+    ]
+    assert run("getpeerinfo | [] | select(.x) | .id", peers) == [0, 1, 2, 3]
+
+
+def test_select_comparison():
+    peers = [{"id": 0, "inbound": True}, {"id": 1, "inbound": False}]
+    assert run("getpeerinfo | [] | select(.inbound == true) | .id", peers) == [0]
@@ -0,0 +1,62 @@
+import functools
+import json
+
+import console
+import rpc
+
+
+def status(ident):
+    return "running"
+
+
+def fill(buffer, n):
+    for i in range(n):
+        ident = buffer.append("getx {}".format(i))
+        buffer.set_response(ident, {"values": list(range(i % 7 * 5))})
+
+
+def test_scrolling_matches_the_whole_buffer():
+    buffer = console.ConsoleBuffer(console.HISTORY_BYTES)
+    fill(buffer, 40)
+
+    everything = buffer.get_lines(0, len(buffer), status)
+    assert len(everything) == len(buffer)
+
+    firsts = list(range(len(buffer))) + list(range(len(buffer) - 1, -1, -1)) + [0, 300, 17, 0]
+    for first in firsts:
+        assert buffer.get_lines(first, 16, status) == everything[first:first+16]
+
+
+def test_only_recent_entries_stay_formatted():
+    buffer = console.ConsoleBuffer(console.HISTORY_BYTES)
+    fill(buffer, 3 * console.FORMAT_CACHE)
+
+    assert len(buffer._cache) == console.FORMAT_CACHE
+    assert not any(isinstance(entry[1], console.Formatted) for entry in buffer._entries)
+
+
+def test_history_is_capped_by_formatted_size():
+    buffer = console.ConsoleBuffer(4096)
+    fill(buffer, 100)
+
+    assert buffer._bytes <= 4096 or len(buffer._entries) == 1
+    assert buffer._dropped > 0
+
+
+def test_small_responses_are_not_formatted_up_front():
+    body = json.dumps({"result": {"a": [1, 2, 3]}, "error": None, "id": None})
+    prepare = functools.partial(console.prepare_response, None)
+
+    # What the worker returns for a large body, and the loop for a small one.
+    formatted = rpc.decode_response(body, prepare, console.format_prepared)
+    raw = rpc.decode_response(body, prepare)
+
+    assert isinstance(formatted, console.Formatted)
+    assert raw == json.loads(body)
+
+    buffer = console.ConsoleBuffer(console.HISTORY_BYTES)
+    for response in (formatted, raw):
+        buffer.set_response(buffer.append("getx"), response)
+    lines = buffer.get_lines(0, len(buffer), status)
+    half = len(lines) // 2
+    assert lines[1:half] == lines[half+1:]
@@ -0,0 +1,24 @@
+import pytest
+
+import fixtures
+import primitives
+
+
+def test_truncated_transactions_raise_deserializationerror():
+    tx = fixtures.spend("ab" * 32, 0, 1000)
+    for end in range(len(tx)):
+        with pytest.raises(primitives.DeserializationError):
+            primitives.Transaction.parse(tx[:end], end=end)
+
+
+def test_truncated_after_segwit_marker():
+    # Version and a zero marker byte, then nothing: no room for the flag.
+    with pytest.raises(primitives.DeserializationError):
+        primitives.Transaction.parse(bytes(5))
+
+
+def test_truncated_blocks_raise_deserializationerror():
+    _, data, _ = fixtures.chain(2)[1]
+    for end in range(0, len(data), 7):
+        with pytest.raises(primitives.DeserializationError):
+            primitives.Block.parse(data[:end])
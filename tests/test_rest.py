@@ -0,0 +1,284 @@
+import asyncio
+
+import pytest
+
+import fixtures
+import primitives
+import rest
+import transport
+from rpc import RPCContentError
+
+class StandIn(object):
+    """ A stand-in for bitcoind's REST interface: fixed bodies by path, 404 otherwise. """
+    def __init__(self, bodies):
+        self.bodies = bodies
+        self.paths = []
+        self._connections = {}  # handler task -> writer
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+        return "http://127.0.0.1:{}".format(self._server.sockets[0].getsockname()[1])
+
+    async def close(self):
+        self._server.close()
+        await self._server.wait_closed()
+        # The clients keep their connections alive; hang up on them.
+        for writer in self._connections.values():
+            writer.close()
+        await asyncio.gather(*self._connections)
+
+    async def _serve(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections[task] = writer
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                path = head.split(b" ", 2)[1].decode("latin-1")
+                self.paths.append(path)
+
+                body = self.bodies.get(path)
+                status = b"200 OK"
+                if body is None:
+                    status, body = b"404 Not Found", b"Not found\r\n"
+                writer.write(b"HTTP/1.1 " + status + b"\r\n"
+                             b"Content-Type: application/octet-stream\r\n"
+                             b"Content-Length: %d\r\n\r\n" % len(body) + body)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+            del self._connections[task]
+
+
+class FakeRPC(object):
+    """ Answers the few RPC calls the stores make from a dict. """
+    def __init__(self, results):
+        self.results = results
+        self.calls = []
+
+    async def request(self, method, params=None, **kwargs):
+        self.calls.append((method, params))
+        try:
+            result = self.results[method, tuple(params or [])]
+        except KeyError:
+            raise RPCContentError("{} {}".format(method, params))
+        return {"result": result, "error": None, "id": 0}
+
+
+CHAIN = fixtures.chain(4)
+
+
+def rest_bodies(blocks=CHAIN, old_headers=False):
+    """ What a node serves for blocks; old_headers for one before 24.0. """
+    headers_path = "/rest/headers/{1}/{0}.bin" if old_headers else "/rest/headers/{0}.bin?count={1}"
+    bodies = {}
+    for i, (blockhash, data, txs) in enumerate(blocks):
+        bodies["/rest/block/{}.bin".format(blockhash)] = data
+        for tx in txs:
+            bodies["/rest/tx/{}.bin".format(fixtures.txid(tx))] = tx
+        for count in range(1, 11):
+            headers = b"".join(d[:primitives.HEADER_SIZE] for _, d, _ in blocks[i:i+count])
+            bodies[headers_path.format(blockhash, count)] = headers
+    return bodies
+
+
+def run(test, bodies, transport_name="builtin"):
+    """ Run test(client, server) against a stand-in serving bodies. """
+    async def main():
+        server = StandIn(bodies)
+        url = await server.start()
+        try:
+            client = rest.RESTClient(transport.make_transport(transport_name, url, "dTpw"))
+            return await test(client, server)
+        finally:
+            await server.close()
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(main())
+    finally:
+        loop.close()
+
+
+@pytest.fixture(params=["builtin", "aiohttp"])
+def transport_name(request):
+    if request.param == "aiohttp":
+        pytest.importorskip("aiohttp")
+    return request.param
+
+
+def test_get_block(transport_name):
+    blockhash, data, txs = CHAIN[2]
+
+    async def test(client, server):
+        return await client.get_block(blockhash)
+
+    block = run(test, rest_bodies(), transport_name)
+
+    assert isinstance(block, primitives.Block)
+    assert block.hash == blockhash
+    assert block["previousblockhash"] == CHAIN[1][0]
+    assert block["tx"] == [fixtures.txid(tx) for tx in txs]
+    assert block["size"] == len(data)
+    assert block["strippedsize"] < block["size"]
+
+    coinbase, spend = block.get_transaction(0), block.get_transaction(1)
+    assert "coinbase" in coinbase["vin"][0]
+    assert spend["vin"][0]["txid"] == fixtures.txid(CHAIN[1][2][0])
+    assert spend["vin"][0]["txinwitness"] == ["30" * 71, "02" * 33]
+    assert spend["vout"][0]["value"] == 49.9999
+    assert spend["blockhash"] == blockhash
+    assert spend["txid"] != spend["hash"]
+
+
+def test_get_transaction(transport_name):
+    tx = CHAIN[3][2][1]
+    txid = fixtures.txid(tx)
+
+    async def test(client, server):
+        return await client.get_transaction(txid)
+
+    transaction = run(test, rest_bodies(), transport_name)
+
+    assert isinstance(transaction, primitives.Transaction)
+    assert transaction["txid"] == txid
+    assert transaction["size"] == len(tx)
+    assert transaction["vsize"] < transaction["size"]
+    assert [out["n"] for out in transaction["vout"]] == [0, 1]
+    assert "blockhash" not in transaction
+
+
+def test_get_headers_walks_the_chain():
+    async def test(client, server):
+        return await client.get_headers(10, CHAIN[0][0]), server.paths
+
+    headers, paths = run(test, rest_bodies())
+
+    assert [header.hash for header in headers] == [blockhash for blockhash, _, _ in CHAIN]
+    for prev, header in zip(headers, headers[1:]):
+        assert header["previousblockhash"] == prev.hash
+    assert paths == ["/rest/headers/{}.bin?count=10".format(CHAIN[0][0])]
+
+
+def test_get_headers_old_node():
+    async def test(client, server):
+        first = await client.get_headers(2, CHAIN[0][0])
+        second = await client.get_headers(2, CHAIN[1][0])
+        return first + second, server.paths
+
+    headers, paths = run(test, rest_bodies(old_headers=True))
+
+    assert [header.hash for header in headers] == [CHAIN[0][0], CHAIN[1][0], CHAIN[1][0], CHAIN[2][0]]
+    # Only the first request tries the new form.
+    assert paths == [
+        "/rest/headers/{}.bin?count=2".format(CHAIN[0][0]),
+        "/rest/headers/2/{}.bin".format(CHAIN[0][0]),
+        "/rest/headers/2/{}.bin".format(CHAIN[1][0]),
+    ]
+
+
+def test_not_found_raises():
+    async def test(client, server):
+        with pytest.raises(RPCContentError):
+            await client.get_block("ab" * 32)
+        with pytest.raises(RPCContentError):
+            await client.get_transaction("cd" * 32)
+        # The connection is still good after a 404.
+        return await client.get_block(CHAIN[0][0])
+
+    assert run(test, rest_bodies()).hash == CHAIN[0][0]
+
+
+def test_mismatched_body_raises():
+    bodies = rest_bodies()
+    # Serve the wrong block under the first block's hash.
+    bodies["/rest/block/{}.bin".format(CHAIN[0][0])] = CHAIN[1][1]
+
+    async def test(client, server):
+        with pytest.raises(RPCContentError):
+            await client.get_block(CHAIN[0][0])
+
+    run(test, bodies)
+
+
+# The stores take their locks with "with await", which Python 3.10
+# dropped, so these go straight to the fetches behind the locks.
+
+def test_blockstore_falls_back_on_404():
+    import block
+
+    served, pruned = CHAIN[3], CHAIN[1]
+    bodies = rest_bodies()
+    del bodies["/rest/block/{}.bin".format(pruned[0])]
+
+    rpc = FakeRPC({
+        ("getblockheader", (served[0],)): {"height": 3, "confirmations": 1},
+        ("getblock", (pruned[0],)): {"hash": pruned[0], "height": 1, "confirmations": 3},
+    })
+
+    async def test(client, server):
+        store = block.BlockStore(rpc, client)
+        return await store._fetch_block(served[0]), await store._fetch_block(pruned[0])
+
+    got_served, got_pruned = run(test, bodies)
+
+    assert isinstance(got_served, primitives.Block)
+    assert got_served["height"] == 3
+    assert got_pruned == {"hash": pruned[0], "height": 1, "confirmations": 3}
+    assert ("getblock", [pruned[0]]) in rpc.calls
+    assert ("getblock", [served[0]]) not in rpc.calls
+
+
+def test_blockstore_walks_headers():
+    import block
+
+    rpc = FakeRPC({})
+
+    async def test(client, server):
+        store = block.BlockStore(rpc, client)
+        return await store._fetch_nextblockhash_n(CHAIN[0][0], 0, 2), server.paths
+
+    nexthash, paths = run(test, rest_bodies())
+
+    assert nexthash == CHAIN[2][0]
+    assert paths == ["/rest/headers/{}.bin?count=3".format(CHAIN[0][0])]
+    assert rpc.calls == []
+
+
+def test_blockstore_walks_by_height_without_headers():
+    import block
+
+    bodies = {path: body for path, body in rest_bodies().items() if "/headers/" not in path}
+    rpc = FakeRPC({("getblockhash", (2,)): CHAIN[2][0]})
+
+    async def test(client, server):
+        store = block.BlockStore(rpc, client)
+        return await store._fetch_nextblockhash_n(CHAIN[0][0], 0, 2)
+
+    assert run(test, bodies) == CHAIN[2][0]
+    assert rpc.calls == [("getblockhash", [2])]
+
+
+def test_transactionstore_falls_back_on_404():
+    import transaction
+
+    mempool_tx, missing_txid = CHAIN[2][2][1], "ef" * 32
+    mempool_txid = fixtures.txid(mempool_tx)
+
+    rpc = FakeRPC({
+        ("getmempoolentry", (mempool_txid,)): {"vsize": 100},
+        ("getrawtransaction", (missing_txid, True)): {"txid": missing_txid, "confirmations": 0},
+    })
+
+    async def test(client, server):
+        store = transaction.TransactionStore(rpc, client)
+        return (await store._fetch_transaction(mempool_txid),
+                await store._fetch_transaction(missing_txid))
+
+    got_rest, got_rpc = run(test, rest_bodies())
+
+    assert isinstance(got_rest, primitives.Transaction)
+    assert got_rest["confirmed"] is False
+    assert got_rpc == {"txid": missing_txid, "confirmations": 0}
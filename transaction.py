@@ -6,14 +6,44 @@ import datetime
 import curses
 import asyncio
 
+import address
 import view
 from macros import TX_VERBOSE_MODE
+from rpc import RPCError, RPCContentError
 from util import isoformatseconds
 
 
+def _fit(text, width):
+    """ Right-justify text in width, eliding its middle if too long. """
+    if len(text) > width:
+        head = (width - 3) // 2
+        text = text[:head] + "..." + text[len(text)-(width-3-head):]
+    return text.rjust(width)
+
+
+def _describe_output(out, chain, width):
+    """ The address paid by an output, or a description of its script. """
+    try:
+        _, text = address.describe(out["scriptPubKey"]["hex"], chain)
+    except KeyError:
+        text = "???"
+    return _fit(text, width)
+
+
 class TransactionStore(object):
-    def __init__(self, client):
+    """
+    Transactions by txid, as getrawtransaction JSON or as
+    primitives.Transaction objects. The latter come from the raw blocks
+    the blockstore holds when they can, and don't need -txindex, or
+    otherwise from a rest.RESTClient if there is one. Deep enough
+    getrawtransaction results are kept in the chaincache.ChainCache, if
+    given, for later sessions.
+    """
+    def __init__(self, client, rest=None, blockstore=None, cache=None):
         self._client = client
+        self._rest = rest
+        self._blockstore = blockstore
+        self._cache = cache
 
         self._lock = asyncio.Lock()
 
@@ -24,10 +54,45 @@ class TransactionStore(object):
             try:
                 return self._transactions[txid]
             except KeyError:
-                # TODO: handle error if the transaction doesn't exist at all.
-                j = await self._client.request("getrawtransaction", [txid, True])
-                self._transactions[txid] = j["result"]
-                return j["result"]
+                pass
+
+            transaction = await self._fetch_transaction(txid)
+            self._transactions[txid] = transaction
+            return transaction
+
+    async def _fetch_transaction(self, txid):
+        """ The transaction from a known block, the cache, REST or RPC, in that order. """
+        transaction = None
+        if self._blockstore is not None:
+            transaction = self._blockstore.find_transaction(txid)
+
+        if transaction is None and self._cache is not None:
+            transaction = await self._cache.get_transaction(txid)
+
+        if transaction is None and self._rest is not None:
+            try:
+                transaction = await self._rest.get_transaction(txid)
+            except RPCContentError:
+                # Not served over REST (no -txindex, say); try the RPC.
+                transaction = None
+            else:
+                # The block isn't known, but at least say whether there is one.
+                try:
+                    await self._client.request("getmempoolentry", [txid])
+                    transaction.confirmed = False
+                except RPCError:
+                    transaction.confirmed = True
+
+        # TODO: handle error if the transaction doesn't exist at all.
+        if transaction is None:
+            j = await self._client.request("getrawtransaction", [txid, True])
+            transaction = j["result"]
+            if self._cache is not None and self._cache.is_final(transaction.get("confirmations", 0)):
+                # The cache checks entries against the chain by height.
+                j = await self._client.request("getblockheader", [transaction["blockhash"]])
+                await self._cache.put_transaction(transaction, j["result"]["height"])
+
+        return transaction
 
 
 class TransactionView(view.View):
@@ -39,6 +104,8 @@ class TransactionView(view.View):
         self._edit_mode = False  # Are we in edit mode?
         self._edit_buffer = ""
 
+        self._chain = address.DEFAULT_CHAIN  # for address encoding
+
         self._txid = None  # currently browsed txid.
         self._selected_input = None # (index, txid)
         self._input_offset = None # (offset, txid)
@@ -69,9 +136,10 @@ class TransactionView(view.View):
         CYELLOW = curses.color_pair(5)
         CBOLD = curses.A_BOLD
 
-        self._pad.addstr(0, 1, "time {}".format(
-            isoformatseconds(datetime.datetime.utcfromtimestamp(transaction["time"]))
-        ), CBOLD)
+        if "time" in transaction:
+            self._pad.addstr(0, 1, "time {}".format(
+                isoformatseconds(datetime.datetime.utcfromtimestamp(transaction["time"]))
+            ), CBOLD)
         self._pad.addstr(1, 1, "size {}b".format(transaction["size"]), CBOLD)
         self._pad.addstr(1, 15, "vsize {}b".format(transaction["vsize"]), CBOLD)
         self._pad.addstr(2, 1, "locktime {}".format(transaction["locktime"]), CBOLD)
@@ -81,6 +149,9 @@ class TransactionView(view.View):
         self._pad.addstr(1, 31, "hash {}".format(transaction["hash"]), CBOLD)
         if "blockhash" in transaction:
             self._pad.addstr(2, 30, "block {}".format(transaction["blockhash"]), CBOLD)
+        elif transaction.get("confirmed"):
+            # Fetched over REST; the block isn't known.
+            self._pad.addstr(2, 58, "confirmed transaction", CBOLD + CGREEN)
         else:
             self._pad.addstr(2, 58, "unconfirmed transaction!", CBOLD + CRED)
 
@@ -122,20 +193,7 @@ class TransactionView(view.View):
             elif inouts is not None: # TX_VERBOSE_MODE
                 # Find the vout
                 inout = inouts[i]
-                inputstr = "{}".format(str(inout)[:40])
-                spk = inout["scriptPubKey"]
-                if "addresses" in spk:
-                    if len(spk["addresses"]) > 1:
-                        inoutstring = "<{} addresses>".format(len(spk["addresses"]))
-                    elif len(spk["addresses"]) == 1:
-                        inoutstring = spk["addresses"][0].rjust(34)
-                    else:
-                        raise Exception("addresses present in scriptPubKey, but 0 addresses")
-                elif "asm" in spk:
-                    inoutstring = spk["asm"][:34]
-                else:
-                    inoutstring = "???"
-
+                inoutstring = _describe_output(inout, self._chain, 49)
                 inputstr = "{:05d} {} {: 15.8f} BTC".format(i, inoutstring, inout["value"])
             else:
                 inputstr = "{:05d} {}:{:05d}".format(i, inp["txid"], inp["vout"])
@@ -179,18 +237,7 @@ class TransactionView(view.View):
                 break
 
             # A 1 million BTC output would be rather surprising. Pad to six.
-            spk = out["scriptPubKey"]
-            if "addresses" in spk:
-                if len(spk["addresses"]) > 1:
-                    outstring = "<{} addresses>".format(len(spk["addresses"]))
-                elif len(spk["addresses"]) == 1:
-                    outstring = spk["addresses"][0].rjust(34)
-                else:
-                    raise Exception("addresses present in scriptPubKey, but 0 addresses")
-            elif "asm" in spk:
-                outstring = spk["asm"][:80]
-            else:
-                outstring = "???"
+            outstring = _describe_output(out, self._chain, 64)
 
             if i == self._selected_output[0] and self._txid == self._selected_output[1]:
                 outputcolor = CGREEN + CBOLD + CREVERSE
@@ -438,6 +485,16 @@ class TransactionView(view.View):
 
         return key
 
+    async def on_blockchaininfo(self, key, obj):
+        try:
+            chain = obj["result"]["chain"]
+        except KeyError:
+            return
+
+        if chain != self._chain:
+            self._chain = chain
+            await self._draw_if_visible()
+
     async def on_mode_change(self, newmode):
         """ Overrides view.View to set the edit mode inactive. """
         if newmode != self._mode_name:
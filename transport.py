@@ -0,0 +1,308 @@
+# Copyright (c) 2014-2017 esotericnonsense (Daniel Edgecumbe)
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or https://opensource.org/licenses/mit-license.php
+
+import asyncio
+import async_timeout
+import urllib.parse
+
+from rpc import TIMEOUT, RPCTimeoutError, RPCConnectionError
+
+CHUNK_SIZE = 64 * 1024
+MAX_CONNECTIONS = 4  # beyond which requests are pipelined
+
+TRANSPORTS = ["aiohttp", "builtin"]
+
+
+class AiohttpTransport(object):
+    """
+    HTTP through aiohttp, with a session per request. aiohttp is only
+    imported on first use, as it takes longer to import than the rest
+    of the program.
+    """
+    def __init__(self, url, auth):
+        self._url = url
+        self._headers = {
+            "Authorization": "Basic {}".format(auth),
+            "Content-Type": "text/plain",
+        }
+
+    async def fetch(self, path, body=None, timeout=TIMEOUT, consume=None):
+        """
+        POST body to path (or GET it, without a body). Returns the status
+        and the response body or, given consume, what consume returns
+        given an async iterator of the body's chunks.
+        """
+        import aiohttp
+
+        method = "GET" if body is None else "POST"
+        try:
+            with async_timeout.timeout(timeout):
+                async with aiohttp.ClientSession() as session:
+                    async with session.request(method, self._url + path,
+                                               headers=self._headers, data=body) as response:
+                        if consume is None:
+                            return response.status, await response.read()
+
+                        return response.status, await consume(response.content.iter_chunked(CHUNK_SIZE))
+        except asyncio.TimeoutError:
+            raise RPCTimeoutError
+        except aiohttp.client_exceptions.ClientOSError:
+            raise RPCConnectionError
+
+
+class StaleConnection(Exception):
+    """ The node closed a kept-alive connection before reading from it. """
+    pass
+
+
+class _Connection(object):
+    """
+    A kept-alive HTTP/1.1 connection. Requests may be pipelined: each is
+    written as soon as it is made, and its response is read once the one
+    before it has been read in full. Any failure part way through a
+    response closes the connection, as there's no telling where the next
+    one starts.
+    """
+    def __init__(self, reader, writer):
+        self._reader = reader
+        self._writer = writer
+
+        self.pending = 0
+        self._tail = None  # set once the last response so far has been read
+        self._used = False
+        self._stale = False  # closed by the node before the rest were read
+        self.closed = False
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._writer.close()
+
+    async def exchange(self, head, body, consume):
+        loop = asyncio.get_event_loop()
+        prev, done = self._tail, loop.create_future()
+        self._tail = done
+        # Written to a connection with nothing outstanding, which the node
+        # may have closed in the meantime.
+        first = self._used and prev.done()
+        self._used = True
+
+        self.pending += 1
+        self._writer.writelines([head, body] if body else [head])
+
+        if prev is not None:
+            try:
+                # Shielded, so as not to cancel the one before if this times out.
+                await asyncio.shield(prev)
+            except asyncio.CancelledError:
+                # The response is still on its way and has to be read past.
+                asyncio.ensure_future(self._skip(prev, done))
+                raise
+
+        try:
+            return await self._respond(first, consume)
+        except BaseException:
+            self.close()
+            raise
+        finally:
+            self.pending -= 1
+            done.set_result(None)
+
+    async def _skip(self, prev, done):
+        try:
+            await prev
+            await self._respond(False, None)
+        except BaseException:
+            self.close()
+        finally:
+            self.pending -= 1
+            done.set_result(None)
+
+    async def _respond(self, first, consume):
+        if self._stale:
+            raise StaleConnection
+        if self.closed:
+            # A request before this one failed part way; this one may or
+            # may not have been seen.
+            raise RPCTimeoutError
+
+        try:
+            status, headers = await self._read_head()
+        except (asyncio.IncompleteReadError, ConnectionResetError, BrokenPipeError) as e:
+            if first and not getattr(e, "partial", b""):
+                self._stale = True
+                raise StaleConnection
+            raise
+
+        chunks = self._iter_body(headers)
+        if consume is None:
+            result = b"".join([chunk async for chunk in chunks])
+        else:
+            result = await consume(chunks)
+            # Anything left over would be read as the next response.
+            async for _ in chunks:
+                pass
+
+        if headers.get("connection", "").lower() == "close":
+            # Nothing pipelined after this will be answered.
+            self._stale = True
+            self.close()
+
+        return status, result
+
+    async def _read_head(self):
+        line = await self._reader.readuntil(b"\r\n")
+        try:
+            status = int(line.split(None, 2)[1])
+        except (IndexError, ValueError):
+            raise ConnectionError("bad HTTP status line {!r}".format(line[:64]))
+
+        headers = {}
+        while True:
+            line = await self._reader.readuntil(b"\r\n")
+            if line == b"\r\n":
+                return status, headers
+
+            key, _, value = line.decode("latin-1").partition(":")
+            headers[key.strip().lower()] = value.strip()
+
+    async def _iter_body(self, headers):
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            while True:
+                line = await self._reader.readuntil(b"\r\n")
+                try:
+                    size = int(line.split(b";", 1)[0], 16)
+                except ValueError:
+                    raise ConnectionError("bad chunk size {!r}".format(line[:64]))
+                if size == 0:
+                    # No trailers are expected, just the final blank line.
+                    await self._reader.readuntil(b"\r\n")
+                    return
+
+                while size:
+                    chunk = await self._reader.read(min(size, CHUNK_SIZE))
+                    if not chunk:
+                        raise asyncio.IncompleteReadError(b"", size)
+                    size -= len(chunk)
+                    yield chunk
+                await self._reader.readexactly(2)
+
+        try:
+            length = int(headers["content-length"])
+        except (KeyError, ValueError):
+            raise ConnectionError("no content length in HTTP response")
+
+        while length:
+            chunk = await self._reader.read(min(length, CHUNK_SIZE))
+            if not chunk:
+                raise asyncio.IncompleteReadError(b"", length)
+            length -= len(chunk)
+            yield chunk
+
+
+class StreamTransport(object):
+    """
+    A small HTTP/1.1 client on asyncio streams, to the node's TCP port or
+    a Unix socket, for when importing aiohttp isn't worth it: the client
+    only ever POSTs small JSON bodies to one host.
+
+    Connections are kept alive and reused, up to max_connections; past
+    that, requests are pipelined onto the least busy one. The request
+    line and headers are built once per path and reused. A request that
+    finds its reused connection closed by the node (-rpcservertimeout)
+    is retried once on a new one, since it can't have been seen; the
+    other idle connections are dropped along with it.
+    """
+    def __init__(self, url, auth, unix_path=None, max_connections=MAX_CONNECTIONS):
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme != "http":
+            raise ValueError("the builtin transport only speaks http, not {}".format(parts.scheme))
+
+        self._host = parts.hostname
+        self._port = parts.port or 80
+        self._unix_path = unix_path
+        self._max_connections = max_connections
+
+        self._headers = (
+            "Host: {}\r\n"
+            "Authorization: Basic {}\r\n"
+            "Content-Type: text/plain\r\n"
+        ).format(parts.netloc if unix_path is None else "localhost", auth)
+        self._heads = {}  # (method, path) -> request line and headers
+
+        self._connections = []
+        self._opening = set()  # connections being opened
+
+    def _head(self, path, length):
+        method = "GET" if length is None else "POST"
+        try:
+            head = self._heads[method, path]
+        except KeyError:
+            head = "{} {} HTTP/1.1\r\n{}".format(method, path or "/", self._headers).encode("latin-1")
+            self._heads[method, path] = head
+
+        if length is None:
+            return head + b"\r\n"
+        return head + b"Content-Length: %d\r\n\r\n" % length
+
+    async def _open(self):
+        if self._unix_path is not None:
+            return await asyncio.open_unix_connection(self._unix_path)
+        return await asyncio.open_connection(self._host, self._port)
+
+    async def _connection(self):
+        while True:
+            self._connections = [conn for conn in self._connections if not conn.closed]
+
+            idle = [conn for conn in self._connections if not conn.pending]
+            if idle:
+                return idle[-1]
+
+            if len(self._connections) + len(self._opening) < self._max_connections:
+                opening = asyncio.ensure_future(self._open())
+                self._opening.add(opening)
+                try:
+                    reader, writer = await opening
+                finally:
+                    self._opening.discard(opening)
+                conn = _Connection(reader, writer)
+                self._connections.append(conn)
+                return conn
+
+            if self._connections:
+                return min(self._connections, key=lambda conn: conn.pending)
+
+            # Every connection is still being opened.
+            await asyncio.wait(self._opening)
+
+    async def fetch(self, path, body=None, timeout=TIMEOUT, consume=None):
+        """ As AiohttpTransport.fetch. """
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+
+        head = self._head(path, None if body is None else len(body))
+        try:
+            with async_timeout.timeout(timeout):
+                for _ in range(2):
+                    conn = await self._connection()
+                    try:
+                        return await conn.exchange(head, body, consume)
+                    except StaleConnection:
+                        # The others have been idle at least as long.
+                        for idle in self._connections:
+                            if not idle.pending:
+                                idle.close()
+                        continue
+
+                raise RPCConnectionError
+        except asyncio.TimeoutError:
+            raise RPCTimeoutError
+        except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            raise RPCConnectionError
+
+
+def make_transport(name, url, auth, unix_path=None):
+    if name == "builtin" or unix_path is not None:
+        return StreamTransport(url, auth, unix_path)
+    return AiohttpTransport(url, auth)
@@ -1,3 +1,6 @@
+from decimal import Decimal
+
+
 def isoformatseconds(dt):
     try:
         return dt.isoformat(timespec="seconds")
@@ -5,3 +8,13 @@ def isoformatseconds(dt):
         # Python 3.5 and below
         # 'timespec' is an invalid keyword argument for this function
         return dt.isoformat().split(".")[0]
+
+
+def block_subsidy(height):
+    """ Block subsidy in BTC at a given height (mainnet schedule). """
+    # TODO: if chain is regtest, this is different
+    halvings = height // 210000
+    if halvings >= 64:
+        return Decimal(0)
+
+    return Decimal(5000000000 >> halvings) / 100000000
@@ -0,0 +1,539 @@
+# Copyright (c) 2014-2017 esotericnonsense (Daniel Edgecumbe)
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or https://opensource.org/licenses/mit-license.php
+
+import array
+import heapq
+
+from rpc import RPCError
+
+# (upper bound in satoshis, label); None is unbounded.
+VALUE_BANDS = [
+    (1000, "< 1k sat"),
+    (10000, "< 10k sat"),
+    (100000, "< 100k sat"),
+    (1000000, "< 0.01 BTC"),
+    (10000000, "< 0.1 BTC"),
+    (100000000, "< 1 BTC"),
+    (None, ">= 1 BTC"),
+]
+
+# (upper bound in confirmations, label); None is unbounded.
+AGE_BANDS = [
+    (1, "unconfirmed"),
+    (144, "< 1 day"),
+    (1008, "< 1 week"),
+    (4320, "< 1 month"),
+    (52560, "< 1 year"),
+    (None, "older"),
+]
+
+FEE_TARGET = 6  # estimatesmartfee confirmation target, in blocks
+DEFAULT_FEERATE = 1.0  # sat/vB, if the node has no estimate
+
+# Rough transaction sizes in vbytes.
+TX_OVERHEAD_VSIZE = 11
+OUTPUT_VSIZE = 31  # P2WPKH
+CHANGE_SPEND_VSIZE = 68
+
+BNB_TRIES = 100000
+TOP_ADDRESSES = 5
+
+GETTRANSACTION_BATCH = 50
+
+
+def input_vsize(address):
+    """ Guess the vsize of an input spending to an address. """
+    if address.startswith(("bc1p", "tb1p", "bcrt1p")):
+        return 58
+    if address.startswith(("bc1q", "tb1q", "bcrt1q")):
+        # P2WSH is longer than P2WPKH; assume 2-of-3 multisig.
+        return 68 if len(address) < 50 else 105
+    if address.startswith(("3", "2")):
+        # Assume P2SH-P2WPKH.
+        return 91
+
+    return 148
+
+
+def outpoint_key(txid, vout):
+    return bytes.fromhex(txid) + vout.to_bytes(4, "little")
+
+
+def select_bnb(values, target, cost_of_change, max_tries=BNB_TRIES):
+    """
+    Branch and bound search for a changeless selection, as in Bitcoin Core.
+
+    values are effective values sorted in descending order. Returns the
+    selected indices with the least excess in [target, target +
+    cost_of_change], or None.
+    """
+    available = sum(values)
+    if available < target:
+        return None
+
+    value = 0
+    selection = []
+    best, best_excess = None, None
+
+    index = 0
+    for _ in range(max_tries):
+        backtrack = False
+        if value + available < target or value > target + cost_of_change:
+            backtrack = True
+        elif value >= target:
+            excess = value - target
+            if best_excess is None or excess <= best_excess:
+                best, best_excess = list(selection), excess
+                if excess == 0:
+                    break
+            backtrack = True
+
+        if backtrack:
+            if not selection:
+                break
+
+            # Put the omitted values back, then try omitting the last
+            # included one.
+            index -= 1
+            while index > selection[-1]:
+                available += values[index]
+                index -= 1
+
+            value -= values[index]
+            selection.pop()
+        else:
+            available -= values[index]
+            if (not selection or index - 1 == selection[-1] or
+                    values[index] != values[index - 1]):
+                # Omitting an equal value we just omitted can't help.
+                selection.append(index)
+                value += values[index]
+
+        index += 1
+
+    return best
+
+
+def select_largest_first(values, target):
+    """ Indices of the largest values until target is reached, or None. """
+    total = 0
+    for i, value in enumerate(values):
+        total += value
+        if total >= target:
+            return list(range(i + 1))
+
+    return None
+
+
+class UTXOSet(object):
+    """
+    Unspent outputs held in parallel arrays, with an outpoint -> slot map.
+
+    Removal moves the last slot into the hole, so the arrays stay dense.
+    Totals per address and value band are kept up to date as outputs come
+    and go; the rest is computed on demand.
+    """
+    def __init__(self):
+        self._slots = {}  # outpoint key -> slot
+        self._txids = bytearray()  # 32 bytes per slot
+        self._vouts = array.array("L")
+        self._values = array.array("q")  # satoshis
+        self._heights = array.array("l")  # -1 if unconfirmed
+        self._addresses = array.array("L")
+
+        self._address_list = []  # interned addresses
+        self._address_index = {}
+        self._vsizes = array.array("H")  # address id -> input vsize
+
+        self._address_totals = {}  # address id -> [count, value]
+        self._band_totals = [[0, 0] for _ in VALUE_BANDS]
+
+        self.changes = 0  # bumped on every change, for caching
+
+    def __len__(self):
+        return len(self._values)
+
+    def _intern(self, address):
+        try:
+            return self._address_index[address]
+        except KeyError:
+            self._address_index[address] = len(self._address_list)
+            self._address_list.append(address)
+            self._vsizes.append(input_vsize(address))
+            return self._address_index[address]
+
+    @staticmethod
+    def _band(value):
+        for i, (bound, _) in enumerate(VALUE_BANDS):
+            if bound is None or value < bound:
+                return i
+
+    def _account(self, slot, sign):
+        value, address = self._values[slot], self._addresses[slot]
+
+        totals = self._address_totals.setdefault(address, [0, 0])
+        totals[0] += sign
+        totals[1] += sign * value
+        if not totals[0]:
+            del self._address_totals[address]
+
+        band = self._band_totals[self._band(value)]
+        band[0] += sign
+        band[1] += sign * value
+
+    def add(self, txid, vout, value, height, address):
+        key = outpoint_key(txid, vout)
+        if key in self._slots:
+            self.set_height(txid, vout, height)
+            return
+
+        slot = len(self._values)
+        self._slots[key] = slot
+        self._txids += key[:32]
+        self._vouts.append(vout)
+        self._values.append(value)
+        self._heights.append(height)
+        self._addresses.append(self._intern(address))
+
+        self._account(slot, 1)
+        self.changes += 1
+
+    def remove(self, txid, vout):
+        try:
+            slot = self._slots.pop(outpoint_key(txid, vout))
+        except KeyError:
+            return
+
+        self._account(slot, -1)
+
+        last = len(self._values) - 1
+        if slot != last:
+            key = bytes(self._txids[32*last:32*last+32]) + self._vouts[last].to_bytes(4, "little")
+            self._slots[key] = slot
+            self._txids[32*slot:32*slot+32] = self._txids[32*last:32*last+32]
+            self._vouts[slot] = self._vouts[last]
+            self._values[slot] = self._values[last]
+            self._heights[slot] = self._heights[last]
+            self._addresses[slot] = self._addresses[last]
+
+        del self._txids[32*last:]
+        self._vouts.pop()
+        self._values.pop()
+        self._heights.pop()
+        self._addresses.pop()
+
+        self.changes += 1
+
+    def set_height(self, txid, vout, height):
+        slot = self._slots.get(outpoint_key(txid, vout))
+        if slot is not None and self._heights[slot] != height:
+            self._heights[slot] = height
+            self.changes += 1
+
+    def value_bands(self):
+        """ [(label, count, value)] """
+        return [
+            (label, count, value)
+            for (_, label), (count, value) in zip(VALUE_BANDS, self._band_totals)
+        ]
+
+    def age_bands(self, tipheight):
+        """ [(label, count, value)] by confirmations at tipheight. """
+        totals = [[0, 0] for _ in AGE_BANDS]
+        for height, value in zip(self._heights, self._values):
+            confirmations = tipheight - height + 1 if height >= 0 else 0
+            for i, (bound, _) in enumerate(AGE_BANDS):
+                if bound is None or confirmations < bound:
+                    totals[i][0] += 1
+                    totals[i][1] += value
+                    break
+
+        return [
+            (label, count, value)
+            for (_, label), (count, value) in zip(AGE_BANDS, totals)
+        ]
+
+    def top_addresses(self, n):
+        """ [(address, count, value)] for the n largest addresses by value. """
+        top = heapq.nlargest(n, self._address_totals.items(), key=lambda item: item[1][1])
+        return [
+            (self._address_list[address], count, value)
+            for address, (count, value) in top
+        ]
+
+    def spend_costs(self, feerate):
+        """
+        (dust count, dust value, total input vsize) at feerate sat/vB.
+
+        Dust here is anything worth less than the fee to spend it.
+        """
+        vsizes = self._vsizes
+        dust_count, dust_value, total_vsize = 0, 0, 0
+        for value, address in zip(self._values, self._addresses):
+            vsize = vsizes[address]
+            total_vsize += vsize
+            if value <= vsize * feerate:
+                dust_count += 1
+                dust_value += value
+
+        return dust_count, dust_value, total_vsize
+
+    def effective_values(self, feerate):
+        """ Positive (effective value, slot) pairs, largest first. """
+        vsizes = self._vsizes
+        pairs = []
+        for slot, (value, address) in enumerate(zip(self._values, self._addresses)):
+            effective = value - int(vsizes[address] * feerate + 0.5)
+            if effective > 0:
+                pairs.append((effective, slot))
+
+        pairs.sort(reverse=True)
+        return pairs
+
+    def get_value(self, slot):
+        return self._values[slot]
+
+
+class UTXOStore(object):
+    """
+    A wallet's UTXO set: fetched once with listunspent, then kept up to
+    date from the wallet's listsinceblock deltas. Spent outputs are found
+    with gettransaction on the new transactions; a re-org (anything in
+    "removed") falls back to a full refetch.
+    """
+    def __init__(self, client, name=None):
+        self._client = client
+        self._name = name
+
+        self._utxos = None
+        self._loading = False
+        self._deferred = []  # deltas that arrived during a load
+        self._applied = set()  # txids whose spends and outputs are applied
+
+        self._tipheight = None
+        self._lastblock = None
+        self._feerate = DEFAULT_FEERATE  # sat/vB
+
+        self._summary = None
+        self._summary_key = None
+
+    def is_loaded(self):
+        return self._utxos is not None
+
+    def is_loading(self):
+        return self._loading
+
+    async def _request_chaininfo(self, calls):
+        """ Batch calls with getblockcount and estimatesmartfee. """
+        calls = [
+            ("getblockcount", None),
+            ("estimatesmartfee", [FEE_TARGET]),
+        ] + calls
+
+        responses = await self._client.request_batch(calls, wallet=self._name)
+
+        if responses[0]["result"] is not None:
+            self._tipheight = responses[0]["result"]
+
+        estimate = responses[1]["result"]
+        if estimate is not None and "feerate" in estimate:
+            # BTC/kvB -> sat/vB
+            self._feerate = estimate["feerate"] * 100000
+
+        return responses[2:]
+
+    async def load(self):
+        if self._loading:
+            return
+
+        self._loading = True
+        try:
+            responses = await self._request_chaininfo([("listunspent", [0])])
+            unspent = responses[0]["result"]
+            if unspent is None or self._tipheight is None:
+                return
+
+            utxos = UTXOSet()
+            for u in unspent:
+                height = self._tipheight - u["confirmations"] + 1 if u["confirmations"] > 0 else -1
+                utxos.add(u["txid"], u["vout"], int(round(u["amount"] * 100000000)),
+                    height, u.get("address", ""))
+
+            self._utxos = utxos
+            self._applied = set()
+        except RPCError:
+            return
+        finally:
+            self._loading = False
+
+        deferred, self._deferred = self._deferred, []
+        for sinceblock in deferred:
+            await self.on_sinceblock(sinceblock)
+
+    async def _apply(self, txids):
+        """ Add the wallet outputs and remove the spends of new transactions. """
+        spends = []
+        change = []  # (txid, vout, value, height, address) awaiting ismine
+        for i in range(0, len(txids), GETTRANSACTION_BATCH):
+            calls = [
+                ("gettransaction", [txid, True, True])
+                for txid in txids[i:i+GETTRANSACTION_BATCH]
+            ]
+            for d in await self._client.request_batch(calls, wallet=self._name):
+                tx = d["result"]
+                if tx is None:
+                    continue
+
+                height = tx.get("blockheight", -1) if tx["confirmations"] > 0 else -1
+                received = set()
+                for detail in tx["details"]:
+                    if detail["category"] in ("receive", "generate", "immature"):
+                        self._utxos.add(tx["txid"], detail["vout"],
+                            int(round(detail["amount"] * 100000000)), height,
+                            detail.get("address", ""))
+                        received.add(detail["vout"])
+
+                if "fee" in tx:
+                    # The wallet sent this; details leave out its change.
+                    for out in tx["decoded"]["vout"]:
+                        if out["n"] in received:
+                            continue
+                        spk = out["scriptPubKey"]
+                        address = spk.get("address") or (spk.get("addresses") or [None])[0]
+                        if address is not None:
+                            change.append((tx["txid"], out["n"],
+                                int(round(out["value"] * 100000000)), height, address))
+
+                spends.extend(
+                    (vin["txid"], vin["vout"]) for vin in tx["decoded"]["vin"]
+                    if "txid" in vin
+                )
+                self._applied.add(tx["txid"])
+
+        await self._apply_change(change)
+
+        # After the additions, in case a transaction spends another in the
+        # same batch.
+        for txid, vout in spends:
+            self._utxos.remove(txid, vout)
+
+    async def _apply_change(self, outputs):
+        """ Add the outputs of sent transactions that pay back to the wallet. """
+        addresses = sorted(set(output[4] for output in outputs))
+        mine = set()
+        for i in range(0, len(addresses), GETTRANSACTION_BATCH):
+            batch = addresses[i:i+GETTRANSACTION_BATCH]
+            calls = [("getaddressinfo", [address]) for address in batch]
+            responses = await self._client.request_batch(calls, wallet=self._name)
+            for address, d in zip(batch, responses):
+                if d["result"] is not None and d["result"].get("ismine"):
+                    mine.add(address)
+
+        for txid, vout, value, height, address in outputs:
+            if address in mine:
+                self._utxos.add(txid, vout, value, height, address)
+
+    async def on_sinceblock(self, sinceblock):
+        """ Apply a listsinceblock result. Returns True if anything changed. """
+        if self._loading:
+            self._deferred.append(sinceblock)
+            return False
+
+        if self._utxos is None:
+            return False
+
+        if sinceblock.get("removed"):
+            await self.load()
+            return True
+
+        changes = self._utxos.changes
+        newtip = sinceblock["lastblock"] != self._lastblock
+        self._lastblock = sinceblock["lastblock"]
+
+        txids = []
+        for tx in sinceblock["transactions"]:
+            if tx["txid"] in self._applied:
+                if "blockheight" in tx and "vout" in tx:
+                    self._utxos.set_height(tx["txid"], tx["vout"], tx["blockheight"])
+            elif tx["txid"] not in txids:
+                txids.append(tx["txid"])
+
+        try:
+            if newtip or txids:
+                await self._request_chaininfo([])
+            if txids:
+                await self._apply(txids)
+        except RPCError:
+            return False
+
+        return newtip or self._utxos.changes != changes
+
+    def get_summary(self):
+        """ Aggregates for display; cached until the set, tip or fee changes. """
+        key = (self._utxos.changes, self._tipheight, self._feerate)
+        if key == self._summary_key:
+            return self._summary
+
+        utxos = self._utxos
+        dust_count, dust_value, total_vsize = utxos.spend_costs(self._feerate)
+        spend_vsize = total_vsize + TX_OVERHEAD_VSIZE + OUTPUT_VSIZE
+
+        self._summary = {
+            "count": len(utxos),
+            "value": sum(value for _, _, value in utxos.value_bands()),
+            "feerate": self._feerate,
+            "value_bands": utxos.value_bands(),
+            "age_bands": utxos.age_bands(self._tipheight),
+            "top_addresses": utxos.top_addresses(TOP_ADDRESSES),
+            "dust_count": dust_count,
+            "dust_value": dust_value,
+            "spend_vsize": spend_vsize,
+            "spend_fee": int(spend_vsize * self._feerate + 0.5),
+        }
+        self._summary_key = key
+
+        return self._summary
+
+    def simulate(self, target):
+        """
+        Select coins to pay target satoshis to one P2WPKH output at the
+        current fee estimate. Tries branch and bound for a changeless
+        selection, then falls back to largest first with change.
+        """
+        feerate = self._feerate
+        pairs = self._utxos.effective_values(feerate)
+        values = [effective for effective, _ in pairs]
+
+        # The fee for everything but the inputs, which effective values cover.
+        base_fee = int((TX_OVERHEAD_VSIZE + OUTPUT_VSIZE) * feerate + 0.5)
+        change_fee = int(OUTPUT_VSIZE * feerate + 0.5)
+        cost_of_change = change_fee + int(CHANGE_SPEND_VSIZE * feerate + 0.5)
+
+        algorithm = "bnb"
+        selection = select_bnb(values, target + base_fee, cost_of_change)
+        if selection is None:
+            algorithm = "largest first"
+            selection = select_largest_first(values, target + base_fee + change_fee)
+            if selection is None:
+                return None
+
+        selected = sum(self._utxos.get_value(pairs[i][1]) for i in selection)
+        effective = sum(values[i] for i in selection)
+        fee = (selected - effective) + base_fee
+
+        if algorithm == "bnb":
+            # Any excess goes to the fee.
+            fee += effective - target - base_fee
+            change = 0
+        else:
+            fee += change_fee
+            change = selected - target - fee
+
+        return {
+            "algorithm": algorithm,
+            "inputs": len(selection),
+            "selected": selected,
+            "fee": fee,
+            "change": change,
+        }
@@ -6,191 +6,943 @@ import datetime
 import curses
 import asyncio
 
+import array
+
 import view
+import utxo
+from rpc import RPCError
 from util import isoformatseconds
 
-class WalletView(view.View):
-    _mode_name = "wallet"
+PAGE_SIZE = 500  # listtransactions entries per request
+PREFETCH = 1000  # entries loaded beyond the visible window
+WALK_OVERLAP = 8  # re-request a few known entries to detect shifted pages
 
-    def __init__(self, txidsetter, modesetter):
-        self._txidsetter = txidsetter
-        self._modesetter = modesetter
+# Coinbase entries move from immature to generate (or orphan) as they mature.
+COINBASE_CATEGORIES = {"generate", "immature", "orphan"}
+
+UNCONFIRMED = -1
+HEIGHT_UNKNOWN = -2  # confirmed, but the node doesn't report blockheight
 
-        self._wallet = None
-        self._tx_offset = None  # (index, hash of wallet)
-        self._selected_tx = None  # (index, hash of wallet)
+FILTER_FIELDS = ["txid", "addr", "label", "amount"]
 
-        super().__init__()
+# getwalletinfo fields whose change means there are new transactions.
+WALLETINFO_FIELDS = ["txcount", "balance", "unconfirmed_balance", "immature_balance"]
+CHECK_INTERVAL = 15.0  # seconds between getwalletinfo checks without a signal
+HEARTBEAT = 60.0  # seconds between full polls without a new tip
+MAX_STRING = "\U0010ffff"
+
+
+def entry_key(tx):
+    """ Compact key identifying a wallet entry: txid, kind, vout. """
+    kind = 1 if tx["category"] in COINBASE_CATEGORIES else 0
+    if tx["category"] == "send":
+        kind = 2
+
+    return bytes.fromhex(tx["txid"]) + bytes([kind]) + tx.get("vout", 0).to_bytes(4, "little")
+
+
+def to_satoshis(amount):
+    return int(round(amount * 100000000))
+
+
+def parse_amount_range(text):
+    """ "0.1..2", "..2", "1.5" -> (lo, hi) in satoshis, hi exclusive. """
+    if ".." in text:
+        lo, hi = text.split("..", 1)
+    else:
+        lo, hi = text, text
 
-    async def _draw_wallet(self, wallet):
-        CGREEN = curses.color_pair(1)
-        CRED = curses.color_pair(3)
-        CYELLOW = curses.color_pair(5)
-        CBOLD = curses.A_BOLD
-        CREVERSE = curses.A_REVERSE
+    lo = to_satoshis(float(lo)) if lo else None
+    hi = to_satoshis(float(hi)) + 1 if hi else None
 
-        if "transactions" in wallet:
-            offset = self._tx_offset[0]
+    return lo, hi
 
-            self._pad.addstr(0, 1, "Transactions: {}".format(
-                len(wallet["transactions"])), CBOLD)
-            self._pad.addstr(0, 68, "[UP/DOWN: browse, ENTER: select]", CYELLOW)
 
-            if offset > 0:
-                self._pad.addstr(1, 25, "... ^ ...", CBOLD)
+def parse_filter(text):
+    """
+    Split filter text into terms.
+
+    Each term is a list of (field, lo, hi) alternatives; "field:value" picks
+    a field, a bare word matches a txid, address or label prefix.
+    """
+    terms = []
+    for word in text.split():
+        field, sep, value = word.partition(":")
+        if not sep or field not in FILTER_FIELDS:
+            field, value = None, word
+
+        if field == "amount":
+            try:
+                lo, hi = parse_amount_range(value)
+            except ValueError:
+                continue
+            terms.append([("amount", lo, hi)])
+            continue
+
+        if not value:
+            continue
+
+        if field == "txid":
+            value = value.lower()
+        hi = value + MAX_STRING
+        if field is not None:
+            terms.append([(field, value, hi)])
+        else:
+            terms.append([
+                ("txid", value.lower(), value.lower() + MAX_STRING),
+                ("addr", value, hi),
+                ("label", value, hi),
+            ])
+
+    return terms
+
+
+class SortedIds(object):
+    """
+    Entry ids ordered by a key function, for prefix and range queries.
+
+    Ids arrive unsorted. A large backlog is sorted in one go on the next
+    query; a small one is inserted by bisection.
+    """
+    def __init__(self, keyfunc):
+        self._keyfunc = keyfunc
+        self._ids = array.array("L")
+        self._unsorted = []
+
+    def add(self, ident):
+        self._unsorted.append(ident)
+
+    def _bisect(self, value):
+        """ The first position whose key is >= value. """
+        keyfunc = self._keyfunc
+        lo, hi = 0, len(self._ids)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if keyfunc(self._ids[mid]) < value:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        return lo
+
+    def _sort(self):
+        if len(self._unsorted) > 64:
+            self._ids.extend(self._unsorted)
+            self._ids = array.array("L", sorted(self._ids, key=self._keyfunc))
+        else:
+            for ident in self._unsorted:
+                self._ids.insert(self._bisect(self._keyfunc(ident)), ident)
+
+        self._unsorted = []
+
+    def key(self, ident):
+        """ The key ident sorts by. """
+        return self._keyfunc(ident)
+
+    def range(self, lo, hi):
+        """ Ids with lo <= key < hi; None is unbounded. """
+        if self._unsorted:
+            self._sort()
+
+        start = 0 if lo is None else self._bisect(lo)
+        end = len(self._ids) if hi is None else self._bisect(hi)
+
+        return self._ids[start:end]
+
+
+class WalletStore(object):
+    """
+    Wallet history, loaded a page at a time with listtransactions.
+
+    Entries are numbered in the order they are first seen and held in
+    compact parallel arrays; the raw RPC dicts are discarded. Only the
+    visible window plus PREFETCH entries are loaded while browsing; the
+    rest of the history is walked when a filter needs it. Entries that
+    arrive afterwards come from listsinceblock and are shown first.
+    """
+    def __init__(self, client, name=None):
+        self._client = client
+        self._name = name  # None for the node's default wallet endpoint
+        self._walletinfo = None
+        self._utxos = utxo.UTXOStore(client, name)
+        self._filter = ""
+        self._window_rows = 0
+        self._reset()
+
+    def _reset(self):
+        self._lastblock = None  # listsinceblock anchor; set by the walk
+        self._complete = False  # walked the whole history?
+        self._wanted = PREFETCH if not self._filter else float("inf")  # in rows
+
+        self._ids = {}  # entry key -> id
+        self._txids = bytearray()  # 32 bytes per id
+        self._vouts = array.array("L")
+        self._amounts = array.array("q")  # satoshis
+        self._times = array.array("L")
+        self._heights = array.array("l")
+        self._categories = array.array("L")
+        self._addresses = array.array("L")
+        self._labels = array.array("L")
+
+        self._strings = [""]  # interned addresses, labels and categories
+        self._string_index = {"": 0}
+
+        self._walked = array.array("L")  # ids in history order, newest first
+        self._heads = array.array("L")  # ids seen after the walk began, oldest first
+
+        self._indexes = {
+            "txid": SortedIds(self._get_txid),
+            "addr": SortedIds(lambda i: self._strings[self._addresses[i]]),
+            "label": SortedIds(lambda i: self._strings[self._labels[i]]),
+            "amount": SortedIds(lambda i: abs(self._amounts[i])),
+        }
+
+        self._terms = parse_filter(self._filter)
+        self._filter_walked = []  # matching ids, in history order
+        self._filter_heads = []
+
+    def _intern(self, s):
+        try:
+            return self._string_index[s]
+        except KeyError:
+            self._string_index[s] = len(self._strings)
+            self._strings.append(s)
+            return self._string_index[s]
+
+    def _get_txid(self, ident):
+        return self._txids[32*ident:32*ident+32].hex()
+
+    @staticmethod
+    def _height(tx):
+        if "blockhash" not in tx:
+            return UNCONFIRMED
+
+        return tx.get("blockheight", HEIGHT_UNKNOWN)
+
+    def _add(self, key, tx):
+        ident = len(self._vouts)
+        self._ids[key] = ident
+
+        self._txids += bytes.fromhex(tx["txid"])
+        self._vouts.append(tx.get("vout", 0))
+        self._amounts.append(to_satoshis(tx["amount"]))
+        self._times.append(tx["timereceived"])
+        self._heights.append(self._height(tx))
+        self._categories.append(self._intern(tx["category"]))
+        self._addresses.append(self._intern(tx.get("address", "")))
+        self._labels.append(self._intern(tx.get("label", "")))
+
+        for index in self._indexes.values():
+            index.add(ident)
+
+        return ident
+
+    def _update(self, ident, tx):
+        """ Confirmation changes; returns True if anything changed. """
+        height = self._height(tx)
+        category = self._intern(tx["category"])
+        if (self._heights[ident], self._categories[ident]) == (height, category):
+            return False
+
+        self._heights[ident] = height
+        self._categories[ident] = category
+        return True
+
+    def _matches(self, ident):
+        for alternatives in self._terms:
+            for field, lo, hi in alternatives:
+                key = self._indexes[field].key(ident)
+                if (lo is None or key >= lo) and (hi is None or key < hi):
+                    break
+            else:
+                return False
 
-            if offset < len(wallet["transactions"]) - 11:
-                self._pad.addstr(19, 25, "... v ...", CBOLD)
+        return True
 
-            for i, tx in enumerate(wallet["transactions"]):
-                if i < offset:
-                    continue
-                if i > offset+5:
-                    break
+    async def _anchor(self):
+        """ Start following listsinceblock from the current tip. """
+        if self._lastblock is None:
+            j = await self._client.request("getbestblockhash")
+            self._lastblock = j["result"]
 
-                color = CGREEN if tx["amount"] >= 0 else CRED
-                # if i == self._selected_tx[0] and self._hash == self._selected_tx[1]:
-                if i == self._selected_tx[0]:
-                    color += CBOLD + CREVERSE
-                    # hackerino
-                    self._pad.addstr(2+((i-offset)*3), 1, " " * 98, color)
-                    self._pad.addstr(2+((i-offset)*3)+1, 1, " " * 98, color)
-
-                self._pad.addstr(2+((i-offset)*3), 1, "{}".format(
-                    isoformatseconds(datetime.datetime.utcfromtimestamp(tx["timereceived"]))
-                ), color)
-                self._pad.addstr(2+((i-offset)*3), 30, "block: {: 7d}".format(tx["blockindex"]), color)
-                self._pad.addstr(2+((i-offset)*3), 81, "{: 15.8f} BTC".format(
-                    tx["amount"],
-                ), color)
-                self._pad.addstr(2+((i-offset)*3)+1, 1, "{}".format(tx["address"]), color)
-                self._pad.addstr(2+((i-offset)*3)+1, 36, "{}".format(tx["txid"]), color)
+    async def walk(self):
+        """
+        Load the next page of history if it is wanted.
 
-    async def _draw(self):
-        self._clear_init_pad()
+        Returns True if there is more to do.
+        """
+        if self._complete or len(self._walked) >= self._wanted:
+            return False
 
-        if self._wallet:
-            await self._draw_wallet(self._wallet)
+        try:
+            await self._anchor()
+
+            # New entries push the older ones down; overlap the previous
+            # page a little and skip whatever we already have.
+            skip = max(len(self._walked) + len(self._heads) - WALK_OVERLAP, 0)
+            j = await self._client.request("listtransactions", ["*", PAGE_SIZE, skip, True],
+                wallet=self._name)
+        except RPCError:
+            # probably a disabled wallet.
+            self._complete = True
+            return False
+
+        page = j["result"]
+        if len(page) < PAGE_SIZE:
+            self._complete = True
+
+        fresh = 0
+        for tx in reversed(page):
+            key = entry_key(tx)
+            if key in self._ids:
+                continue
+
+            ident = self._add(key, tx)
+            self._walked.append(ident)
+            fresh += 1
+            if self._terms and self._matches(ident):
+                self._filter_walked.append(ident)
+
+        if not fresh and not self._complete and skip:
+            # The page is entirely known; the node's history changed under
+            # us (e.g. a rescan). Start again.
+            self._reset()
+            return True
+
+        return not self._complete and len(self._walked) < self._wanted
+
+    @staticmethod
+    def _balance_key(walletinfo):
+        return tuple(walletinfo.get(field) for field in WALLETINFO_FIELDS)
+
+    async def poll(self, full):
+        """
+        Refresh getwalletinfo, and merge transactions since the last poll
+        if this is a full poll or the wallet's txcount or balances moved.
+        Returns True if anything changed.
+        """
+        calls = [("getwalletinfo", None)]
+        sinceblock_call = None
+        if self._lastblock is not None:
+            # Once the history or UTXOs are wanted.
+            sinceblock_call = ("listsinceblock", [self._lastblock, 1, True, True])
+            if full:
+                calls.append(sinceblock_call)
 
-        self._draw_pad_to_screen()
+        try:
+            responses = await self._client.request_batch(calls, wallet=self._name)
+
+            changed = False
+            walletinfo = responses[0]["result"]
+            if walletinfo is not None:
+                if (self._walletinfo is None or
+                        self._balance_key(walletinfo) != self._balance_key(self._walletinfo)):
+                    changed = True
+                self._walletinfo = walletinfo
+
+            if changed and sinceblock_call is not None and not full:
+                responses += await self._client.request_batch([sinceblock_call], wallet=self._name)
+        except RPCError:
+            return False
 
-    async def on_sinceblock(self, key, obj):
-        # TODO: if no changes don't reset cursor or do anything?
+        if len(responses) > 1 and responses[1]["result"] is not None:
+            sinceblock = responses[1]["result"]
+            changed |= self._merge_sinceblock(sinceblock)
+            changed |= await self._utxos.on_sinceblock(sinceblock)
+
+        return changed
+
+    async def load_utxos(self):
         try:
-            wallet = obj["result"]
-        except KeyError:
+            await self._anchor()
+        except RPCError:
             return
 
-        if wallet is None:
-            # probably a disabled wallet.
+        await self._utxos.load()
+
+    def get_utxos(self):
+        return self._utxos
+
+    def _merge_sinceblock(self, sinceblock):
+        changed = False
+
+        # Transactions disconnected by a re-org go back to unconfirmed.
+        for tx in sinceblock.get("removed", []):
+            ident = self._ids.get(entry_key(tx))
+            if ident is not None and self._heights[ident] != UNCONFIRMED:
+                self._heights[ident] = UNCONFIRMED
+                changed = True
+
+        for tx in sinceblock["transactions"]:
+            key = entry_key(tx)
+            try:
+                ident = self._ids[key]
+            except KeyError:
+                ident = self._add(key, tx)
+                self._heads.append(ident)
+                if self._terms and self._matches(ident):
+                    self._filter_heads.append(ident)
+                changed = True
+                continue
+
+            changed |= self._update(ident, tx)
+
+        self._lastblock = sinceblock["lastblock"]
+
+        return changed
+
+    def get_walletinfo(self):
+        return self._walletinfo
+
+    def set_window(self, first, last):
+        """ Rows [first, last) are on screen. """
+        self._window_rows = last - first
+        if not self._filter:
+            self._wanted = max(self._wanted, last - len(self._heads) + PREFETCH)
+
+    def set_filter(self, text):
+        if text == self._filter:
             return
 
-        if self._wallet is not None:
-            if wallet["lastblock"] == self._wallet["lastblock"]:
-                # No change.
+        self._filter = text
+        self._terms = parse_filter(text)
+        self._filter_walked, self._filter_heads = [], []
+        if not self._terms:
+            # Back to the top of the unfiltered list; fetch only what shows.
+            self._wanted = max(PREFETCH, self._window_rows - len(self._heads) + PREFETCH)
+            return
+
+        # Filtering needs everything.
+        self._wanted = float("inf")
+
+        matches = None
+        for alternatives in self._terms:
+            ids = set()
+            for field, lo, hi in alternatives:
+                ids.update(self._indexes[field].range(lo, hi))
+            matches = ids if matches is None else matches & ids
+            if not matches:
                 return
 
-        def sort_wallet_tx(tx):
-            return (tx["timereceived"], tx["amount"])
+        # Ids are handed out in the order entries are seen, so they sort
+        # into history order; heads are few.
+        heads = set(self._heads)
+        for ident in sorted(matches):
+            if ident in heads:
+                self._filter_heads.append(ident)
+            else:
+                self._filter_walked.append(ident)
+
+    def get_filter(self):
+        return self._filter
+
+    def is_complete(self):
+        return self._complete
+
+    def get_total(self):
+        return len(self._vouts)
+
+    def __len__(self):
+        if self._terms:
+            return len(self._filter_heads) + len(self._filter_walked)
+        if not self._filter:
+            return len(self._heads) + len(self._walked)
+        return 0
+
+    def get_transaction(self, row):
+        """ A listtransactions-like dict for a display row. """
+        heads, walked = self._heads, self._walked
+        if self._filter:
+            heads, walked = self._filter_heads, self._filter_walked
+
+        if row < len(heads):
+            ident = heads[len(heads) - 1 - row]
+        else:
+            ident = walked[row - len(heads)]
+
+        tx = {
+            "txid": self._get_txid(ident),
+            "vout": self._vouts[ident],
+            "amount": self._amounts[ident] / 100000000,
+            "timereceived": self._times[ident],
+            "category": self._strings[self._categories[ident]],
+            "address": self._strings[self._addresses[ident]],
+            "label": self._strings[self._labels[ident]],
+        }
+        if self._heights[ident] >= 0:
+            tx["blockheight"] = self._heights[ident]
+        elif self._heights[ident] == HEIGHT_UNKNOWN:
+            tx["blockheight"] = None
+
+        return tx
+
+
+class WalletSet(object):
+    """
+    A WalletStore for each loaded wallet, polled together.
+
+    Polls are driven by signals rather than a fast timer: a new tip causes
+    a full poll (listwallets, getwalletinfo and listsinceblock); a mempool
+    change, seen at most once per getmempoolinfo poll, only checks
+    getwalletinfo, and each wallet fetches its deltas if its txcount or
+    balances moved. Without a signal the same check runs every
+    CHECK_INTERVAL seconds, and a full poll every HEARTBEAT seconds.
+    """
+    def __init__(self, client):
+        self._client = client
+
+        self._names = []  # as listwallets orders them
+        self._stores = {}  # name -> WalletStore
+
+        self._event = asyncio.Event()
+        self._full = True  # the next poll is a full one
+        self._last_full = None  # event loop time of the last full poll
+        self._bestblockhash = None
+        self._mempool_key = None
+
+    def on_bestblockhash(self, blockhash):
+        if blockhash != self._bestblockhash:
+            self._bestblockhash = blockhash
+            self._full = True
+            self._event.set()
+
+    def on_mempoolinfo(self, mempoolinfo):
+        # Any of our transactions entering or leaving the mempool moves this.
+        key = (mempoolinfo["size"], mempoolinfo["bytes"])
+        if key != self._mempool_key:
+            self._mempool_key = key
+            self._event.set()
+
+    async def wait(self):
+        """ Wait for a signal, or until a check or the heartbeat is due. """
+        try:
+            await asyncio.wait_for(self._event.wait(), CHECK_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+        self._event.clear()
+        if asyncio.get_event_loop().time() - self._last_full >= HEARTBEAT:
+            self._full = True
+
+    async def poll(self):
+        """ Poll every wallet. Returns True if anything changed. """
+        full, self._full = self._full, False
+
+        names = self._names
+        if full:
+            self._last_full = asyncio.get_event_loop().time()
+            try:
+                j = await self._client.request("listwallets")
+                names = j["result"]
+            except RPCError:
+                # Built without a wallet, or it is disabled.
+                names = []
+
+        changed = names != self._names
+        self._stores = {
+            name: self._stores[name] if name in self._stores
+                else WalletStore(self._client, name)
+            for name in names
+        }
+        self._names = names
+
+        results = await asyncio.gather(*[
+            self._stores[name].poll(full) for name in names
+        ])
+
+        return changed or any(results)
+
+    def get_names(self):
+        return self._names
+
+    def get_store(self, name):
+        return self._stores.get(name)
+
+    def get_walletinfos(self):
+        return [
+            self._stores[name].get_walletinfo() for name in self._names
+            if self._stores[name].get_walletinfo() is not None
+        ]
 
-        # Sort it.
-        wallet["transactions"] = sorted(wallet["transactions"], key=sort_wallet_tx, reverse=True)
 
-        self._wallet = wallet
+class WalletView(view.View):
+    _mode_name = "wallet"
 
-        # TODO: scan the old and new wallets, select the same tx, update offset.
+    def __init__(self, walletset, txidsetter, modesetter):
+        self._walletset = walletset
+        self._wallet = None  # name of the wallet on screen
+        self._txidsetter = txidsetter
+        self._modesetter = modesetter
 
-        if self._selected_tx is None:
-            self._selected_tx = (0, None)
+        self._selected = 0  # display row
+        self._offset = 0  # first display row on screen
 
-        if self._tx_offset is None:
-            self._tx_offset = (0, None)
+        self._edit_mode = False  # typing a filter?
+        self._edit_buffer = ""
 
-        await self._draw_if_visible()
+        self._walk_task = None
+        self._walk_pending = False
 
-    async def _select_previous_transaction(self):
-        """
-        if self._hash is None:
-            return # Can't do anything
+        self._utxo_mode = False  # showing UTXOs instead of the history?
+        self._target = None  # coin selection target, satoshis
+        self._simulation = None
 
-        if self._selected_tx == None or self._selected_tx[1] != self._hash:
-            return # Can't do anything
+        super().__init__()
 
-        if self._tx_offset == None or self._tx_offset[1] != self._hash:
-            return # Can't do anything
-        """
+    def _get_store(self):
+        return self._walletset.get_store(self._wallet)
+
+    async def _draw_wallet_name(self):
+        CYELLOW = curses.color_pair(5)
+        CBOLD = curses.A_BOLD
 
-        if not self._wallet:
+        names = self._walletset.get_names()
+        self._pad.addstr(1, 1, "{}/{}: {}".format(
+            names.index(self._wallet) + 1, len(names), self._wallet or "(default)")[:22], CBOLD)
+        if len(names) > 1:
+            self._pad.addstr(1, 36, "[[/]: wallet]", CYELLOW)
+
+    async def _draw_wallet(self):
+        CGREEN = curses.color_pair(1)
+        CRED = curses.color_pair(3)
+        CYELLOW = curses.color_pair(5)
+        CBOLD = curses.A_BOLD
+        CREVERSE = curses.A_REVERSE
+
+        store = self._get_store()
+        offset = self._offset
+
+        header = "Transactions: {}".format(len(store))
+        if store.get_filter():
+            header += " of {}".format(store.get_total())
+        if not store.is_complete():
+            header += " (more to load)"
+        self._pad.addstr(0, 1, header, CBOLD)
+        self._pad.addstr(0, 54, "[UP/DOWN, ENTER: select, /: filter, u: UTXOs]", CYELLOW)
+
+        await self._draw_wallet_name()
+
+        if self._edit_mode:
+            self._pad.addstr(1, 50, "filter> {}".format(self._edit_buffer)[:48],
+                CRED + CBOLD + CREVERSE)
+        elif store.get_filter():
+            self._pad.addstr(1, 50, "filter: {}".format(store.get_filter())[:48], CRED + CBOLD)
+
+        if offset > 0:
+            self._pad.addstr(1, 25, "... ^ ...", CBOLD)
+
+        if offset < len(store) - 6:
+            self._pad.addstr(19, 25, "... v ...", CBOLD)
+
+        for i in range(offset, min(offset+6, len(store))):
+            tx = store.get_transaction(i)
+            y = 2 + (i-offset)*3
+
+            color = CGREEN if tx["amount"] >= 0 else CRED
+            if i == self._selected:
+                color += CBOLD + CREVERSE
+                # hackerino
+                self._pad.addstr(y, 1, " " * 98, color)
+                self._pad.addstr(y+1, 1, " " * 98, color)
+
+            self._pad.addstr(y, 1, "{}".format(
+                isoformatseconds(datetime.datetime.utcfromtimestamp(tx["timereceived"]))
+            ), color)
+            if "blockheight" not in tx:
+                self._pad.addstr(y, 30, "unconfirmed", color)
+            elif tx["blockheight"] is None:
+                self._pad.addstr(y, 30, "confirmed", color)
+            else:
+                self._pad.addstr(y, 30, "height: {: 7d}".format(tx["blockheight"]), color)
+            if tx["label"]:
+                self._pad.addstr(y, 50, "{}".format(tx["label"][:28]), color)
+            self._pad.addstr(y, 81, "{: 15.8f} BTC".format(
+                tx["amount"],
+            ), color)
+            self._pad.addstr(y+1, 1, "{}".format(tx["address"]), color)
+            self._pad.addstr(y+1, 36, "{}".format(tx["txid"]), color)
+
+    async def _draw_utxos(self):
+        CGREEN = curses.color_pair(1)
+        CCYAN = curses.color_pair(2)
+        CRED = curses.color_pair(3)
+        CYELLOW = curses.color_pair(5)
+        CBOLD = curses.A_BOLD
+        CREVERSE = curses.A_REVERSE
+
+        utxos = self._get_store().get_utxos()
+        self._pad.addstr(0, 69, "[u: history, /: target amount]", CYELLOW)
+
+        if self._edit_mode:
+            self._pad.addstr(1, 50, "target BTC> {}".format(self._edit_buffer)[:48],
+                CRED + CBOLD + CREVERSE)
+
+        if not utxos.is_loaded():
+            self._pad.addstr(0, 1, "Loading UTXOs...", CBOLD)
             return
 
-        if self._selected_tx[0] == 0:
-            return # At the beginning already.
+        summary = utxos.get_summary()
+        self._pad.addstr(0, 1, "UTXOs: {}, {:.8f} BTC".format(
+            summary["count"], summary["value"] / 100000000), CBOLD)
+
+        self._pad.addstr(2, 1, "Fee estimate {:.1f} sat/vB. Spending everything: {} inputs, ~{} vB, fee {:.8f} BTC".format(
+            summary["feerate"], summary["count"], summary["spend_vsize"],
+            summary["spend_fee"] / 100000000))
+        self._pad.addstr(3, 1, "Dust (worth less than the fee to spend it): {} outputs, {:.8f} BTC".format(
+            summary["dust_count"], summary["dust_value"] / 100000000),
+            CRED if summary["dust_count"] else 0)
+
+        if self._target is not None:
+            result = self._simulation
+            if result is None:
+                text = "Target {:.8f} BTC: insufficient funds".format(self._target / 100000000)
+            else:
+                text = "Target {:.8f} BTC: {}, {} inputs, fee {:.8f} BTC, {}".format(
+                    self._target / 100000000, result["algorithm"], result["inputs"],
+                    result["fee"] / 100000000,
+                    "change {:.8f} BTC".format(result["change"] / 100000000)
+                        if result["change"] else "no change")
+            self._pad.addstr(4, 1, text[:98], CCYAN + CBOLD)
+
+        self._pad.addstr(6, 1, "Value", CBOLD)
+        self._pad.addstr(6, 15, "  Count", CBOLD)
+        self._pad.addstr(6, 26, "             BTC", CBOLD)
+        for i, (label, count, value) in enumerate(summary["value_bands"]):
+            self._pad.addstr(7+i, 1, label)
+            self._pad.addstr(7+i, 15, "{: 7d}".format(count))
+            self._pad.addstr(7+i, 26, "{: 16.8f}".format(value / 100000000), CGREEN)
+
+        self._pad.addstr(6, 51, "Age", CBOLD)
+        self._pad.addstr(6, 65, "  Count", CBOLD)
+        self._pad.addstr(6, 76, "             BTC", CBOLD)
+        for i, (label, count, value) in enumerate(summary["age_bands"]):
+            self._pad.addstr(7+i, 51, label)
+            self._pad.addstr(7+i, 65, "{: 7d}".format(count))
+            self._pad.addstr(7+i, 76, "{: 16.8f}".format(value / 100000000), CGREEN)
+
+        self._pad.addstr(14, 1, "Top addresses", CBOLD)
+        self._pad.addstr(14, 65, "  Count", CBOLD)
+        self._pad.addstr(14, 76, "             BTC", CBOLD)
+        for i, (address, count, value) in enumerate(summary["top_addresses"]):
+            self._pad.addstr(15+i, 1, address[:62])
+            self._pad.addstr(15+i, 65, "{: 7d}".format(count))
+            self._pad.addstr(15+i, 76, "{: 16.8f}".format(value / 100000000), CGREEN)
 
-        if self._selected_tx[0] == self._tx_offset[0]:
-            self._tx_offset = (self._tx_offset[0] - 1, self._tx_offset[1])
+    async def _draw(self):
+        self._clear_init_pad()
 
-        self._selected_tx = (self._selected_tx[0] - 1, self._selected_tx[1])
+        store = self._get_store()
+        if store is None:
+            self._pad.addstr(0, 1, "No wallets loaded", curses.A_BOLD)
+            self._draw_pad_to_screen()
+            return
 
-        await self._draw_if_visible()
+        if self._utxo_mode:
+            await self._draw_wallet_name()
+            await self._draw_utxos()
+            self._draw_pad_to_screen()
+            return
 
-    async def _select_next_transaction(self):
-        """
-        if self._hash is None:
-            return # Can't do anything
+        # Keep the cursor in range if the filter shrank the list.
+        last = max(len(store) - 1, 0)
+        if self._selected > last:
+            self._selected = last
+        self._offset = min(self._offset, self._selected)
+        self._offset = max(self._offset, self._selected - 5)
 
-        if self._selected_tx == None or self._selected_tx[1] != self._hash:
-            return # Can't do anything
+        await self._draw_wallet()
 
-        if self._tx_offset == None or self._tx_offset[1] != self._hash:
-            return # Can't do anything
-        """
+        self._draw_pad_to_screen()
 
-        if not self._wallet:
+    async def _walk(self):
+        while self._walk_pending:
+            self._walk_pending = False
+            more = True
+            while more and self._get_store() is not None:
+                # The wallet may be switched between pages.
+                more = await self._get_store().walk()
+                await self._draw_if_visible()
+
+    def _schedule_walk(self):
+        store = self._get_store()
+        if store is None:
             return
 
-        if self._selected_tx[0] == len(self._wallet["transactions"]) - 1:
-            return # At the end already
+        # Pages are loaded in the background as the window moves.
+        store.set_window(self._offset, self._offset + 6)
+        self._walk_pending = True
+        if self._walk_task is None or self._walk_task.done():
+            self._walk_task = asyncio.ensure_future(self._walk())
+
+    async def on_walletset(self):
+        """ Called after the WalletSet has been polled and something changed. """
+        names = self._walletset.get_names()
+        if self._wallet not in names:
+            self._wallet = names[0] if names else None
+            self._selected, self._offset = 0, 0
+            self._utxo_mode = False
+
+        if self._utxo_mode:
+            self._simulate()
+        elif self._visible:
+            self._schedule_walk()
+        await self._draw_if_visible()
 
-        if self._selected_tx[0] == self._tx_offset[0] + 5:
-            self._tx_offset = (self._tx_offset[0] + 1, self._tx_offset[1])
+    async def _switch_wallet(self, delta):
+        names = self._walletset.get_names()
+        if len(names) < 2:
+            return
 
-        self._selected_tx = (self._selected_tx[0] + 1, self._selected_tx[1])
+        self._wallet = names[(names.index(self._wallet) + delta) % len(names)]
+        self._selected, self._offset = 0, 0
+        self._edit_mode = False
 
+        if self._utxo_mode:
+            self._schedule_utxos()
+        else:
+            self._schedule_walk()
         await self._draw_if_visible()
 
-    async def _enter_transaction_view(self):
-        """
-        if self._hash is None:
-            return # Can't do anything
+    async def _load_utxos(self, store):
+        await store.load_utxos()
+        self._simulate()
+        await self._draw_if_visible()
 
-        if self._selected_tx == None or self._selected_tx[1] != self._hash:
-            return # Can't do anything
+    def _schedule_utxos(self):
+        store = self._get_store()
+        self._simulation = None
+        if store.get_utxos().is_loaded():
+            self._simulate()
+        elif not store.get_utxos().is_loading():
+            # listunspent on a big wallet takes a while.
+            asyncio.ensure_future(self._load_utxos(store))
+
+    def _simulate(self):
+        utxos = self._get_store().get_utxos()
+        if self._target is not None and utxos.is_loaded():
+            self._simulation = utxos.simulate(self._target)
+
+    async def _toggle_utxo_mode(self):
+        self._utxo_mode = not self._utxo_mode
+        self._edit_mode = False
+        if self._utxo_mode:
+            self._schedule_utxos()
+        else:
+            self._schedule_walk()
 
-        if self._tx_offset == None or self._tx_offset[1] != self._hash:
-            return # This shouldn't matter, but skip anyway
-        """
+        await self._draw_if_visible()
+
+    async def _move(self, delta):
+        self._selected = max(0, min(self._selected + delta, len(self._get_store()) - 1))
+        if self._selected < self._offset:
+            self._offset = self._selected
+        elif self._selected > self._offset + 5:
+            self._offset = self._selected - 5
+
+        self._schedule_walk()
+        await self._draw_if_visible()
 
-        if self._selected_tx == None:
+    async def _enter_transaction_view(self):
+        store = self._get_store()
+        if store is None or not len(store):
             return # Can't do anything
 
-        txid = self._wallet["transactions"][self._selected_tx[0]]["txid"]
+        txid = store.get_transaction(self._selected)["txid"]
 
         await self._txidsetter(txid)
         await self._modesetter("transaction")
 
+    async def _submit_target(self):
+        try:
+            target = float(self._edit_buffer)
+        except ValueError:
+            return
+
+        self._target = int(round(target * 100000000)) if target > 0 else None
+        self._simulation = None
+        self._simulate()
+
+    async def _handle_edit_keypress(self, key):
+        if (len(key) == 1 and ord(key) == 127) or key == "KEY_BACKSPACE":
+            self._edit_buffer = self._edit_buffer[:-1]
+        elif key == "KEY_RETURN" or key == "\n":
+            self._edit_mode = False
+            if self._utxo_mode:
+                await self._submit_target()
+                return
+        elif len(key) == 1:
+            if len(self._edit_buffer) < 40:
+                self._edit_buffer += key
+        else:
+            return
+
+        if self._utxo_mode:
+            return
+
+        # Filter as you type, from the index.
+        self._get_store().set_filter(self._edit_buffer)
+        self._selected, self._offset = 0, 0
+        self._schedule_walk()
+
     async def handle_keypress(self, key):
         assert self._visible
 
-        if key == "KEY_UP":
-            await self._select_previous_transaction()
+        if self._get_store() is None:
+            return key
+
+        if self._edit_mode:
+            await self._handle_edit_keypress(key)
+            await self._draw_if_visible()
+            return None
+
+        if key in ("[", "]"):
+            await self._switch_wallet(-1 if key == "[" else 1)
+            return None
+
+        if key.lower() == "u":
+            await self._toggle_utxo_mode()
             return None
 
-        if key == "KEY_DOWN":
-            await self._select_next_transaction()
+        if self._utxo_mode:
+            if key == "/":
+                self._edit_mode = True
+                self._edit_buffer = ""
+                await self._draw_if_visible()
+                return None
+
+            return key
+
+        moves = {
+            "KEY_UP": -1,
+            "KEY_DOWN": 1,
+            "KEY_PPAGE": -6,
+            "KEY_NPAGE": 6,
+        }
+        if key in moves:
+            await self._move(moves[key])
             return None
 
         if key == "KEY_RETURN" or key == "\n":
             await self._enter_transaction_view()
             return None
 
+        if key == "/":
+            self._edit_mode = True
+            self._edit_buffer = self._get_store().get_filter()
+            await self._draw_if_visible()
+            return None
+
         return key
+
+    async def on_mode_change(self, newmode):
+        """ Overrides view.View to leave the filter prompt. """
+        if newmode != self._mode_name:
+            self._edit_mode = False
+            self._visible = False
+            return
+
+        # Nothing is loaded until the view has been shown once.
+        self._visible = True
+        if not self._utxo_mode:
+            self._schedule_walk()
+        await self._draw_if_visible()